@@ -7,6 +7,16 @@ assets_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
 PyInstaller.__main__.run([
     '--name=epic_multiplayer',
     '--onefile',
+    '--paths=.',
+    '--hidden-import=shared.protocol',
+    '--hidden-import=shared.framing',
+    '--hidden-import=shared.mapchunks',
+    '--hidden-import=shared.datagram',
+    '--hidden-import=shared.clock',
+    '--hidden-import=shared.content',
+    '--hidden-import=networking.sender',
+    '--hidden-import=networking.udp',
+    '--hidden-import=networking.interpolation',
     '--hidden-import=render.renderer',
     '--hidden-import=loader.content',
     '--hidden-import=arcade',
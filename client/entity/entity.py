@@ -16,6 +16,7 @@ class Entity:
         self.draw = True
         self.inventory_id = None
         self.should_update = True
+        self.remote = False  # True for entities created from server snapshots
 
     def set_position(self, x, y):
         self.x = x
@@ -1,8 +1,15 @@
 import arcade
+import math
+from collections import deque
 from entity.entity import Entity
 from render.renderer import TILE_SIZE
 from loader.content import get_object_properties as get_content
-from networking.main import get_tile_map, entities
+from networking.main import get_map_chunks, get_input_ack, entities
+
+# Predicted inputs kept for replay; older ones are forgotten if the server stops answering
+MAX_PENDING_INPUTS = 256
+# Server positions closer than this (in tiles) to our prediction are not corrected
+RECONCILE_EPSILON = 0.01
 
 class Player:
     def __init__(self):
@@ -13,6 +20,21 @@ class Player:
         self.speed = 250
         self.keys = {'W': False, 'A': False, 'S': False, 'D': False}
         self.wall_list = arcade.SpriteList()
+        self.chunk_walls = {}  # map chunk -> its wall sprites in wall_list
+        self.walls_built = False
+        # Client-side prediction: every frame with movement keys held is one numbered input,
+        # applied locally at once and kept as [seq, keys, delta_time, x, y] until the server
+        # reports the position it ended up at (see reconcile).
+        self.input_seq = 0
+        self.pending_inputs = deque(maxlen=MAX_PENDING_INPUTS)
+        self.last_input = None  # (seq, x, y) of the newest input, read by the network thread
+        self.acked_input = 0
+        # Metrics
+        self.corrections = 0
+        self.replayed_inputs = 0
+        self.last_correction = 0.0  # tiles
+        self.max_correction = 0.0
+        self.total_correction = 0.0
 
     def get_position(self):
         return self.x, self.y
@@ -22,7 +44,7 @@ class Player:
         if self.entity: return True
         
         for entity in entities.values():
-            if entity.proto == 'player' and entity.sprite:
+            if entity.proto == 'player' and not entity.remote and entity.sprite:
                 self.entity = entity
                 print("✅ Player entity linked!")
                 return True
@@ -31,14 +53,10 @@ class Player:
     def build_static_wall_list(self):
         print("Player: Building static wall list...")
         self.wall_list = arcade.SpriteList()
-        
-        all_tiles = get_tile_map().get('layout', {}).get('tiles', [])
-        for tile in all_tiles:
-            tile_props = get_content(tile.get('tile'))
-            if tile_props and tile_props.get('wall', False):
-                wall = arcade.SpriteSolidColor(int(TILE_SIZE), int(TILE_SIZE), arcade.color.RED)
-                wall.position = (tile['x'] * TILE_SIZE + TILE_SIZE / 2, tile['y'] * TILE_SIZE + TILE_SIZE / 2)
-                self.wall_list.append(wall)
+        self.chunk_walls.clear()
+
+        for chunk, tiles in get_map_chunks().items():
+            self.add_chunk_walls(chunk, tiles)
 
         if entities:
             for entity in entities.values():
@@ -48,6 +66,32 @@ class Player:
                     self.wall_list.append(entity.sprite)
         
         print(f"Player: Wall list created with {len(self.wall_list)} objects.")
+        self.walls_built = True
+
+    def add_chunk_walls(self, chunk, tiles):
+        for wall in self.chunk_walls.pop(chunk, ()):
+            wall.remove_from_sprite_lists()
+        walls = []
+        for tile in tiles:
+            tile_props = get_content(tile.get('tile'))
+            if tile_props and tile_props.get('wall', False):
+                wall = arcade.SpriteSolidColor(int(TILE_SIZE), int(TILE_SIZE), arcade.color.RED)
+                wall.position = (tile['x'] * TILE_SIZE + TILE_SIZE / 2, tile['y'] * TILE_SIZE + TILE_SIZE / 2)
+                walls.append(wall)
+        self.wall_list.extend(walls)
+        self.chunk_walls[chunk] = walls
+
+    def update_walls(self, added, removed):
+        """Add the walls of newly loaded map chunks and drop those of unloaded ones."""
+        if not self.walls_built:
+            return  # build_static_wall_list picks up every loaded chunk
+        map_chunks = get_map_chunks()
+        for chunk in added:
+            if chunk in map_chunks:
+                self.add_chunk_walls(chunk, map_chunks[chunk])
+        for chunk in removed:
+            for wall in self.chunk_walls.pop(chunk, ()):
+                wall.remove_from_sprite_lists()
 
     def on_key_press_player(self, symbol, modifiers):
         if symbol == arcade.key.F7:
@@ -68,9 +112,10 @@ class Player:
     def on_update(self, delta_time: float):
         if not self.try_link_entity(): return
         
-        if not self.wall_list:
+        if not self.walls_built:
             self.build_static_wall_list()
 
+        self.reconcile()
         self.process_movement(delta_time)
 
         # After all physics, update the read-only coordinates
@@ -78,11 +123,25 @@ class Player:
         self.y = self.entity.sprite.center_y
     def process_movement(self, delta_time: float):
         if not self.entity or not self.entity.sprite: return
-        vx = 0; vy = 0 
-        if self.keys['W']: vy += self.speed
-        if self.keys['S']: vy -= self.speed
-        if self.keys['A']: vx -= self.speed
-        if self.keys['D']: vx += self.speed
+        keys = (self.keys['W'], self.keys['A'], self.keys['S'], self.keys['D'])
+        if not any(keys):
+            # Nothing to predict; keep the grid coordinates in step with the sprite
+            self.entity.x = self.entity.sprite.center_x / TILE_SIZE
+            self.entity.y = self.entity.sprite.center_y / TILE_SIZE
+            return
+        self.input_seq += 1
+        self.move(keys, delta_time)
+        self.pending_inputs.append([self.input_seq, keys, delta_time, self.entity.x, self.entity.y])
+        self.last_input = (self.input_seq, self.entity.x, self.entity.y)
+
+    def move(self, keys, delta_time: float):
+        """Apply one input (W, A, S, D held) with wall collision. Also used to replay inputs."""
+        up, left, down, right = keys
+        vx = 0; vy = 0
+        if up: vy += self.speed
+        if down: vy -= self.speed
+        if left: vx -= self.speed
+        if right: vx += self.speed
         if vx != 0 and vy != 0:
             vx *= 0.7071; vy *= 0.7071
         
@@ -99,4 +158,50 @@ class Player:
 
         # Sync the entity's grid coordinates from the sprite's final position
         self.entity.x = self.entity.sprite.center_x / TILE_SIZE
-        self.entity.y = self.entity.sprite.center_y / TILE_SIZE
\ No newline at end of file
+        self.entity.y = self.entity.sprite.center_y / TILE_SIZE
+
+    def reconcile(self):
+        """Check our prediction against the newest position the server applied.
+
+        Inputs the server has seen are dropped. If its position for the acknowledged input
+        differs from what we predicted, we move there and replay the inputs it has not seen yet.
+        """
+        ack = get_input_ack()
+        if ack is None or ack[0] <= self.acked_input or not self.entity or not self.entity.sprite:
+            return
+        seq, x, y = ack
+        self.acked_input = seq
+        predicted = None
+        while self.pending_inputs and self.pending_inputs[0][0] <= seq:
+            predicted = self.pending_inputs.popleft()
+        if predicted is None or predicted[0] != seq:
+            return  # not one of ours any more (reconnected, or history overflowed)
+        error = math.hypot(predicted[3] - x, predicted[4] - y)
+        if error <= RECONCILE_EPSILON:
+            return
+
+        self.corrections += 1
+        self.last_correction = error
+        self.max_correction = max(self.max_correction, error)
+        self.total_correction += error
+        self.entity.sprite.center_x = x * TILE_SIZE
+        self.entity.sprite.center_y = y * TILE_SIZE
+        self.entity.x, self.entity.y = x, y
+        for command in self.pending_inputs:
+            self.move(command[1], command[2])
+            command[3], command[4] = self.entity.x, self.entity.y
+        self.replayed_inputs += len(self.pending_inputs)
+        self.last_input = (self.pending_inputs[-1][0] if self.pending_inputs else seq, self.entity.x, self.entity.y)
+
+    def prediction_stats(self) -> dict:
+        """Reconciliation metrics; errors are in tiles."""
+        return {
+            'input_seq': self.input_seq,
+            'acked_input': self.acked_input,
+            'pending_inputs': len(self.pending_inputs),
+            'corrections': self.corrections,
+            'replayed_inputs': self.replayed_inputs,
+            'last_error': self.last_correction,
+            'max_error': self.max_correction,
+            'avg_error': self.total_correction / self.corrections if self.corrections else 0.0,
+        }
@@ -2,12 +2,16 @@ import arcade
 from arcade.camera import Camera2D
 import arcade.gui
 import os
+import sys
 import time
 import threading
 
-from networking.main import start_client, entities
+# shared/ (wire protocol used by client and server) lives at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from networking.main import start_client, entities, apply_snapshots, sync_map_chunks
 from loader.content import load_content, get_object_properties
-from render.renderer import draw, draw_map, initialize_renderer, active_sprites
+from render.renderer import draw, draw_map, initialize_renderer, init_map, unload_map, active_sprites
 from game.player import Player
 from game.inventory import Inventory
 from game.music import MusicPlayer
@@ -40,19 +44,20 @@ class GameWindow(arcade.Window):
         self.network_thread.start()
 
         # Test Entity for offline development
+        # Local-only entities use negative ids so they never collide with server ids.
         if not any(e.proto == 'player' for e in entities.values()):
-            ent = Entity(id=1, proto="player", x=0, y=0)
+            ent = Entity(id=-1, proto="player", x=0, y=0)
             entities[ent.id] = ent
-        item1 = Entity(id=2, proto="cheese", x=10, y=0)
+        item1 = Entity(id=-2, proto="cheese", x=10, y=0)
         entities[item1.id] = item1
         self.inventory.add_item(item1)
-        item1 = Entity(id=3, proto="cheese", x=10, y=2)
+        item1 = Entity(id=-3, proto="cheese", x=10, y=2)
         entities[item1.id] = item1
         self.inventory.add_item(item1)
-        item1 = Entity(id=4, proto="dirt", x=10, y=0)
+        item1 = Entity(id=-4, proto="dirt", x=10, y=0)
         entities[item1.id] = item1
         self.inventory.add_item(item1)
-        item1 = Entity(id=5, proto="dirt", x=10, y=2)
+        item1 = Entity(id=-5, proto="dirt", x=10, y=2)
         entities[item1.id] = item1
         self.inventory.add_item(item1)
         self.music_player.load_song()
@@ -72,6 +77,14 @@ class GameWindow(arcade.Window):
         self.ui_manager.draw()    
     def on_update(self, delta_time: float):
         initialize_renderer()
+        apply_snapshots()
+
+        # Stream map chunks around the player in, and far ones out
+        entity = self.player.entity
+        added, removed = sync_map_chunks((entity.x, entity.y) if entity else None)
+        init_map(added)
+        unload_map(removed)
+        self.player.update_walls(added, removed)
         
         self.player.on_update(delta_time)
         update_entities()
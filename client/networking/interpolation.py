@@ -0,0 +1,154 @@
+"""
+Snapshot interpolation for remote entities.
+
+Snapshots arrive at the server's tick rate, which is slower and less even than the frame
+rate. Every remote entity keeps its last few positions, stamped with the time the snapshot
+carrying them was received. It is drawn `delay` seconds in the past, between the two
+samples around that time, so it moves smoothly instead of jumping once per tick.
+
+A delta snapshot leaves out entities that did not move, so an entity whose newest sample is
+older than the newest snapshot is simply standing still and is held there. Only when no
+snapshot at all has arrived since its newest sample (loss, or a late packet) is it
+extrapolated along its last velocity, for at most `max_extrapolation` seconds.
+
+Samples live in flat `array('d')` columns indexed by slot, SAMPLES per entity, and slots of
+removed entities are reused, so thousands of entities cost a few float arrays instead of
+objects per sample.
+"""
+from array import array
+
+# Samples kept per entity; enough to cover the delay at tick rates down to ~10 Hz
+SAMPLES = 4
+# Shortest render delay in seconds; it grows to two snapshot intervals at low tick rates
+MIN_DELAY = 0.1
+MAX_EXTRAPOLATION = 0.25
+
+class InterpolationBuffer:
+    """Time-stamped position samples of remote entities, sampled once per frame."""
+
+    def __init__(self, capacity: int = 256, min_delay: float = MIN_DELAY, max_extrapolation: float = MAX_EXTRAPOLATION):
+        self.min_delay = min_delay
+        self.delay = min_delay
+        self.max_extrapolation = max_extrapolation
+        self.slots = {}  # entity id -> slot
+        self._free = []
+        self._capacity = 0
+        self._times = array('d')
+        self._xs = array('d')
+        self._ys = array('d')
+        self._rots = array('d')
+        self._head = array('B')   # per slot: ring index of its newest sample
+        self._count = array('B')  # per slot: samples stored
+        # Newest snapshot received, and the smoothed time between snapshots
+        self.latest = 0.0
+        self.interval = 0.0
+        # Metrics
+        self.extrapolated = 0  # samples that ran past the newest snapshot
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.slots
+
+    def advance(self, received: float) -> None:
+        """Record that a snapshot received at `received` was applied, moved or not."""
+        if self.latest:
+            gap = received - self.latest
+            if gap > 0:
+                self.interval = gap if not self.interval else self.interval * 0.9 + gap * 0.1
+                self.delay = max(self.min_delay, 2 * self.interval)
+        self.latest = max(self.latest, received)
+
+    def push(self, entity_id, received: float, x: float, y: float, rot: float) -> None:
+        """Add an entity's position from a snapshot received at `received`."""
+        slot = self.slots.get(entity_id)
+        if slot is None:
+            slot = self._allocate(entity_id)
+        base = slot * SAMPLES
+        head = self._head[slot]
+        if self._count[slot] and received <= self._times[base + head]:
+            index = base + head  # same snapshot time: the newer value wins
+        else:
+            head = (head + 1) % SAMPLES if self._count[slot] else 0
+            self._head[slot] = head
+            self._count[slot] = min(SAMPLES, self._count[slot] + 1)
+            index = base + head
+        self._times[index] = received
+        self._xs[index] = x
+        self._ys[index] = y
+        self._rots[index] = rot
+
+    def remove(self, entity_id) -> None:
+        slot = self.slots.pop(entity_id, None)
+        if slot is not None:
+            self._count[slot] = 0
+            self._free.append(slot)
+
+    def clear(self) -> None:
+        for entity_id in list(self.slots):
+            self.remove(entity_id)
+        self.latest = 0.0
+        self.interval = 0.0
+        self.delay = self.min_delay
+
+    def sample(self, entity_id, now: float):
+        """(x, y, rot) to draw the entity at for a frame at `now`, or None if it has no samples."""
+        slot = self.slots.get(entity_id)
+        if slot is None:
+            return None
+        count = self._count[slot]
+        base = slot * SAMPLES
+        head = self._head[slot]
+        times = self._times
+        newest = base + head
+        t = now - self.delay
+
+        if t >= times[newest] or count == 1:
+            if count == 1 or self.latest > times[newest]:
+                # Not in any newer snapshot, so it has not moved since
+                return self._xs[newest], self._ys[newest], self._rots[newest]
+            previous = base + (head - 1) % SAMPLES
+            span = times[newest] - times[previous]
+            ahead = min(t - times[newest], self.max_extrapolation)
+            self.extrapolated += 1
+            if span <= 0:
+                return self._xs[newest], self._ys[newest], self._rots[newest]
+            f = 1.0 + ahead / span
+            return self._lerp(previous, newest, f)
+
+        # Newest sample at or before t, and the one after it
+        later = newest
+        for k in range(1, count):
+            index = base + (head - k) % SAMPLES
+            if times[index] <= t:
+                span = times[later] - times[index]
+                return self._lerp(index, later, (t - times[index]) / span if span > 0 else 1.0)
+            later = index
+        # Older than everything we kept: draw the oldest sample
+        return self._xs[later], self._ys[later], self._rots[later]
+
+    def _lerp(self, a: int, b: int, f: float) -> tuple:
+        xs, ys, rots = self._xs, self._ys, self._rots
+        turn = (rots[b] - rots[a] + 180.0) % 360.0 - 180.0  # shortest way round
+        return xs[a] + (xs[b] - xs[a]) * f, ys[a] + (ys[b] - ys[a]) * f, rots[a] + turn * f
+
+    def _grow(self, slots: int) -> None:
+        # Lowest slots are handed out first, so live samples stay near the front of the columns
+        self._free.extend(range(self._capacity + slots - 1, self._capacity - 1, -1))
+        self._capacity += slots
+        zeros = array('d', bytes(8 * slots * SAMPLES))
+        for column in (self._times, self._xs, self._ys, self._rots):
+            column.extend(zeros)
+        self._head.extend(bytes(slots))
+        self._count.extend(bytes(slots))
+
+    def _allocate(self, entity_id) -> int:
+        if not self._free:
+            self._grow(max(self._capacity, 16))
+        slot = self._free.pop()
+        self.slots[entity_id] = slot
+        self._head[slot] = 0
+        self._count[slot] = 0
+        return slot
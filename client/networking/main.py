@@ -1,61 +1,322 @@
 import socket
 import threading
-import json
+import time
+from collections import deque
+from shared.clock import LinkEstimator, ping_message, pong_message
+from shared.framing import FrameDecoder
+from shared.mapchunks import chunk_of, chunks_around
+from shared.protocol import decode, encode, encode_payload, wants_binary, PROTOCOL_VERSION
+from networking.sender import SendScheduler
+from networking.udp import DatagramLink
+from networking.interpolation import InterpolationBuffer
 
 isConnectedToServer = False
+# Map outline from the server's 'map' response: name, chunk_size, bounds (in chunks)
 tile_map = {}
+# Where the server placed our player, in tiles, from the 'joined' response
+spawn = (0, 0)
+# Chunks around the player that are kept loaded; farther ones are unloaded with one chunk of slack
+MAP_VIEW_RADIUS = 2
+# (cx, cy) -> tiles of each loaded map chunk. Only touched on the game thread, by sync_map_chunks().
+map_chunks = {}
+# Chunk messages received on the network thread; None marks a new map outline
+pending_chunks = deque()
+_requested_chunks = set()
+_map_center = None
 entities = {}
+# Id of our own player entity on the server, set by the 'joined' response
+player_id = None
+# World snapshots received on the network thread, applied on the game thread by apply_snapshots()
+pending_snapshots = deque()
+# Recent positions of remote entities; the renderer draws them slightly in the past from here
+interpolation = InterpolationBuffer()
+# Newest snapshot applied; acknowledged to the server by the send scheduler
+last_snapshot_tick = None
+# Newest (input seq, x, y) the server applied to our player, from snapshots; see Player.reconcile()
+input_ack = None
+# True once the server accepted the binary protocol in its 'joined' reply
+binary = False
+joined_event = threading.Event()
+# Paces outgoing messages once connected; other modules can queue() one-off messages on it
+scheduler = None
+# UDP side channel offered in the 'joined' reply ({'port', 'token'}), and our end of it once bound
+udp_offer = None
+udp_link = None
+# Session token from the 'joined' reply, presented when reconnecting to resume where we left off
+session = None
+# Seconds to wait before each reconnect attempt after losing the connection; then we give up
+RECONNECT_DELAYS = (0.5, 1, 2, 4)
+# Round trip time, jitter and server clock offset of the current connection, from our pings
+link = LinkEstimator()
 
 
+def handle_message(message):
+    global tile_map
+    global player_id
+    global binary
+    global spawn
+    global udp_offer
+    global session
+    global last_snapshot_tick
+    if message['type'] == 'response':
+        if message['data']['type'] == 'joined':
+            player_id = message['data']['data']['id']
+            spawn = tuple(message['data']['data'].get('spawn', (0, 0)))
+            udp_offer = message['data']['data'].get('udp')
+            session = message['data']['data'].get('session')
+            if not message['data']['data'].get('resumed'):
+                # A fresh session (or another server) starts with a full snapshot and its own ticks
+                last_snapshot_tick = None
+            binary = wants_binary(message)
+            joined_event.set()
+        elif message['data']['type'] == 'entities':
+            # Full entity dump: same shape as a full snapshot without a tick
+            pending_snapshots.append({'tick': None, 'base': None, 'entities': list(message['data']['data'].values()),
+                                      'received': time.perf_counter()})
+        elif message['data']['type'] == 'snapshot':
+            snapshot = message['data']['data']
+            # Stamped on arrival, not when the game thread gets to it, for interpolation
+            snapshot['received'] = time.perf_counter()
+            pending_snapshots.append(snapshot)
+        elif message['data']['type'] == 'map':
+            tile_map = message['data']['data']
+            pending_chunks.append(None)
+        elif message['data']['type'] == 'chunk':
+            pending_chunks.append(message['data']['data'])
+    elif message['type'] == 'ping':
+        # Answered right away instead of with the next batch, which would add to the server's sample
+        if scheduler is not None:
+            scheduler.send_now(pong_message(message['data']['data']['t']))
+    elif message['type'] == 'pong':
+        pong = message['data']['data']
+        link.pong(pong['t'], pong['clock'])
 
 def receive_messages(sock):
-    global tile_map
-    global entities
-    while True:
-        try:
-            data = sock.recv(65536)
-            if not data:
+    # Reads go straight into the decoder's buffer; a map payload split over many reads,
+    # or several messages in one read, both come out as whole frames.
+    decoder = FrameDecoder(initial_size=65536)
+    try:
+        while True:
+            received = sock.recv_into(decoder.writable())
+            if not received:
                 print("Disconnected from server")
                 break
-            #print(f"Received: {data.decode()}")
-            message = json.loads(data.decode())
-            if message['type'] == 'response':
-                if message['data']['type'] == 'entities':
-                    entities = message['data']['data']
-                    #print(f"recieved entities {entities}")
-                    pass
-                elif message['data']['type'] == 'map':
-                    tile_map = message['data']['data']
-                    #print(f"recieved map {tile_map}")
-                    pass
-            
-        except ConnectionError:
-            print("Connection lost")
-            break
+            decoder.commit(received)
+            for payload in decoder.frames():
+                handle_message(decode(payload))
+    except ValueError as e:
+        print(f"Malformed message from server ({e})")
+    except OSError:
+        # Also what a read gets once the socket was closed under it
+        print("Connection lost")
+    finally:
+        if scheduler is not None:
+            scheduler.stop()  # ends start_client's send loop, which may then reconnect
+
+def apply_snapshots():
+    """Apply received snapshots, oldest first, to `entities`. Must run on the game thread."""
+    global last_snapshot_tick
+    global input_ack
+    from entity.entity import Entity  # entity.entity imports this module
+
+    # Our own entity was created locally before joining; move it under the server id.
+    local_player = next((e for e in entities.values() if e.proto == 'player' and not e.remote), None)
+    if player_id is not None and local_player and local_player.id != player_id:
+        del entities[local_player.id]
+        local_player.id = player_id
+        entities[player_id] = local_player
+
+    while pending_snapshots:
+        snapshot = pending_snapshots.popleft()
+        if snapshot.get('tick') is not None and last_snapshot_tick is not None and snapshot['tick'] <= last_snapshot_tick:
+            # Snapshots come over TCP and UDP, so an older one can arrive after a newer one.
+            continue
+        full = snapshot.get('base') is None
+        received = snapshot.get('received', time.perf_counter())
+        seen = set()
+        for state in snapshot['entities']:
+            entity_id = state['id']
+            seen.add(entity_id)
+            if entity_id == player_id:
+                continue  # driven by local input
+            entity = entities.get(entity_id)
+            if entity is None:
+                if 'proto' not in state:
+                    continue  # partial update for an entity we never had
+                entity = Entity(id=entity_id, x=state['x'], y=state['y'], rot=state['rot'], proto=state['proto'])
+                entity.remote = True
+                entities[entity_id] = entity
+            elif entity.remote:
+                entity.set_position(state.get('x', entity.x), state.get('y', entity.y))
+                entity.rot = state.get('rot', entity.rot)
+            else:
+                continue
+            interpolation.push(entity_id, received, entity.x, entity.y, entity.rot)
+
+        if full:
+            removed = [i for i, e in entities.items() if e.remote and i not in seen]
+        else:
+            removed = snapshot['removed']
+        for entity_id in removed:
+            entity = entities.get(entity_id)
+            if entity is not None and entity.remote:
+                del entities[entity_id]
+                interpolation.remove(entity_id)
+
+        interpolation.advance(received)
+        if snapshot.get('input') is not None:
+            input_ack = tuple(snapshot['input'])
+        if snapshot.get('tick') is not None:
+            last_snapshot_tick = snapshot['tick']
+
+def sync_map_chunks(position=None) -> tuple:
+    """Load the chunks that arrived and request or unload chunks around `position` (in tiles).
+
+    Without a position our spawn point is used. Returns (added, removed) chunk
+    coordinates; apply the added ones before the removed ones. Call on the game thread.
+    """
+    global _map_center
+    added, removed = [], []
+    while pending_chunks:
+        chunk = pending_chunks.popleft()
+        if chunk is None:
+            # New map outline (e.g. after reconnecting): everything loaded so far is stale.
+            removed.extend(map_chunks)
+            added.clear()
+            map_chunks.clear()
+            _requested_chunks.clear()
+            _map_center = None
+            continue
+        key = (chunk['x'], chunk['y'])
+        if key in _requested_chunks:  # otherwise it was unloaded again while in flight
+            map_chunks[key] = chunk['tiles']
+            added.append(key)
+    if not tile_map or scheduler is None:
+        return added, removed
+
+    x, y = position if position is not None else spawn
+    center = chunk_of(x, y, tile_map['chunk_size'])
+    if center != _map_center:
+        _map_center = center
+        missing = [c for c in chunks_around(center, MAP_VIEW_RADIUS, tile_map['bounds']) if c not in _requested_chunks]
+        if missing:
+            # Nearest first, so the ground under the player is built before the edges
+            _requested_chunks.update(missing)
+            scheduler.queue({'type': 'get', 'data': {'type': 'chunks', 'data': {'chunks': [list(c) for c in missing]}}})
+        for key in list(_requested_chunks):
+            if max(abs(key[0] - center[0]), abs(key[1] - center[1])) > MAP_VIEW_RADIUS + 1:
+                _requested_chunks.discard(key)
+                if map_chunks.pop(key, None) is not None:
+                    removed.append(key)
+    return added, removed
 
 def get_tile_map():
     return tile_map
 
+def get_map_chunks():
+    return map_chunks
+
 def get_entities():
     return entities
 
+def get_player_id():
+    return player_id
+
+def get_input_ack():
+    return input_ack
+
+def get_rtt():
+    """Smoothed round trip time to the server in seconds, None until measured"""
+    return link.rtt
+
+def get_link_stats() -> dict:
+    """RTT, jitter and server clock offset in milliseconds (see shared/clock.py)"""
+    return link.to_dict()
+
+def server_time() -> float:
+    """The server's clock now, estimated from our clock (time.perf_counter) and the measured offset"""
+    return link.remote_time()
+
 
-def send_messages(socket: socket.socket,player):
-    s = socket
+def send(sock: socket.socket, message: dict):
+    """Send one message, encoded with the protocol negotiated at join"""
+    sock.sendall(encode(message, binary))
+
+def send_messages(scheduler: SendScheduler, player):
+    """Refresh the scheduler's state slots; it sends them only when they changed. Pings once a second."""
+    if link.ping_due():
+        scheduler.queue(ping_message())  # goes out in the flush right after this
+    if last_snapshot_tick is not None:
+        scheduler.set_state('ack', {"type": "ack", "data": {"type": "snapshot", "data": {"tick": last_snapshot_tick}}})
+    if player.entity is None:
+        return
+    # Positions on the wire are in tiles, like Entity.x / Entity.y. The input sequence number
+    # tells the server which of our predicted moves the position includes.
+    seq, x, y = player.last_input if player.last_input is not None else (None, player.entity.x, player.entity.y)
     message = {
         "type": "update",
         "data": {
             "type": "player",
             "data": {
-                "x": player.x,
-                "y": player.y
+                "x": x,
+                "y": y
             }
         }
     }
-    s.sendall((json.dumps(message) + '\n').encode())  # Convert entire message to JSON once
-def start_client(player, host='127.0.0.1', port=5555):
+    if seq is not None:
+        message['data']['data']['seq'] = seq
+    scheduler.set_state('position', message)
+
+def bind_udp(host: str, offer: dict) -> None:
+    """Open the UDP side channel and move the scheduler's state slots onto it once it works."""
+    global udp_link
+    link = DatagramLink(host, offer['port'], offer['token'], handle_message)
+    if not link.bind():
+        print("UDP side channel unreachable, staying on TCP")
+        link.close()
+        return
+    udp_link = link
+    scheduler.datagram = lambda message: link.send(encode_payload(message, binary))
+    print(f"UDP side channel bound to {host}:{offer['port']}")
+
+def start_client(player, host='127.0.0.1', port=5555, protocol='binary', send_rate=30.0, compression=True, udp=True,
+                 reconnect=True):
+    """Connect, join and send input until the connection ends.
+
+    With `reconnect`, a connection lost after joining is retried after each of RECONNECT_DELAYS
+    in turn. The join then presents our session token: a server that still holds the session
+    continues it with a snapshot delta, without sending the map and every entity again.
+    """
+    global session
+    session = None
+    delays = iter(())
+    while True:
+        if _connect(player, host, port, protocol, send_rate, compression, udp):
+            delays = iter(RECONNECT_DELAYS)
+        delay = next(delays, None) if reconnect else None
+        if delay is None:
+            return
+        print(f"Reconnecting in {delay} s")
+        time.sleep(delay)
+
+def _connect(player, host, port, protocol, send_rate, compression, udp) -> bool:
+    """One connection: join (resuming `session` if we have one) and run the send loop. True if it
+    joined and then lost the connection."""
     global isConnectedToServer
+    global binary
+    global scheduler
+    global udp_offer
+    global udp_link
+    global input_ack
+    global link
     isConnectedToServer = False
+    binary = False
+    input_ack = None
+    link = LinkEstimator()
+    udp_offer = None
+    udp_link = None
+    scheduler = None
+    joined_event.clear()
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         try:
             s.connect((host, port))
@@ -65,26 +326,50 @@ def start_client(player, host='127.0.0.1', port=5555):
             # Start receiving messages in a separate thread
             recv_thread = threading.Thread(target=receive_messages, args=(s,), daemon=True)
             recv_thread.start()
+            # Spawn where our player was if we had one (in tiles, as the server counts; player.x/y are pixels)
+            entity = player.entity
             message = {
                 "type": "join",
                 "data": {
                     "type": "player",
                     "data": {
-                        "x": player.x,
-                        "y": player.y
+                        "x": entity.x if entity is not None else 0,
+                        "y": entity.y if entity is not None else 0
                     }
                 }
             }
-            s.sendall((json.dumps(message) + '\n').encode())  # Convert entire message to JSON once
-            # Send messages from user input
-            while True:
-                send_messages(s,player)
+            if protocol == 'binary':
+                message.update(protocol='binary', version=PROTOCOL_VERSION)
+            if compression:
+                # The receive decoder inflates compressed frames by itself
+                message['compression'] = 'zlib'
+            if udp:
+                # Snapshots and movement go over UDP if the server offers it and datagrams get through
+                message['udp'] = True
+            if session is not None:
+                message['resume'] = session
+            send(s, message)  # always JSON: the handshake picks the protocol
+            # Wait for our player id; the reply also decides the encoding from here on.
+            if not joined_event.wait(timeout=10):
+                print("Server did not answer the join")
+                return False
+            # Send input at a fixed rate, only when it changed, with a heartbeat when idle
+            scheduler = SendScheduler(s, lambda message: encode(message, binary), rate=send_rate)
+            if udp_offer is not None:
+                threading.Thread(target=bind_udp, args=(host, udp_offer), daemon=True).start()
+            scheduler.run(lambda sched: send_messages(sched, player))
         except ConnectionRefusedError:
             print(f"Could not connect to {host}:{port}")
         except KeyboardInterrupt:
             print("\nDisconnecting...")
+            return False
         except Exception as e:
             print(f"Error: {e}")
+        finally:
+            isConnectedToServer = False
+            if udp_link is not None:
+                udp_link.close()
+    return joined_event.is_set()
 
 if __name__ == '__main__':
-    start_client()
\ No newline at end of file
+    start_client()
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import deque
+
+class SendScheduler:
+    """Paces everything the client sends to the server.
+
+    Continuously changing state such as our position goes into named slots with set_state() and is
+    only sent when it differs from what was last sent. One-off messages go through queue(), or
+    send_now() from any thread when waiting for the next batch would skew them (pong replies).
+    Every `1 / rate` seconds whatever is pending is encoded and written in a single sendall.
+    If nothing was sent for `heartbeat` seconds, the heartbeat slot is resent so the server
+    still hears from an idle client.
+
+    Once `datagram` is set (a callable taking one message, see networking.udp), state slots
+    are sent through it instead, one datagram each, and repeated on the next
+    `datagram_repeats` flushes after they stop changing. Queued messages always use the socket.
+    """
+
+    def __init__(self, sock, encode, rate: float = 30.0, heartbeat: float = 1.0, heartbeat_key: str = 'position'):
+        self.sock = sock
+        self.encode = encode
+        self.interval = 1.0 / rate
+        self.heartbeat = heartbeat
+        self.heartbeat_key = heartbeat_key
+        self._queue = deque()
+        self._state = {}
+        self._sent_state = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps send_now() frames from interleaving with a batch
+        self._last_send = time.monotonic()
+        self.running = False
+        self.datagram = None
+        self.datagram_repeats = 2
+        self._repeats = {}
+        # Counters for the debug overlay / tuning
+        self.datagrams_sent = 0
+        self.batches_sent = 0
+        self.messages_sent = 0
+        self.bytes_sent = 0
+
+    def queue(self, message: dict) -> None:
+        """Send a message with the next batch. Safe to call from any thread."""
+        self._queue.append(message)
+
+    def send_now(self, message: dict) -> None:
+        """Write one message immediately, bypassing the batch. Safe to call from any thread."""
+        data = self.encode(message)
+        with self._write_lock:
+            self.sock.sendall(data)
+        self.messages_sent += 1
+        self.bytes_sent += len(data)
+
+    def set_state(self, key: str, message: dict) -> None:
+        """Replace the latest value of a state slot; it is sent only if it changed."""
+        with self._lock:
+            self._state[key] = message
+
+    def flush(self) -> int:
+        """Write everything pending as one batch and return the number of bytes sent."""
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        states = []
+        now = time.monotonic()
+        datagram = self.datagram
+        with self._lock:
+            for key, message in self._state.items():
+                if self._sent_state.get(key) != message:
+                    states.append(message)
+                    self._sent_state[key] = message
+                    self._repeats[key] = self.datagram_repeats
+                elif datagram is not None and self._repeats.get(key):
+                    # A lost datagram is not resent, so a slot's final value goes out a few more times.
+                    states.append(message)
+                    self._repeats[key] -= 1
+            if not batch and not states and now - self._last_send >= self.heartbeat and self.heartbeat_key in self._state:
+                states.append(self._state[self.heartbeat_key])
+        if datagram is not None and states:
+            for message in states:
+                datagram(message)
+            self.datagrams_sent += len(states)
+            self._last_send = now
+        else:
+            batch.extend(states)
+        if not batch:
+            return 0
+        data = b''.join(self.encode(message) for message in batch)
+        with self._write_lock:
+            self.sock.sendall(data)
+        self._last_send = now
+        self.batches_sent += 1
+        self.messages_sent += len(batch)
+        self.bytes_sent += len(data)
+        return len(data)
+
+    def run(self, prepare) -> None:
+        """Call `prepare(self)` and flush once per interval until stop() is called."""
+        self.running = True
+        deadline = time.monotonic()
+        while self.running:
+            prepare(self)
+            self.flush()
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def stop(self) -> None:
+        self.running = False
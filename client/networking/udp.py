@@ -0,0 +1,74 @@
+import socket
+import threading
+from shared.datagram import DatagramError, SequenceFilter, pack_to_server, unpack_to_client
+from shared.protocol import decode
+
+class DatagramLink:
+    """Client end of the UDP side channel (see shared/datagram.py).
+
+    bind() sends bind datagrams until the server answers, which proves datagrams get
+    through both ways. Only then should position updates and acks be sent here; if UDP is
+    blocked they simply keep going over TCP. Messages that arrive are passed to `handle`
+    on the link's own thread, newest only.
+    """
+
+    def __init__(self, host: str, port: int, token: int, handle):
+        self.token = token
+        self.handle = handle
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((host, port))
+        self.bound = threading.Event()
+        self.received = SequenceFilter()
+        self.closed = False
+        self._seq = 0
+        self._lock = threading.Lock()
+        # Counters for the debug overlay / tuning
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+
+    def bind(self, timeout: float = 3.0, interval: float = 0.25) -> bool:
+        """Start receiving and wait until the server answers a bind. False if it never did."""
+        threading.Thread(target=self._receive, daemon=True).start()
+        attempts = max(1, int(timeout / interval))
+        for _ in range(attempts):
+            self.send(b'')
+            if self.bound.wait(interval):
+                return True
+        return False
+
+    def send(self, payload: bytes) -> None:
+        """Send one message payload (b'' is a bind); lost datagrams are not resent."""
+        with self._lock:
+            self._seq += 1
+            data = pack_to_server(self.token, self._seq, payload)
+        try:
+            self.sock.send(data)
+        except OSError:
+            return
+        self.datagrams_sent += 1
+        self.bytes_sent += len(data)
+
+    def close(self) -> None:
+        self.closed = True
+        self.sock.close()
+
+    def _receive(self) -> None:
+        while not self.closed:
+            try:
+                data = self.sock.recv(65535)
+            except OSError:
+                if self.closed:
+                    return
+                continue  # e.g. ICMP port unreachable before the server's socket was up
+            try:
+                seq, payload = unpack_to_client(data)
+            except DatagramError:
+                continue
+            if not self.received.accept(seq):
+                continue
+            self.bound.set()
+            if payload:
+                try:
+                    self.handle(decode(payload))
+                except ValueError as e:
+                    print(f"Dropping malformed datagram ({e})")
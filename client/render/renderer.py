@@ -2,9 +2,9 @@ import arcade
 import os
 import time
 from typing import Dict, List, Tuple, Set, Optional
-from loader.content import get_object_properties as get_content
+from loader.content import get_object_properties as get_content, get_objects_by_property
 from dataclasses import dataclass
-from networking.main import get_tile_map, entities
+from networking.main import get_map_chunks, entities, interpolation
 
 _debug_draw_hitboxes = False
 
@@ -21,6 +21,7 @@ _update_interval = 0.1  # Update viewport every 100ms
 loaded_textures: Dict[str, arcade.Texture] = {}
 active_sprites: arcade.SpriteList = arcade.SpriteList(use_spatial_hash=True)
 tile_sprites: Dict[Tuple[int, int], arcade.Sprite] = {}
+chunk_tiles: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}  # map chunk -> its keys in tile_sprites
 entity_sprites: Dict[str, arcade.Sprite] = {} # New: For storing entity sprites
 player_sprite: Optional[arcade.Sprite] = None
 unique_textures = set()
@@ -57,18 +58,10 @@ def preload_textures() -> None:
     unique_textures.add("ui/trans1.png")
     unique_textures.add("ui/trans1024.png")
     
-    # Get all unique tile textures if map is available
-    tile_map = get_tile_map()
-    if 'layout' in tile_map and 'tiles' in tile_map['layout']:
-        for tile in tile_map['layout']['tiles']:
-            try:
-                tile_props = get_content(tile['tile'])
-                if tile_props and 'texture' in tile_props:
-                    unique_textures.add(tile_props["texture"])
-            except (KeyError, TypeError):
-                continue
-    else:
-        print('skill issue')
+    # Every tile texture, since map chunks arrive after this runs
+    for tile_props in get_objects_by_property('type', 'tile'):
+        if 'texture' in tile_props:
+            unique_textures.add(tile_props["texture"])
 
     # Get all unique entity textures
     if entities:
@@ -96,49 +89,96 @@ def preload_textures() -> None:
             except (FileNotFoundError, arcade.resources.resource.ResourceError):
                 print(f"Warning: Could not load texture: {texture_name}")
 
-def init_map() -> None:
-    """Initialize the map and create all tile sprites."""
-    global tile_sprites
+def init_map(chunks: Optional[List[Tuple[int, int]]] = None) -> None:
+    """Create tile sprites for map chunks as they arrive.
+
+    `chunks` are chunk coordinates from networking.sync_map_chunks(); None builds every
+    chunk loaded so far. Rebuilding a chunk replaces its sprites.
+    """
+    global _last_viewport
+
+    map_chunks = get_map_chunks()
+    if chunks is None:
+        chunks = list(map_chunks)
+    if not chunks:
+        return
+
+    for chunk in chunks:
+        tiles = map_chunks.get(chunk)
+        if tiles is None:
+            continue
+        unload_map([chunk])
+        keys = []
+        for tile in tiles:
+            try:
+                tile_name = tile.get('tile')
+                if not tile_name:
+                    continue
+
+                tile_props = get_content(tile_name)
+                if not tile_props or 'texture' not in tile_props:
+                    continue
+
+                texture_name = tile_props["texture"]
+                if texture_name not in loaded_textures:
+                    continue
+
+                texture = loaded_textures[texture_name]
+
+                # Create sprite
+                sprite = arcade.Sprite(texture)
+                sprite.scale = TILE_SIZE / max(texture.width, texture.height)
+                sprite.position = (round(tile['x'] * TILE_SIZE), round(tile['y'] * TILE_SIZE))
+
+                # Store sprite with its grid position as key
+                tile_sprites[(tile['x'], tile['y'])] = sprite
+                keys.append((tile['x'], tile['y']))
+
+            except (KeyError, TypeError) as e:
+                print(f"Warning: Error processing tile at ({tile.get('x')}, {tile.get('y')}): {e}")
+        chunk_tiles[chunk] = keys
+
+    # Show the new tiles on the next frame instead of waiting for the camera to move
+    _last_viewport = None
+
+def unload_map(chunks: List[Tuple[int, int]]) -> None:
+    """Drop the tile sprites of chunks the client no longer keeps loaded."""
+    global _last_viewport
+    for chunk in chunks:
+        for key in chunk_tiles.pop(chunk, ()):
+            tile_sprites.pop(key, None)
+        _last_viewport = None
+
+def sprite_position(proto: str, x: float, y: float) -> Tuple[float, float]:
+    """Pixel centre of an entity's sprite. A player's position is already its centre (the Player
+    sends its sprite's centre); other entities sit on the tile whose corner their position is."""
+    if proto == 'player':
+        return x * TILE_SIZE, y * TILE_SIZE
+    return x * TILE_SIZE + TILE_SIZE / 2, y * TILE_SIZE + TILE_SIZE / 2
+
+def create_entity_sprite(entity_id, entity) -> Optional[arcade.Sprite]:
+    """Create, register and return the sprite for one entity, or None if it has no texture."""
+    props = get_content(entity.proto)
+    if not props or 'texture' not in props: return None
     
-    tile_sprites.clear()
+    texture_name = props["texture"]
+    if texture_name not in loaded_textures: return None
     
-    tile_map = get_tile_map()
+    texture = loaded_textures[texture_name]
+    sprite = arcade.Sprite(texture, hit_box_algorithm="Detailed")
 
-    # Check if map data is available
-    if 'layout' not in tile_map or 'tiles' not in tile_map['layout']:
-        print("Warning: Map data not available for initialization")
-        print(tile_map)
-        raise RuntimeError("Map data not available for initialization")
-    
-    map_data = tile_map
+    if entity.proto == 'player':
+        sprite.width = TILE_SIZE - 4
+        sprite.height = TILE_SIZE - 4
+    else:
+        sprite.scale = TILE_SIZE / max(texture.width, texture.height)
+
+    sprite.position = sprite_position(entity.proto, entity.x, entity.y)
+    sprite.angle = entity.rot
     
-    for tile in map_data['layout']['tiles']:
-        try:
-            tile_name = tile.get('tile')
-            if not tile_name:
-                continue
-                
-            tile_props = get_content(tile_name)
-            if not tile_props or 'texture' not in tile_props:
-                continue
-                
-            texture_name = tile_props["texture"]
-            if texture_name not in loaded_textures:
-                continue
-            
-            texture = loaded_textures[texture_name]
-            
-            # Create sprite
-            sprite = arcade.Sprite(texture)
-            sprite.scale = TILE_SIZE / max(texture.width, texture.height)
-            sprite.position = (round(tile['x'] * TILE_SIZE), round(tile['y'] * TILE_SIZE))
-            
-            # Store sprite with its grid position as key
-            tile_sprites[(tile['x'], tile['y'])] = sprite
-            
-        except (KeyError, TypeError) as e:
-            print(f"Warning: Error processing tile at ({tile.get('x')}, {tile.get('y')}): {e}")
-            continue
+    entity_sprites[entity_id] = sprite
+    entity.sprite = sprite
+    return sprite
 
 def init_entities() -> None:
     """Initialize sprites for ALL entities, including the player."""
@@ -151,40 +191,42 @@ def init_entities() -> None:
         # Only process entities that should be drawn
         if entity.draw:
             try:
-                props = get_content(entity.proto)
-                if not props or 'texture' not in props: continue
-                
-                texture_name = props["texture"]
-                if texture_name not in loaded_textures: continue
-                
-                texture = loaded_textures[texture_name]
-                sprite = arcade.Sprite(texture, hit_box_algorithm="Detailed")
+                create_entity_sprite(entity_id, entity)
+            except (KeyError, TypeError) as e:
+                print(f"Warning: Error initializing sprite for entity '{entity_id}': {e}")
 
-                if entity.proto == 'player':
-                    sprite.width = TILE_SIZE - 4
-                    sprite.height = TILE_SIZE - 4
-                else:
-                    sprite.scale = TILE_SIZE / max(texture.width, texture.height)
+def sync_entity_sprites() -> None:
+    """Create sprites for entities that arrived from the server and drop sprites of removed ones."""
+    for entity_id in [i for i in entity_sprites if i not in entities]:
+        del entity_sprites[entity_id]
 
-                sprite.position = ((entity.x * TILE_SIZE) + (TILE_SIZE / 2), (entity.y * TILE_SIZE) + (TILE_SIZE / 2))
-                sprite.angle = entity.rot
-                
-                entity_sprites[entity_id] = sprite
-                entity.sprite = sprite
+    for entity_id, entity in entities.items():
+        if entity.remote and entity.draw and entity.sprite is None:
+            try:
+                create_entity_sprite(entity_id, entity)
             except (KeyError, TypeError) as e:
                 print(f"Warning: Error initializing sprite for entity '{entity_id}': {e}")
 
 def update_entity_sprites() -> None:
-    """Update positions and rotations of all drawn entities."""
+    """Update positions and rotations of all drawn entities.
+
+    Remote entities are drawn where the interpolation buffer puts them (slightly in the past,
+    between two snapshots); local ones at their current position.
+    """
     if not entities:
         return
-        
+
+    sync_entity_sprites()
+    now = time.perf_counter()
+
     for entity_id, entity in entities.items():
-        # Only process entities that should be drawn
-        if entity.proto != 'player' and entity.draw and entity_id in entity_sprites:
+        # Only process entities that should be drawn; our own player is moved by Player physics
+        if (entity.proto != 'player' or entity.remote) and entity.draw and entity_id in entity_sprites:
             sprite = entity_sprites[entity_id]
-            sprite.position = ((entity.x * TILE_SIZE) + (TILE_SIZE / 2), (entity.y * TILE_SIZE) + (TILE_SIZE / 2))
-            sprite.angle = entity.rot
+            state = interpolation.sample(entity_id, now) if entity.remote else None
+            x, y, rot = state if state is not None else (entity.x, entity.y, entity.rot)
+            sprite.position = sprite_position(entity.proto, x, y)
+            sprite.angle = rot
 def should_update_viewport(viewport: 'Viewport') -> bool:
     """Check if we should update the viewport based on movement."""
     global _last_update_time, _last_viewport
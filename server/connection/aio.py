@@ -0,0 +1,243 @@
+import asyncio
+from typing import Dict, Set, Tuple
+from shared.framing import FrameDecoder, FrameCompressor
+from shared.protocol import decode, encode
+from connection.logic import packet_handler, disconnect_handler
+from connection.metrics import Metrics, OTHER, kind_of
+from connection.outbox import Outbox
+from connection.ratelimit import InboundLimiter, MAX_CLIENT_FRAME
+from connection.sessions import SessionStore, SESSION_GRACE
+from connection.udp import UDPChannel
+from update.data import walls
+from update.grid import VIEW_RADIUS
+from update.snapshot import SNAPSHOT_BUDGET
+from update.tick import TickLoop
+from update.walls import MoveValidator
+
+# Bytes buffered in a transport before the event loop pauses writing to it; past that,
+# messages wait in the client's Outbox where its queue policy applies.
+WRITE_BUFFER_HIGH = 64 * 1024
+
+class ClientProtocol(asyncio.BufferedProtocol):
+    """One connected client. The event loop reads straight into its frame decoder and each
+    decoded message goes to packet_handler.
+
+    Outgoing frames go straight to the transport while it keeps up. Once the transport
+    pauses writing they collect in the outbox and are flushed when it resumes.
+    """
+
+    def __init__(self, server: 'AsyncTCPServer'):
+        self.server = server
+        self.transport = None
+        self.addr = None
+        self.decoder = FrameDecoder(max_frame=MAX_CLIENT_FRAME)
+        self.limiter = InboundLimiter(server.rate_limit, server.rate_burst) if server.rate_limit else None
+        self.outbox = Outbox(server.queue_size, server.queue_bytes, server.queue_policy)
+        self.paused = False
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.addr = transport.get_extra_info('peername')
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+        self.server.clients[self.addr] = transport
+        self.server.metrics.connections += 1
+        print(f"Client connected: {self.addr}")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.decoder.writable(max(sizehint, 4096))
+
+    def buffer_updated(self, nbytes: int):
+        self.decoder.commit(nbytes)
+        try:
+            for payload in self.decoder.frames():
+                if self.limiter is None or self.limiter.allow():
+                    packet_handler(self.server, self.addr, decode(payload), len(payload))
+                else:
+                    self.server.metrics.rate_limited += 1
+        except ValueError as e:
+            self.server.metrics.malformed += 1
+            print(f"Dropping {self.addr}: malformed message ({e})")
+            self.transport.close()
+            return
+        if self.limiter and self.limiter.should_kick:
+            print(f"Kicking {self.addr}: over the inbound rate limit ({self.limiter.dropped} messages dropped)")
+            self.transport.close()
+
+    def send(self, data: bytes, reliable: bool = True) -> bool:
+        """Write a frame now if the transport is keeping up, otherwise queue it. False if the client was dropped."""
+        if self.transport.is_closing():
+            return False
+        if not self.paused and not len(self.outbox):
+            self.outbox.bytes_sent += len(data)
+            self.write(data)
+            return True
+        if self.outbox.put(data, reliable):
+            return True
+        print(f"Disconnecting {self.addr}: outbound queue full ({len(self.outbox)} messages, {self.outbox.bytes_pending} bytes)")
+        self.outbox.close()
+        self.transport.abort()
+        return False
+
+    def pause_writing(self):
+        self.paused = True
+
+    def write(self, data: bytes) -> None:
+        if self.outbox.compressor is not None:
+            data = self.outbox.compressor.compress(data)
+        self.transport.write(data)
+
+    def resume_writing(self):
+        self.paused = False
+        data = self.outbox.pop_all()
+        if data:
+            self.write(data)
+
+    def connection_lost(self, exc):
+        self.outbox.close()
+        self.server.clients.pop(self.addr, None)
+        self.server.binary_clients.discard(self.addr)
+        self.server.metrics.disconnections += 1
+        disconnect_handler(self.server, self.addr)
+        print(f"Connection closed: {self.addr}")
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    """The UDP side channel's socket on the event loop"""
+
+    def __init__(self, channel: UDPChannel):
+        self.channel = channel
+
+    def datagram_received(self, data: bytes, addr):
+        self.channel.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        pass  # e.g. ICMP port unreachable from a client that went away
+
+class AsyncTCPServer:
+    """Single-threaded asyncio server with the same message handling and send API as TCPServer.
+
+    Every connection is a protocol object on one event loop instead of an OS thread,
+    so idle clients only cost their socket and read buffer.
+    """
+
+    def __init__(self, host='0.0.0.0', port=5555, backlog=1024, tick_rate=20, rate_limit=60.0, rate_burst=120.0,
+                 view_radius=VIEW_RADIUS, queue_policy='coalesce', queue_size=256, queue_bytes=1024 * 1024,
+                 compress_threshold=512, udp_port=None, validate_moves=True, session_grace=SESSION_GRACE,
+                 snapshot_budget=SNAPSHOT_BUDGET):
+        self.host = host
+        self.port = port
+        self.backlog = backlog
+        self.rate_limit = rate_limit  # inbound messages/sec per client, 0 disables
+        self.rate_burst = rate_burst
+        self.view_radius = view_radius  # chunks a client sees around its player, None for the whole world
+        self.snapshot_budget = snapshot_budget  # snapshot bytes per client per tick, None for no limit
+        self.queue_policy = queue_policy  # see connection.outbox.POLICIES
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.compress_threshold = compress_threshold  # smallest frame worth deflating, None disables compression
+        self.clients: Dict[Tuple[str, int], asyncio.Transport] = {}  # (ip, port) -> transport
+        self.binary_clients: Set[Tuple[str, int]] = set()  # clients that negotiated the binary protocol
+        # Optional UDP side channel for snapshots and movement, None when disabled
+        self.udp = UDPChannel(self, udp_port) if udp_port is not None else None
+        # ShardLink when this server runs one region of a sharded world (see shard/worker.py)
+        self.shard = None
+        self.metrics = Metrics()
+        # Checks player moves against speed and walls before the tick applies them; None trusts clients
+        self.moves = MoveValidator(walls) if validate_moves else None
+        # Persistence that journals every tick and snapshots the world, when started with a world file
+        self.persistence = None
+        # Sessions a client can resume for `session_grace` seconds after its connection drops; 0 disables
+        self.sessions = SessionStore(session_grace) if session_grace else None
+        self.running = False
+        self.loop = None
+        self.ticker = TickLoop(self, tick_rate)
+        self._tick_task = None
+
+    def drop_client(self, client_addr: Tuple[str, int]) -> None:
+        """Close a connection; connection_lost then cleans up."""
+        transport = self.clients.get(client_addr)
+        if transport is not None:
+            transport.abort()
+
+    def use_binary(self, client_addr: Tuple[str, int]) -> None:
+        """Encode everything sent to this client with the binary protocol from now on"""
+        self.binary_clients.add(client_addr)
+
+    def use_compression(self, client_addr: Tuple[str, int]) -> None:
+        """Deflate large frames to this client from now on (it accepted compression at join)"""
+        transport = self.clients.get(client_addr)
+        if transport is not None and transport.get_protocol().outbox.compressor is None:
+            transport.get_protocol().outbox.compressor = FrameCompressor(self.compress_threshold)
+
+    def send_to_client(self, client_addr: Tuple[str, int], message: dict, reliable: bool = True) -> bool:
+        """Send a message to a specific client, encoded with the protocol it negotiated.
+
+        Unreliable messages (snapshots) go over the client's UDP channel when it has one, and
+        may be dropped or coalesced if the client falls behind.
+        """
+        transport = self.clients.get(client_addr)
+        if transport is None:
+            return False
+        binary = client_addr in self.binary_clients
+        if not reliable and self.udp is not None and self.udp.send(client_addr, message, binary):
+            return True
+        data = encode(message, binary)
+        self.metrics.sent(kind_of(message), len(data))
+        return transport.get_protocol().send(data, reliable)
+
+    def send_frame(self, client_addr: Tuple[str, int], frame: bytes, reliable: bool = True, kind: int = OTHER) -> bool:
+        """Send an already encoded frame (see is_binary for the encoding it must use); `kind` is for metrics"""
+        transport = self.clients.get(client_addr)
+        if transport is None:
+            return False
+        self.metrics.sent(kind, len(frame))
+        return transport.get_protocol().send(frame, reliable)
+
+    def is_binary(self, client_addr: Tuple[str, int]) -> bool:
+        return client_addr in self.binary_clients
+
+    def broadcast(self, message: dict, exclude_addr: Tuple[str, int] = None, addrs=None, reliable: bool = True) -> None:
+        """Send a message to all connected clients (or only `addrs`, see logic.clients_near) except the excluded one"""
+        encoded = {}  # binary flag -> bytes, so each encoding is done at most once
+        if addrs is not None:
+            addrs = set(addrs)
+        kind = kind_of(message)
+        for addr, transport in list(self.clients.items()):
+            if (exclude_addr and addr == exclude_addr) or (addrs is not None and addr not in addrs):
+                continue
+            binary = addr in self.binary_clients
+            if binary not in encoded:
+                encoded[binary] = encode(message, binary)
+            self.metrics.sent(kind, len(encoded[binary]))
+            transport.get_protocol().send(encoded[binary], reliable)
+
+    def queue_stats(self) -> Dict[Tuple[str, int], dict]:
+        """Outbound queue metrics per client (see Outbox.stats)"""
+        return {addr: transport.get_protocol().outbox.stats() for addr, transport in list(self.clients.items())}
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await self.loop.create_server(
+            lambda: ClientProtocol(self), self.host, self.port,
+            reuse_address=True, backlog=self.backlog,
+        )
+        print(f"Server started on {self.host}:{self.port} (asyncio)")
+        if self.udp is not None:
+            udp_transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(self.udp), local_addr=(self.host, self.udp.port))
+            self.udp.sendto = udp_transport.sendto
+            print(f"UDP side channel on {self.host}:{self.udp.port}")
+        self._tick_task = self.loop.create_task(self.ticker.run_async())
+        async with server:
+            await server.serve_forever()
+
+    def start(self):
+        self.running = True
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\nShutting down server...")
+        finally:
+            self.running = False
+            for transport in self.clients.values():
+                transport.close()
+            self.clients.clear()
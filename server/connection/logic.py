@@ -1,10 +1,193 @@
-import json
-
-def packet_handler(message: str):
-    data = json.loads(message)
-    if data['type'] == 'update':
-        if data['data']['type'] == 'player':
-            print(f"Player moved to ({data['data']['data']['x']}, {data['data']['data']['y']})")
-    elif data['type'] == 'get':
-        if data['data']['type'] == 'entities':
-            pass
\ No newline at end of file
+import time
+from shared.clock import LinkEstimator, pong_message
+from shared.protocol import PROTOCOL_VERSION, ProtocolError
+from update.data import entities, updates, lock, grid, spawn_entity, remove_entity, visible_from, entities_version
+from update.snapshot import ClientView
+from loader.mapchunks import get_map, MAX_CHUNKS_PER_REQUEST
+from connection.payloads import PayloadCache
+from connection.metrics import KIND, OTHER
+from connection.messages import key_of, Join, PlayerUpdate, SnapshotAck, GetEntities, GetChunks, Ping, Pong
+
+# (ip, port) -> id of the player entity owned by that connection
+players = {}
+# (ip, port) -> snapshot baseline of a joined client
+views = {}
+# player entity id -> newest input sequence number applied to it, echoed back in snapshots
+inputs = {}
+# (ip, port) -> RTT, jitter and clock offset of a joined client, from the pings the tick sends it
+links = {}
+# Encoded map and entity payloads, shared by every client that asks for the same content
+payloads = PayloadCache()
+# (type, data type) -> (message class, handler), filled in by @handles below
+HANDLERS = {}
+
+def handles(cls):
+    """Register the decorated function as the handler of messages of class `cls` (see connection.messages)"""
+    def register(handler):
+        HANDLERS[cls.key] = (cls, handler)
+        return handler
+    return register
+
+def packet_handler(server, addr, data: dict, size: int = 0):
+    """Handle one decoded message from a client. Shared by the threaded and asyncio servers.
+
+    The message goes to the handler registered for its (type, data type), validated and
+    parsed into that handler's message class; anything without a handler is ignored.
+    Raises ProtocolError (a ValueError) for a message that does not match its schema.
+    `size` is the message's encoded length, counted in server.metrics with the time it took.
+    """
+    start = time.perf_counter()
+    entry = HANDLERS.get(key_of(data))
+    if entry is None:
+        server.metrics.received(OTHER, size, time.perf_counter() - start)
+        return
+    cls, handler = entry
+    handler(server, addr, cls.parse(data))
+    server.metrics.received(cls.kind, size, time.perf_counter() - start)
+
+@handles(Join)
+def handle_join(server, addr, message: Join):
+    print(f"Client joined: {addr}")
+    spawn = get_map().clamp(message.x, message.y)
+    handoff = message.handoff if server.shard is not None else None
+    resumed = None
+    with lock:
+        if addr in players:
+            # One player per connection; a second one would be left behind when the connection closes
+            raise ProtocolError("Already joined")
+        if server.sessions is not None and message.resume is not None:
+            resumed = server.sessions.resume(message.resume)
+        if resumed is not None:
+            # Back within the grace period: same player, and the client still has the map and the
+            # snapshots it acknowledged, so the next snapshot is a delta against that baseline.
+            entity_id = resumed.entity_id
+            if resumed.seq is not None:
+                inputs[entity_id] = resumed.seq
+            entity = entities[entity_id]
+            spawn = (entity['x'], entity['y'])
+        elif handoff is not None:
+            # Our player walked over from another shard (see shard/worker.py): same entity, and
+            # the client already has the map.
+            entity_id = server.shard.attach(handoff['entity'], handoff['tick'])
+            if handoff.get('seq') is not None:
+                inputs[entity_id] = handoff['seq']
+        else:
+            entity_id = spawn_entity('player', *spawn)
+        players[addr] = entity_id
+        # A new client has no baseline yet, so the first snapshot it gets is a full one.
+        views[addr] = resumed.view if resumed is not None else ClientView(entity_id)
+        links[addr] = LinkEstimator()
+        session = server.sessions.issue(addr) if server.sessions is not None else None
+    joined = {'type': 'response', 'data': {'type': 'joined', 'data': {'id': entity_id, 'spawn': list(spawn)}}}
+    if session is not None:
+        # Presented as `resume` in the join after a dropped connection
+        joined['data']['data']['session'] = session
+        if resumed is not None:
+            joined['data']['data']['resumed'] = True
+    binary = message.protocol == 'binary' and message.version == PROTOCOL_VERSION
+    if binary:
+        # The reply is still JSON; both directions are binary after it.
+        joined.update(protocol='binary', version=PROTOCOL_VERSION)
+    compress = message.compression == 'zlib' and server.compress_threshold is not None
+    if compress:
+        joined['compression'] = 'zlib'
+    if message.udp and server.udp is not None:
+        # Snapshots and movement may then go over UDP; the token binds the datagrams to this connection.
+        joined['data']['data']['udp'] = {'port': server.udp.port, 'token': server.udp.open(addr)}
+    server.send_to_client(addr, joined)
+    if binary:
+        server.use_binary(addr)
+    if compress:
+        server.use_compression(addr)
+    if handoff is not None or resumed is not None:
+        return
+    # Only the map's outline; the client asks for the chunks around it with `get chunks`.
+    world_map = get_map()
+    server.send_frame(addr, payloads.get('map', world_map.version, server.is_binary(addr), lambda: {
+        'type': 'response', 'data': {'type': 'map', 'data': world_map.info()}}), kind=KIND['response', 'map'])
+
+@handles(PlayerUpdate)
+def handle_update(server, addr, message: PlayerUpdate):
+    entity_id = players.get(addr)
+    if entity_id is not None:
+        update = {'x': message.x, 'y': message.y}
+        if message.seq is not None:
+            # Numbered by a predicting client, which reconciles against the position we echo back
+            update['seq'] = message.seq
+        # Applied by the tick loop; only the newest update per client per tick is kept.
+        updates.append((entity_id, update))
+
+@handles(SnapshotAck)
+def handle_ack(server, addr, message: SnapshotAck):
+    with lock:
+        view = views.get(addr)
+        if view is not None:
+            view.ack(message.tick)
+
+@handles(Ping)
+def handle_ping(server, addr, message: Ping):
+    # Answered at once so the client's RTT sample only holds the network and our queue
+    server.send_to_client(addr, pong_message(message.t))
+
+@handles(Pong)
+def handle_pong(server, addr, message: Pong):
+    link = links.get(addr)
+    if link is not None:
+        server.metrics.rtt(link.pong(message.t, message.clock))
+
+@handles(GetEntities)
+def handle_get_entities(server, addr, message: GetEntities):
+    binary = server.is_binary(addr)
+    with lock:
+        entity_id = players.get(addr)
+        # Joined clients get what is in their view, so clients in the same chunk share one payload.
+        # Other connections (tools) get the whole world.
+        if entity_id is not None and server.view_radius is not None:
+            key = ('entities', grid.chunk_of(entity_id), server.view_radius)
+            ids = lambda: visible_from(entity_id, server.view_radius)
+        else:
+            key = ('entities', None)
+            ids = lambda: entities
+        frame = payloads.get(key, entities_version(), binary, lambda: {
+            'type': 'response', 'data': {'type': 'entities', 'data': {i: dict(entities[i]) for i in ids()}}})
+    server.send_frame(addr, frame, kind=KIND['response', 'entities'])
+
+@handles(GetChunks)
+def handle_get_chunks(server, addr, message: GetChunks):
+    world_map = get_map()
+    binary = server.is_binary(addr)
+    for cx, cy in message.chunks[:MAX_CHUNKS_PER_REQUEST]:
+        if (cx, cy) not in world_map.chunks:
+            # Outside the map or without tiles: nothing to send, and nothing to cache
+            continue
+        server.send_frame(addr, payloads.get(('chunk', cx, cy), world_map.chunk_version(cx, cy), binary, lambda: {
+            'type': 'response', 'data': {'type': 'chunk', 'data': world_map.chunk(cx, cy)}}), kind=KIND['response', 'chunk'])
+
+def clients_near(server, x: float, y: float) -> list:
+    """Addresses of the joined clients whose view covers tile (x, y), e.g. for server.broadcast(addrs=...)."""
+    if server.view_radius is None:
+        return list(views)
+    with lock:
+        nearby = grid.query(grid.chunk(x, y), server.view_radius)
+        return [addr for addr, entity_id in players.items() if entity_id in nearby]
+
+def disconnect_handler(server, addr):
+    """Remove the player entity of a client whose connection closed, or park its session to be resumed."""
+    if server.udp is not None:
+        server.udp.close(addr)
+    with lock:
+        entity_id = players.pop(addr, None)
+        if entity_id is None:
+            return
+        if server.moves is not None:
+            server.moves.forget(entity_id)
+        view = views.pop(addr, None)
+        seq = inputs.pop(entity_id, None)
+        links.pop(addr, None)
+        if server.sessions is None or not server.sessions.park(addr, entity_id, view, seq):
+            remove_entity(entity_id)
+
+def expire_sessions(server):
+    """Remove the players of parked sessions nobody resumed in time. Called by the tick with the lock held."""
+    for entity_id in server.sessions.expire():
+        remove_entity(entity_id)
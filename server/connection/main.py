@@ -1,98 +1,219 @@
 import socket
 import threading
-from typing import Dict, Tuple
-from connection.logic import packet_handler
-from update.data import entities
-from loader.content import get_object_properties as get_content, yml_content
-import json
+from typing import Dict, Set, Tuple
+from shared.framing import FrameDecoder, FrameCompressor
+from shared.protocol import decode, encode
+from connection.logic import packet_handler, disconnect_handler
+from connection.metrics import Metrics, OTHER, kind_of
+from connection.outbox import Outbox
+from connection.ratelimit import InboundLimiter, MAX_CLIENT_FRAME
+from connection.sessions import SessionStore, SESSION_GRACE
+from connection.udp import UDPChannel
+from update.data import walls
+from update.grid import VIEW_RADIUS
+from update.snapshot import SNAPSHOT_BUDGET
+from update.tick import TickLoop
+from update.walls import MoveValidator
 
 class TCPServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, tick_rate=20, rate_limit=60.0, rate_burst=120.0,
+                 view_radius=VIEW_RADIUS, queue_policy='coalesce', queue_size=256, queue_bytes=1024 * 1024,
+                 compress_threshold=512, udp_port=None, validate_moves=True, session_grace=SESSION_GRACE,
+                 snapshot_budget=SNAPSHOT_BUDGET):
         self.host = host
         self.port = port
+        self.rate_limit = rate_limit  # inbound messages/sec per client, 0 disables
+        self.rate_burst = rate_burst
+        self.view_radius = view_radius  # chunks a client sees around its player, None for the whole world
+        self.snapshot_budget = snapshot_budget  # snapshot bytes per client per tick, None for no limit
+        self.queue_policy = queue_policy  # see connection.outbox.POLICIES
+        self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.compress_threshold = compress_threshold  # smallest frame worth deflating, None disables compression
         self.clients: Dict[Tuple[str, int], socket.socket] = {}  # (ip, port) -> socket
+        self.outboxes: Dict[Tuple[str, int], Outbox] = {}  # (ip, port) -> frames waiting for its writer thread
         self.lock = threading.Lock()  # For thread-safe client dictionary access
+        self.binary_clients: Set[Tuple[str, int]] = set()  # clients that negotiated the binary protocol
+        # Optional UDP side channel for snapshots and movement, None when disabled
+        self.udp = UDPChannel(self, udp_port) if udp_port is not None else None
+        # ShardLink when this server runs one region of a sharded world (see shard/worker.py)
+        self.shard = None
+        self.metrics = Metrics()
+        # Checks player moves against speed and walls before the tick applies them; None trusts clients
+        self.moves = MoveValidator(walls) if validate_moves else None
+        # Persistence that journals every tick and snapshots the world, when started with a world file
+        self.persistence = None
+        # Sessions a client can resume for `session_grace` seconds after its connection drops; 0 disables
+        self.sessions = SessionStore(session_grace) if session_grace else None
         self.running = False
+        self.ticker = TickLoop(self, tick_rate)
 
     def handle_client(self, conn: socket.socket, addr: Tuple[str, int]):
         print(f"Client connected: {addr}")
+        self.metrics.connections += 1
+        outbox = Outbox(self.queue_size, self.queue_bytes, self.queue_policy)
         with self.lock:
             self.clients[addr] = conn
+            self.outboxes[addr] = outbox
+        threading.Thread(target=self.write_client, args=(conn, addr, outbox), daemon=True).start()
 
-        buffer = b''
+        decoder = FrameDecoder(max_frame=MAX_CLIENT_FRAME)
+        limiter = InboundLimiter(self.rate_limit, self.rate_burst) if self.rate_limit else None
         try:
             while self.running:
-                data = conn.recv(1024)
-                if not data:
+                received = conn.recv_into(decoder.writable())
+                if not received:
+                    break
+                decoder.commit(received)
+                for payload in decoder.frames():
+                    if limiter is None or limiter.allow():
+                        packet_handler(self, addr, decode(payload), len(payload))
+                    else:
+                        self.metrics.rate_limited += 1
+                if limiter and limiter.should_kick:
+                    print(f"Kicking {addr}: over the inbound rate limit ({limiter.dropped} messages dropped)")
                     break
-                buffer += data
-                
-                while b'\n' in buffer:
-                    line, buffer = buffer.split(b'\n', 1)
-                    if line:
-                        message = line.decode()
-                        data = json.loads(message)
-                        if data['type'] == 'join':
-                            print(f"Client joined: {addr}, sending map ")
-                            self.send_to_client(addr, json.dumps({'type': 'response', 'data': {'type': 'entities', 'data': entities}}))
-                            self.send_to_client(addr, json.dumps({'type': 'response', 'data': {'type': 'map', 'data':yml_content['map']}}))
-                        if data['type'] == 'update':
-                            if data['data']['type'] == 'player':
-                                pass
-                                #print(f"Player moved to ({data['data']['data']['x']}, {data['data']['data']['y']})")
-                        elif data['type'] == 'get':
-                            if data['data']['type'] == 'entities':
-                                self.send_to_client(addr, json.dumps({'type': 'response', 'data': {'type': 'entities', 'data': entities}}))
         except (ConnectionResetError, ConnectionAbortedError):
             print(f"Client disconnected: {addr}")
+        except ValueError as e:
+            self.metrics.malformed += 1
+            print(f"Dropping {addr}: malformed message ({e})")
         finally:
+            self.metrics.disconnections += 1
             with self.lock:
                 self.clients.pop(addr, None)
+                self.outboxes.pop(addr, None)
+                self.binary_clients.discard(addr)
+            outbox.close()
+            disconnect_handler(self, addr)
             conn.close()
             print(f"Connection closed: {addr}")
 
-    def send_to_client(self, client_addr: Tuple[str, int], message: str) -> bool:
-        """Send a message to a specific client"""
+    def write_client(self, conn: socket.socket, addr: Tuple[str, int], outbox: Outbox):
+        """Writer thread of one connection: blocking sends happen here, never in the sender's thread."""
+        while True:
+            data = outbox.take()
+            if data is None:
+                return
+            if outbox.compressor is not None:
+                data = outbox.compressor.compress(data)
+            try:
+                conn.sendall(data)
+            except OSError:
+                print(f"Failed to send to {addr}: Client disconnected")
+                self.drop_client(addr)
+                return
+
+    def drop_client(self, client_addr: Tuple[str, int]) -> None:
+        """Close a connection from any thread; its handler thread then cleans up."""
         with self.lock:
-            client_socket = self.clients.get(client_addr)
-        
-        if client_socket:
+            conn = self.clients.get(client_addr)
+        if conn is not None:
             try:
-                if not message.endswith('\n'):
-                    message += '\n'
-                client_socket.sendall(message.encode())
-                return True
-            except (ConnectionResetError, BrokenPipeError):
-                print(f"Failed to send to {client_addr}: Client disconnected")
-                with self.lock:
-                    self.clients.pop(client_addr, None)
-        return False
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def use_binary(self, client_addr: Tuple[str, int]) -> None:
+        """Encode everything sent to this client with the binary protocol from now on"""
+        with self.lock:
+            self.binary_clients.add(client_addr)
+
+    def use_compression(self, client_addr: Tuple[str, int]) -> None:
+        """Deflate large frames to this client from now on (it accepted compression at join)"""
+        with self.lock:
+            outbox = self.outboxes.get(client_addr)
+        if outbox is not None and outbox.compressor is None:
+            outbox.compressor = FrameCompressor(self.compress_threshold)
+
+    def send_to_client(self, client_addr: Tuple[str, int], message: dict, reliable: bool = True) -> bool:
+        """Queue a message for a specific client, encoded with the protocol it negotiated.
+
+        Unreliable messages (snapshots) go over the client's UDP channel when it has one, and
+        may be dropped or coalesced if the client falls behind.
+        """
+        with self.lock:
+            outbox = self.outboxes.get(client_addr)
+            binary = client_addr in self.binary_clients
+        if outbox is None:
+            return False
+        if not reliable and self.udp is not None and self.udp.send(client_addr, message, binary):
+            return True
+        data = encode(message, binary)
+        self.metrics.sent(kind_of(message), len(data))
+        return self._queue(client_addr, outbox, data, reliable)
 
-    def broadcast(self, message: str, exclude_addr: Tuple[str, int] = None) -> None:
-        """Send a message to all connected clients except the excluded one"""
-        if not message.endswith('\n'):
-            message += '\n'
-            
+    def send_frame(self, client_addr: Tuple[str, int], frame: bytes, reliable: bool = True, kind: int = OTHER) -> bool:
+        """Queue an already encoded frame (see is_binary for the encoding it must use); `kind` is for metrics"""
         with self.lock:
-            clients = list(self.clients.items())
-            
-        for addr, sock in clients:
-            if exclude_addr and addr == exclude_addr:
+            outbox = self.outboxes.get(client_addr)
+        if outbox is None:
+            return False
+        self.metrics.sent(kind, len(frame))
+        return self._queue(client_addr, outbox, frame, reliable)
+
+    def is_binary(self, client_addr: Tuple[str, int]) -> bool:
+        with self.lock:
+            return client_addr in self.binary_clients
+
+    def broadcast(self, message: dict, exclude_addr: Tuple[str, int] = None, addrs=None, reliable: bool = True) -> None:
+        """Send a message to all connected clients (or only `addrs`, see logic.clients_near) except the excluded one"""
+        encoded = {}  # binary flag -> bytes, so each encoding is done at most once
+
+        with self.lock:
+            clients = [(addr, outbox, addr in self.binary_clients) for addr, outbox in self.outboxes.items()]
+
+        if addrs is not None:
+            addrs = set(addrs)
+        kind = kind_of(message)
+        for addr, outbox, binary in clients:
+            if (exclude_addr and addr == exclude_addr) or (addrs is not None and addr not in addrs):
                 continue
+            if binary not in encoded:
+                encoded[binary] = encode(message, binary)
+            self.metrics.sent(kind, len(encoded[binary]))
+            self._queue(addr, outbox, encoded[binary], reliable)
+
+    def queue_stats(self) -> Dict[Tuple[str, int], dict]:
+        """Outbound queue metrics per client (see Outbox.stats)"""
+        with self.lock:
+            outboxes = list(self.outboxes.items())
+        return {addr: outbox.stats() for addr, outbox in outboxes}
+
+    def _queue(self, addr: Tuple[str, int], outbox: Outbox, data: bytes, reliable: bool) -> bool:
+        if outbox.put(data, reliable):
+            return True
+        if not outbox.closed:
+            print(f"Disconnecting {addr}: outbound queue full ({len(outbox)} messages, {outbox.bytes_pending} bytes)")
+            outbox.close()
+            self.drop_client(addr)
+        return False
+
+    def receive_datagrams(self, sock: socket.socket):
+        """Reader thread of the UDP side channel"""
+        while self.running:
             try:
-                sock.sendall(message.encode())
-            except (ConnectionResetError, BrokenPipeError):
-                print(f"Failed to broadcast to {addr}")
-                with self.lock:
-                    self.clients.pop(addr, None)
+                data, endpoint = sock.recvfrom(65535)
+            except OSError:
+                if not self.running:
+                    return
+                continue  # e.g. ICMP port unreachable from a client that went away
+            self.udp.datagram_received(data, endpoint)
 
     def start(self):
         self.running = True
+        if self.udp is not None:
+            udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp_sock.bind((self.host, self.udp.port))
+            self.udp.sendto = udp_sock.sendto
+            threading.Thread(target=self.receive_datagrams, args=(udp_sock,), daemon=True).start()
+            print(f"UDP side channel on {self.host}:{self.udp.port}")
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind((self.host, self.port))
             s.listen()
             print(f"Server started on {self.host}:{self.port}")
+            threading.Thread(target=self.ticker.run, daemon=True).start()
 
             try:
                 while self.running:
@@ -0,0 +1,150 @@
+"""
+Typed client messages, validated against compact schemas.
+
+Each message a client may send is declared once with message(): its (type, subtype) and a
+schema mapping field names to a spec. A spec is float, int, str, bool, dict or list (the
+value must have that type; an int is accepted for a float, which must be finite), a
+converter that raises TypeError or ValueError on bad input, or optional(spec, default).
+Fields are read from the message body, `message['data']['data']` (missing counts as
+empty); `envelope` fields from the top level of the message (e.g. the handshake keys of a
+`join`).
+
+A schema is compiled into a parse function once, when the message is declared, so
+validating a message is straight-line code with no per-field interpretation. Anything
+that does not match raises ProtocolError, which the connection treats like an undecodable
+frame.
+"""
+import math
+from shared.mapchunks import CHUNK_SIZE, MAX_COORDINATE
+from shared.protocol import ProtocolError
+from connection.metrics import KIND, OTHER
+
+_MISSING = object()
+# Checks for the plain type specs; `value` is the field's raw value
+_CHECKS = {
+    float: ("if type(value) is not float:\n"
+            "    if type(value) is not int:\n"
+            "        raise ProtocolError(f'{name}: {field} must be a number')\n"
+            "    value = float(value)\n"
+            "if not isfinite(value):\n"
+            "    raise ProtocolError(f'{name}: {field} must be finite')"),
+    int: ("if type(value) is not int:\n"
+          "    raise ProtocolError(f'{name}: {field} must be an integer')"),
+}
+for _type in (str, bool, dict, list):
+    _CHECKS[_type] = (f"if type(value) is not {_type.__name__}:\n"
+                      f"    raise ProtocolError(f'{{name}}: {{field}} must be a {_type.__name__}')")
+
+def key_of(message) -> tuple:
+    """(type, data type) of a decoded message, the key its class is declared under"""
+    try:
+        key = message['type'], message['data']['type']
+        hash(key)
+    except (KeyError, TypeError, IndexError):
+        raise ProtocolError("A message needs a type and a data type") from None
+    return key
+
+class optional:
+    """A field that may be missing or null, in which case it is `default`"""
+
+    __slots__ = ('spec', 'default')
+
+    def __init__(self, spec, default=None):
+        self.spec = spec
+        self.default = default
+
+def message(type_: str, subtype: str, envelope: dict = None, **fields):
+    """Declare a message: returns a class whose parse(message) validates a decoded message
+    and returns an instance with one attribute per field."""
+    envelope = envelope or {}
+    name = f"{type_} {subtype}"
+    namespace = {'ProtocolError': ProtocolError, 'isfinite': math.isfinite, 'MISSING': _MISSING}
+    lines = ["def parse(message):",
+             "    data = message['data'].get('data')",
+             "    if data is None:",
+             "        data = {}",
+             "    elif type(data) is not dict:",
+             f"        raise ProtocolError({name + ': the body must be an object'!r})",
+             "    self = new(cls)"]
+    for source, schema in (('data', fields), ('message', envelope)):
+        for field, spec in schema.items():
+            default = _MISSING
+            if isinstance(spec, optional):
+                spec, default = spec.spec, spec.default
+            lines.append(f"    value = {source}.get({field!r}, MISSING)")
+            if default is _MISSING:
+                lines.append(f"    if value is MISSING:\n        raise ProtocolError({f'{name}: {field} is missing'!r})")
+                indent = "    "
+            else:
+                namespace[f'default_{field}'] = default
+                lines.append(f"    if value is MISSING or value is None:\n        value = default_{field}\n    else:")
+                indent = "        "
+            check = _CHECKS.get(spec)
+            if check is None:
+                namespace[f'convert_{field}'] = spec
+                check = (f"try:\n    value = convert_{field}(value)\n"
+                         f"except (TypeError, ValueError) as e:\n"
+                         f"    raise ProtocolError(f'{{name}}: bad {{field}} ({{e}})') from None")
+            check = check.replace('{name}', name).replace('{field}', field)
+            lines.extend(indent + line for line in check.splitlines())
+            lines.append(f"    self.{field} = value")
+    lines.append("    return self")
+
+    cls = type(''.join(part.title() for part in (type_, subtype)), (_Message,), {
+        '__slots__': tuple(fields) + tuple(envelope),
+        'key': (type_, subtype),
+        'kind': KIND.get((type_, subtype), OTHER),
+        'fields': tuple(fields) + tuple(envelope),
+    })
+    namespace.update(new=object.__new__, cls=cls)
+    exec('\n'.join(lines), namespace)
+    cls.parse = staticmethod(namespace['parse'])
+    return cls
+
+class _Message:
+    __slots__ = ()
+    key = (None, None)
+    kind = OTHER
+    fields = ()
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self.fields)
+        return f"{type(self).__name__}({values})"
+
+def coordinate(value) -> float:
+    """A tile position: a number within MAX_COORDINATE of the origin"""
+    if type(value) is not float:
+        if type(value) is not int:
+            raise TypeError("not a number")
+        value = float(value)
+    if not -MAX_COORDINATE <= value <= MAX_COORDINATE:  # also false for NaN
+        raise ValueError("out of range")
+    return value
+
+# Largest chunk coordinate a client may ask for, the chunk holding MAX_COORDINATE
+MAX_CHUNK = int(MAX_COORDINATE) // CHUNK_SIZE
+
+def chunk_list(value) -> list:
+    """[[cx, cy], ...] as a list of integer pairs within MAX_CHUNK of the origin"""
+    if type(value) is not list:
+        raise TypeError("not a list")
+    chunks = []
+    for item in value:
+        cx, cy = item
+        if type(cx) is not int or type(cy) is not int:
+            raise TypeError("chunk coordinates must be integers")
+        if not (-MAX_CHUNK <= cx <= MAX_CHUNK and -MAX_CHUNK <= cy <= MAX_CHUNK):
+            raise ValueError("chunk coordinates out of range")
+        chunks.append((cx, cy))
+    return chunks
+
+# Everything a client sends over its connection (or the UDP side channel, see udp.DATAGRAM_TYPES)
+Join = message('join', 'player', x=optional(coordinate, 0.0), y=optional(coordinate, 0.0), envelope=dict(
+    protocol=optional(str), version=optional(int), compression=optional(str), udp=optional(bool),
+    resume=optional(str), handoff=optional(dict)))
+PlayerUpdate = message('update', 'player', x=coordinate, y=coordinate, seq=optional(int))
+SnapshotAck = message('ack', 'snapshot', tick=int)
+GetEntities = message('get', 'entities')
+GetChunks = message('get', 'chunks', chunks=chunk_list)
+Ping = message('ping', 'clock', t=float)
+Pong = message('pong', 'clock', t=float, clock=float)
@@ -0,0 +1,213 @@
+"""
+Server metrics: messages and bytes per message kind in both directions, handler latency,
+tick duration and client round trip histograms, connection counts and outbound queue depths.
+
+Counters live in preallocated arrays indexed by message kind and histograms have fixed
+buckets, so recording an event is a few index operations and allocates nothing; metrics are
+always on. Counters are bumped without a lock: on the threaded server two threads counting
+the same thing at the same instant may lose one of the increments, which is fine for
+metrics.
+
+report() gathers everything into one JSON-friendly dict, which serve_stats() publishes on
+a localhost HTTP port and dump_stats() writes to a file at an interval.
+"""
+import json
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Message kinds counted separately, by (type, data type); anything else counts as 'other'
+KINDS = (
+    ('join', 'player'),
+    ('update', 'player'),
+    ('ack', 'snapshot'),
+    ('get', 'entities'),
+    ('get', 'chunks'),
+    ('response', 'joined'),
+    ('response', 'map'),
+    ('response', 'entities'),
+    ('response', 'chunk'),
+    ('response', 'snapshot'),
+    ('ping', 'clock'),
+    ('pong', 'clock'),
+)
+KIND = {kind: i for i, kind in enumerate(KINDS)}
+OTHER = len(KINDS)
+KIND_NAMES = tuple(f"{t} {s}" for t, s in KINDS) + ('other',)
+
+# Upper bounds of the latency histogram buckets in milliseconds; the last bucket is open-ended
+LATENCY_BOUNDS_MS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def kind_of(message: dict) -> int:
+    """Index of a decoded message's kind in KINDS, or OTHER"""
+    try:
+        return KIND.get((message['type'], message['data']['type']), OTHER)
+    except (KeyError, TypeError):
+        return OTHER
+
+class Histogram:
+    """Counts of values in fixed buckets (see LATENCY_BOUNDS_MS), plus their sum and maximum."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds: tuple = LATENCY_BOUNDS_MS):
+        self.bounds = bounds
+        self.counts = array('q', bytes(8 * (len(bounds) + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile, capped at the largest value seen"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets': {(str(b) if i < len(self.bounds) else 'inf'): c
+                        for i, (b, c) in enumerate(zip(self.bounds + (None,), self.counts)) if c},
+        }
+
+class Metrics:
+    """Counters of one server, updated by its connections, handlers and tick loop."""
+
+    def __init__(self):
+        kinds = len(KINDS) + 1
+        self.started = time.time()
+        self.messages_in = array('q', bytes(8 * kinds))
+        self.bytes_in = array('q', bytes(8 * kinds))
+        self.messages_out = array('q', bytes(8 * kinds))
+        self.bytes_out = array('q', bytes(8 * kinds))
+        self.handler_ms = tuple(Histogram() for _ in range(kinds))
+        self.tick_ms = Histogram()
+        self.rtt_ms = Histogram()  # every ping round trip to every client (shared/clock.py)
+        self.connections = 0
+        self.disconnections = 0
+        self.malformed = 0
+        self.rate_limited = 0  # inbound messages dropped by the rate limiter
+
+    def received(self, kind: int, size: int, seconds: float) -> None:
+        """A message of kind `kind` and `size` encoded bytes was handled in `seconds`"""
+        self.messages_in[kind] += 1
+        self.bytes_in[kind] += size
+        self.handler_ms[kind].record(seconds * 1000)
+
+    def sent(self, kind: int, size: int) -> None:
+        """A message of kind `kind` (see kind_of) and `size` bytes before compression was sent or queued"""
+        self.messages_out[kind] += 1
+        self.bytes_out[kind] += size
+
+    def tick(self, seconds: float) -> None:
+        self.tick_ms.record(seconds * 1000)
+
+    def rtt(self, seconds: float) -> None:
+        self.rtt_ms.record(seconds * 1000)
+
+    def report(self, server) -> dict:
+        """Everything about `server` (TCPServer or AsyncTCPServer) as one JSON-friendly dict"""
+        ticks = server.ticker.stats()
+        queues = ticks['queues'].values()
+        return {
+            'time': time.time(),
+            'uptime_s': time.time() - self.started,
+            'clients': len(server.clients),
+            'connections': {
+                'opened': self.connections,
+                'closed': self.disconnections,
+                'malformed': self.malformed,
+                'rate_limited': self.rate_limited,
+            },
+            'messages_in': {
+                name: {'count': self.messages_in[i], 'bytes': self.bytes_in[i], 'handler_ms': self.handler_ms[i].to_dict()}
+                for i, name in enumerate(KIND_NAMES) if self.messages_in[i]
+            },
+            'messages_out': {
+                name: {'count': self.messages_out[i], 'bytes': self.bytes_out[i]}
+                for i, name in enumerate(KIND_NAMES) if self.messages_out[i]
+            },
+            'tick': {
+                'tick': ticks['tick'],
+                'tick_rate': ticks['tick_rate'],
+                'overruns': ticks['total_overruns'],
+                'duration_ms': self.tick_ms.to_dict(),
+            },
+            'queues': {
+                'clients': len(queues),
+                'max_depth': max((q['depth'] for q in queues), default=0),
+                'total_depth': sum(q['depth'] for q in queues),
+                'bytes_pending': sum(q['bytes_pending'] for q in queues),
+                'bytes_sent': sum(q['bytes_sent'] for q in queues),
+                'dropped': sum(q['dropped'] for q in queues),
+                'coalesced': sum(q['coalesced'] for q in queues),
+            },
+            'links': {
+                'rtt_ms': self.rtt_ms.to_dict(),
+                'clients': ticks['links'],  # 'ip:port' -> smoothed rtt, jitter and clock offset
+            },
+            'budget': ticks['budget'],
+            'payloads': ticks['payloads'],
+            'udp': ticks['udp'],
+            'shard': ticks['shard'],
+            'moves': ticks['moves'],
+            'persistence': ticks['persistence'],
+            'sessions': ticks['sessions'],
+        }
+
+def serve_stats(server, port: int) -> ThreadingHTTPServer:
+    """Answer every GET on 127.0.0.1:port with server.metrics.report() as JSON, from a daemon thread."""
+
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(server.metrics.report(server)).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', port), StatsHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"Stats on http://127.0.0.1:{port}/")
+    return httpd
+
+def dump_stats(server, path: str, interval: float = 10.0) -> None:
+    """Rewrite `path` with server.metrics.report() as JSON every `interval` seconds, from a daemon thread.
+
+    The file is replaced in one step, so a reader never sees half a report.
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            tmp = f"{path}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(server.metrics.report(server), f, indent=1)
+            os.replace(tmp, path)
+
+    threading.Thread(target=run, daemon=True).start()
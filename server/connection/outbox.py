@@ -0,0 +1,123 @@
+import threading
+from collections import deque
+
+# What to do when a client's queue is full:
+#   drop        drop the oldest unreliable messages (snapshots) to make room
+#   coalesce    like drop, and a new unreliable message also replaces any still waiting,
+#               since a newer snapshot delta repeats everything an older one carried
+#   disconnect  close the connection
+POLICIES = ('drop', 'coalesce', 'disconnect')
+
+class Outbox:
+    """Bounded queue of encoded frames waiting to be written to one client.
+
+    Senders only append here, so a slow client never blocks the tick or a handler; the
+    connection's writer stage drains it. Reliable messages (join replies, map, responses)
+    are never dropped: if one does not fit, put() returns False and the client is
+    disconnected.
+    """
+
+    def __init__(self, max_messages: int = 256, max_bytes: int = 1024 * 1024, policy: str = 'coalesce'):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy!r}, expected one of {POLICIES}")
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._queue = deque()  # (reliable, data)
+        self._cond = threading.Condition()
+        self.closed = False
+        # FrameCompressor once the client accepted compression; applied by the writer, never here
+        self.compressor = None
+        # Metrics
+        self.bytes_pending = 0
+        self.peak_depth = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, data: bytes, reliable: bool = True) -> bool:
+        """Queue one encoded frame. Returns False if the client has to be disconnected."""
+        with self._cond:
+            if self.closed:
+                return False
+            if not reliable and self.policy == 'coalesce':
+                self.coalesced += self._remove_unreliable(all_of_them=True)
+            while self._is_full(len(data)):
+                if self.policy == 'disconnect':
+                    return False
+                if not self._remove_unreliable():
+                    if reliable:
+                        return False
+                    # Only reliable messages are waiting; this update is the one that gives way.
+                    self.dropped += 1
+                    return True
+                self.dropped += 1
+            self._queue.append((reliable, data))
+            self.bytes_pending += len(data)
+            self.peak_depth = max(self.peak_depth, len(self._queue))
+            self._cond.notify()
+            return True
+
+    def pop_all(self) -> bytes:
+        """Everything queued as one buffer, or b'' if nothing is waiting."""
+        with self._cond:
+            return self._pop_all()
+
+    def take(self, timeout: float = None):
+        """Block until something is queued and return it all, or None once the outbox is closed."""
+        with self._cond:
+            while not self._queue and not self.closed:
+                self._cond.wait(timeout)
+            if self.closed:
+                return None
+            return self._pop_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self.closed = True
+            self._queue.clear()
+            self.bytes_pending = 0
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        stats = {
+            'depth': len(self._queue),
+            'bytes_pending': self.bytes_pending,
+            'peak_depth': self.peak_depth,
+            'bytes_sent': self.bytes_sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+        }
+        if self.compressor is not None:
+            stats['compression'] = self.compressor.stats()
+        return stats
+
+    def _pop_all(self) -> bytes:
+        if not self._queue:
+            return b''
+        data = b''.join(frame for _, frame in self._queue)
+        self._queue.clear()
+        self.bytes_pending = 0
+        self.bytes_sent += len(data)
+        return data
+
+    def _is_full(self, size: int) -> bool:
+        # An empty queue takes any message, so one frame bigger than max_bytes (e.g. the map) still goes out.
+        return bool(self._queue) and (len(self._queue) >= self.max_messages or self.bytes_pending + size > self.max_bytes)
+
+    def _remove_unreliable(self, all_of_them: bool = False) -> int:
+        """Remove the oldest unreliable message (or all of them) and return how many were removed."""
+        removed = 0
+        kept = deque()
+        for reliable, data in self._queue:
+            if not reliable and (all_of_them or not removed):
+                self.bytes_pending -= len(data)
+                removed += 1
+            else:
+                kept.append((reliable, data))
+        if removed:
+            self._queue = kept
+        return removed
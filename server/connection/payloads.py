@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from shared.protocol import encode
+
+# Most frames kept; past that the least recently used go. Keys follow what clients ask for
+# (e.g. the chunk their player is in), so without a cap they could pile up.
+MAX_ENTRIES = 4096
+
+class PayloadCache:
+    """Encoded frames of messages many clients ask for (map outline, map chunks, entity dumps).
+
+    Each entry is stored per encoding together with the content version it was built from.
+    A request with the same version is answered with the stored bytes. Only a new version
+    (the map or the entities changed) makes it encode again.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self._frames = OrderedDict()  # (key, binary) -> (version, frame), least recently used first
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get(self, key, version, binary: bool, build) -> bytes:
+        """The encoded frame for `key` at `version`; `build()` returns the message on a miss."""
+        with self._lock:
+            entry = self._frames.get((key, binary))
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._frames.move_to_end((key, binary))
+                return entry[1]
+            self.misses += 1
+        frame = encode(build(), binary)
+        with self._lock:
+            self._frames[(key, binary)] = (version, frame)
+            self._frames.move_to_end((key, binary))
+            while len(self._frames) > self.max_entries:
+                self._frames.popitem(last=False)
+                self.evicted += 1
+        return frame
+
+    def clear(self) -> None:
+        with self._lock:
+            self._frames.clear()
+
+    def stats(self) -> dict:
+        """Safe to call from any thread (e.g. the metrics endpoint's) while frames are being added"""
+        with self._lock:
+            hits, misses, evicted = self.hits, self.misses, self.evicted
+            entries = len(self._frames)
+            size = sum(len(frame) for _, frame in self._frames.values())
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': entries,
+            'evicted': evicted,
+            'bytes': size,
+        }
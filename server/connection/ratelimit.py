@@ -0,0 +1,42 @@
+import time
+
+# Client messages are small (join, position, acks); anything bigger is a broken or hostile client.
+MAX_CLIENT_FRAME = 64 * 1024
+
+class InboundLimiter:
+    """Per-connection token bucket for incoming messages.
+
+    A client may send `rate` messages per second with bursts of up to `burst`. Messages over
+    the limit are dropped before they reach packet_handler, so a flooding client cannot fill
+    the update queue the tick drains. A client that has more than `kick_after` messages dropped
+    within one second is disconnected.
+    """
+
+    def __init__(self, rate: float = 60.0, burst: float = 120.0, kick_after: int = 600):
+        self.rate = rate
+        self.burst = burst
+        self.kick_after = kick_after
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.dropped = 0
+        self._window_start = self.last
+        self._window_dropped = 0
+
+    def allow(self) -> bool:
+        """Spend one token. False means drop the message."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        self.dropped += 1
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_dropped = 0
+        self._window_dropped += 1
+        return False
+
+    @property
+    def should_kick(self) -> bool:
+        return self._window_dropped > self.kick_after
@@ -0,0 +1,77 @@
+import secrets
+import time
+from typing import Dict, Tuple
+
+# Seconds a dropped client's player and snapshot baseline are kept for it to resume
+SESSION_GRACE = 10.0
+
+class _Parked:
+    __slots__ = ('entity_id', 'view', 'seq', 'expires')
+
+    def __init__(self, entity_id, view, seq, expires):
+        self.entity_id = entity_id  # player entity, left standing in the world meanwhile
+        self.view = view            # the client's ClientView: what it acknowledged and was sent
+        self.seq = seq              # newest input applied to the player
+        self.expires = expires
+
+class SessionStore:
+    """Resumable sessions, shared by both servers.
+
+    Every join is handed a token. When the connection drops, disconnect_handler parks the
+    session under that token instead of removing the player: the entity stays where it is
+    and the client's ClientView keeps its acknowledged baseline. A join that presents the
+    token within `grace` seconds takes the session over, and the next snapshot is a delta
+    from that baseline instead of a full one; the client also keeps its map. Tokens are
+    single use: a resumed session gets a new one.
+    """
+
+    def __init__(self, grace: float = SESSION_GRACE):
+        self.grace = grace
+        self._tokens: Dict[Tuple[str, int], str] = {}  # (ip, port) -> token of its live session
+        self._parked: Dict[str, _Parked] = {}           # token -> parked session, oldest first
+        # Metrics
+        self.issued = 0
+        self.resumed = 0
+        self.expired = 0
+
+    def issue(self, addr: Tuple[str, int]) -> str:
+        """A new token for a joined client"""
+        token = secrets.token_hex(16)
+        self._tokens[addr] = token
+        self.issued += 1
+        return token
+
+    def park(self, addr: Tuple[str, int], entity_id: int, view, seq) -> bool:
+        """Keep the session of a closed connection. False if it has none; remove its player then."""
+        token = self._tokens.pop(addr, None)
+        if token is None or view is None:
+            return False
+        self._parked[token] = _Parked(entity_id, view, seq, time.monotonic() + self.grace)
+        return True
+
+    def resume(self, token) -> _Parked:
+        """Take a parked session over, or None if the token is unknown or expired"""
+        parked = self._parked.get(token) if isinstance(token, str) else None
+        if parked is None or parked.expires < time.monotonic():
+            return None  # an expired one is left for expire() to clean up
+        del self._parked[token]
+        self.resumed += 1
+        return parked
+
+    def expire(self) -> list:
+        """Drop the sessions whose grace period ran out and return their player entity ids"""
+        if not self._parked:
+            return []
+        now = time.monotonic()
+        expired = []
+        # Parked in order with the same grace, so the expired ones are at the front
+        for token, parked in self._parked.items():
+            if parked.expires >= now:
+                break
+            expired.append(token)
+        self.expired += len(expired)
+        return [self._parked.pop(token).entity_id for token in expired]
+
+    def stats(self) -> dict:
+        return {'live': len(self._tokens), 'parked': len(self._parked), 'issued': self.issued,
+                'resumed': self.resumed, 'expired': self.expired}
@@ -0,0 +1,147 @@
+import secrets
+import threading
+from typing import Dict, Tuple
+from shared.datagram import MAX_DATAGRAM, TO_CLIENT, DatagramError, SequenceFilter, pack_to_client, unpack_to_server
+from shared.protocol import decode, encode_payload
+from connection.logic import packet_handler
+from connection.metrics import kind_of
+from connection.ratelimit import InboundLimiter
+
+# Messages a client may send over UDP; everything else has to come over its TCP connection.
+DATAGRAM_TYPES = ('update', 'ack')
+
+class _Session:
+    __slots__ = ('addr', 'token', 'endpoint', 'confirmed', 'sent_seq', 'received', 'limiter')
+
+    def __init__(self, addr, token, limiter):
+        self.addr = addr            # TCP address the session belongs to
+        self.token = token
+        self.endpoint = None        # UDP address the client last sent from
+        self.confirmed = False      # the client got our bind reply, so datagrams reach it
+        self.sent_seq = 0
+        self.received = SequenceFilter()
+        self.limiter = limiter
+
+class UDPChannel:
+    """Sessions of the UDP side channel (see shared/datagram.py), shared by both servers.
+
+    A session is opened at join and identified by its token. The server owns the socket:
+    it sets `sendto` once it is bound and passes every datagram it reads to
+    datagram_received(). send() returns False whenever the message has to go over TCP
+    instead: no confirmed endpoint yet, or too big for one datagram.
+    """
+
+    def __init__(self, server, port: int, max_datagram: int = MAX_DATAGRAM):
+        self.server = server
+        self.port = port
+        self.max_datagram = max_datagram
+        self.sendto = None  # (data, udp_addr) -> None
+        self._lock = threading.Lock()
+        self._tokens: Dict[int, _Session] = {}
+        self._sessions: Dict[Tuple[str, int], _Session] = {}  # TCP (ip, port) -> session
+        # Metrics
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0  # malformed, unknown token or a message type not allowed here
+        self.too_big = 0   # sent over TCP instead
+
+    def open(self, addr: Tuple[str, int]) -> int:
+        """Start a session for a joined client and return its token"""
+        limiter = InboundLimiter(self.server.rate_limit, self.server.rate_burst) if self.server.rate_limit else None
+        with self._lock:
+            old = self._sessions.pop(addr, None)
+            if old is not None:
+                del self._tokens[old.token]
+            token = secrets.randbits(64)
+            while token in self._tokens:
+                token = secrets.randbits(64)
+            session = _Session(addr, token, limiter)
+            self._tokens[token] = self._sessions[addr] = session
+        return token
+
+    def close(self, addr: Tuple[str, int]) -> None:
+        with self._lock:
+            session = self._sessions.pop(addr, None)
+            if session is not None:
+                del self._tokens[session.token]
+
+    def datagram_received(self, data: bytes, endpoint: Tuple[str, int]) -> None:
+        self.datagrams_in += 1
+        self.bytes_in += len(data)
+        try:
+            token, seq, payload = unpack_to_server(data)
+        except DatagramError:
+            self.rejected += 1
+            return
+        with self._lock:
+            session = self._tokens.get(token)
+            if session is None:
+                self.rejected += 1
+                return
+            if not session.received.accept(seq):
+                return
+            session.endpoint = endpoint
+            if not payload:
+                # Bind: answer so the client knows datagrams reach it
+                self._sendto(session, b'')
+                return
+            # The client only sends messages after it got our bind reply
+            session.confirmed = True
+        if session.limiter is not None and not session.limiter.allow():
+            self.server.metrics.rate_limited += 1
+            return
+        try:
+            message = decode(payload)
+        except ValueError:
+            self.rejected += 1
+            return
+        if message.get('type') not in DATAGRAM_TYPES:
+            self.rejected += 1
+            return
+        try:
+            packet_handler(self.server, session.addr, message, len(payload))
+        except ValueError:
+            # A datagram that does not match its schema is dropped; unlike a bad frame it cannot desync anything.
+            self.rejected += 1
+
+    def send(self, addr: Tuple[str, int], message: dict, binary: bool) -> bool:
+        """Send a message as one datagram. False means it was not sent and should go over TCP."""
+        with self._lock:
+            session = self._sessions.get(addr)
+            if session is None or not session.confirmed or self.sendto is None:
+                return False
+        payload = encode_payload(message, binary)
+        if len(payload) + TO_CLIENT.size > self.max_datagram:
+            self.too_big += 1
+            return False
+        with self._lock:
+            self._sendto(session, payload)
+        self.server.metrics.sent(kind_of(message), len(payload))
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'sessions': len(sessions),
+            'bound': sum(1 for s in sessions if s.confirmed),
+            'datagrams_in': self.datagrams_in,
+            'datagrams_out': self.datagrams_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'stale': sum(s.received.stale for s in sessions),
+            'rejected': self.rejected,
+            'too_big': self.too_big,
+        }
+
+    def _sendto(self, session: _Session, payload: bytes) -> None:
+        session.sent_seq += 1
+        data = pack_to_client(session.sent_seq, payload)
+        try:
+            self.sendto(data, session.endpoint)
+        except OSError:
+            return  # unreliable by design; the next snapshot tries again
+        self.datagrams_out += 1
+        self.bytes_out += len(data)
@@ -0,0 +1,88 @@
+import itertools
+from shared.mapchunks import CHUNK_SIZE, chunk_of
+from loader.content import yml_content
+
+# Most chunks one `get chunks` request may ask for; enough for a 9x9 area around the player.
+MAX_CHUNKS_PER_REQUEST = 81
+
+# Map content versions, unique across reloads so a cached payload never outlives its map
+_versions = itertools.count(1)
+
+class MapChunks:
+    """The tile map split into chunks once at startup, so serving a chunk is a dict lookup.
+
+    `version` changes whenever the map does and `chunk_version()` whenever one chunk does;
+    encoded payloads are cached against them.
+    """
+
+    def __init__(self, tile_map: dict, chunk_size: int = CHUNK_SIZE):
+        layout = tile_map.get('layout', {})
+        self.name = layout.get('name')
+        self.chunk_size = chunk_size
+        self.version = next(_versions)
+        # (cx, cy) -> tiles in that chunk, as in the map file
+        self.chunks = {}
+        # (cx, cy) -> version of its last change; chunks not listed are as loaded
+        self._chunk_versions = {}
+        self._loaded_version = self.version
+        for tile in layout.get('tiles', []):
+            self.chunks.setdefault(chunk_of(tile['x'], tile['y'], chunk_size), []).append(tile)
+        self._update_bounds()
+        self.tile_count = sum(len(tiles) for tiles in self.chunks.values())
+
+    def info(self) -> dict:
+        """What a client needs at join to start requesting chunks"""
+        return {'name': self.name, 'chunk_size': self.chunk_size, 'bounds': list(self.bounds)}
+
+    def chunk_version(self, cx: int, cy: int) -> int:
+        return self._chunk_versions.get((cx, cy), self._loaded_version)
+
+    def changed_chunks(self, since: int) -> list:
+        """Chunks changed after map version `since`"""
+        return [chunk for chunk, version in self._chunk_versions.items() if version > since]
+
+    def set_tile(self, x: int, y: int, tile: str, rot: int = 0) -> None:
+        """Place or replace one tile; only its chunk's cached payloads go stale."""
+        chunk = chunk_of(x, y, self.chunk_size)
+        tiles = self.chunks.setdefault(chunk, [])
+        for i, existing in enumerate(tiles):
+            if existing['x'] == x and existing['y'] == y:
+                tiles[i] = {'tile': tile, 'x': x, 'y': y, 'rot': rot}
+                break
+        else:
+            tiles.append({'tile': tile, 'x': x, 'y': y, 'rot': rot})
+            self.tile_count += 1
+        self.version = self._chunk_versions[chunk] = next(_versions)
+        self._update_bounds()
+
+    def chunk(self, cx: int, cy: int) -> dict:
+        """Body of a `chunk` response; a chunk with no tiles comes back empty."""
+        return {'x': cx, 'y': cy, 'size': self.chunk_size, 'tiles': self.chunks.get((cx, cy), [])}
+
+    def clamp(self, x: float, y: float) -> tuple:
+        """(x, y) moved onto the area the map's chunks cover; unchanged when the map is empty"""
+        min_cx, min_cy, max_cx, max_cy = self.bounds
+        if max_cx < min_cx:
+            return x, y
+        size = self.chunk_size
+        return (min(max(x, min_cx * size), (max_cx + 1) * size), min(max(y, min_cy * size), (max_cy + 1) * size))
+
+    def _update_bounds(self) -> None:
+        if self.chunks:
+            xs = [x for x, _ in self.chunks]
+            ys = [y for _, y in self.chunks]
+            self.bounds = (min(xs), min(ys), max(xs), max(ys))
+        else:
+            self.bounds = (0, 0, -1, -1)
+
+world_map = None
+
+def load_map() -> MapChunks:
+    """Split the loaded map content into chunks. Call after load_content()."""
+    global world_map
+    world_map = MapChunks(yml_content.get('map', {}))
+    print(f"Map {world_map.name!r}: {world_map.tile_count} tiles in {len(world_map.chunks)} chunks")
+    return world_map
+
+def get_map() -> MapChunks:
+    return world_map if world_map is not None else load_map()
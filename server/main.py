@@ -1,7 +1,93 @@
+import argparse
+import sys
+from pathlib import Path
+
+# shared/ (wire protocol used by client and server) lives at the repository root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
 from connection.main import TCPServer
+from connection.aio import AsyncTCPServer
+from connection.metrics import serve_stats, dump_stats
+from connection.outbox import POLICIES
+from connection.sessions import SESSION_GRACE
 from loader.content import load_content
+from loader.mapchunks import load_map
+from shard.frontend import run_sharded
+from update.persist import Persistence
+from update.grid import CHUNK_SIZE, VIEW_RADIUS
+from update.snapshot import SNAPSHOT_BUDGET
+
+SERVERS = {
+    'asyncio': AsyncTCPServer,
+    'threaded': TCPServer,
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="epic_multiplayer server")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5555)
+    parser.add_argument('--mode', choices=sorted(SERVERS), default='asyncio',
+                        help="asyncio: one event loop for all clients, threaded: one thread per client")
+    parser.add_argument('--tick-rate', type=int, default=20, help="simulation ticks per second (e.g. 20, 30, 60)")
+    parser.add_argument('--rate-limit', type=float, default=60.0, help="inbound messages/sec allowed per client, 0 disables")
+    parser.add_argument('--rate-burst', type=float, default=120.0, help="inbound message burst allowed per client")
+    parser.add_argument('--queue-policy', choices=POLICIES, default='coalesce',
+                        help="what to do when a client's outbound queue is full")
+    parser.add_argument('--queue-size', type=int, default=256, help="outbound messages queued per client")
+    parser.add_argument('--queue-bytes', type=int, default=1024 * 1024, help="outbound bytes queued per client")
+    parser.add_argument('--compress-threshold', type=int, default=512,
+                        help="deflate frames of at least this many bytes to clients that accept it, -1 disables")
+    parser.add_argument('--udp-port', type=int, default=None,
+                        help="port of the UDP side channel for snapshots and movement, defaults to --port, -1 disables")
+    parser.add_argument('--shards', type=int, default=0,
+                        help="split the map into this many regions, each ticked by its own process; 0 runs one process")
+    parser.add_argument('--shard-port', type=int, default=None,
+                        help="first localhost port of the shard processes, defaults to --port + 1")
+    parser.add_argument('--trust-clients', action='store_true',
+                        help="apply player positions as sent, without checking speed and walls")
+    parser.add_argument('--session-grace', type=float, default=SESSION_GRACE,
+                        help="seconds a dropped client can reconnect and resume where it left off, 0 disables (not with --shards)")
+    parser.add_argument('--world-file', default=None,
+                        help="keep the world in this file (snapshot plus FILE.journal) and restore it at startup (not with --shards)")
+    parser.add_argument('--snapshot-interval', type=float, default=60.0,
+                        help="seconds between world snapshots; the journal covers the ticks in between")
+    parser.add_argument('--stats-port', type=int, default=None,
+                        help="serve metrics as JSON on http://127.0.0.1:PORT/ (not with --shards)")
+    parser.add_argument('--stats-file', default=None, help="rewrite this file with metrics as JSON every --stats-interval")
+    parser.add_argument('--stats-interval', type=float, default=10.0, help="seconds between --stats-file dumps")
+    parser.add_argument('--snapshot-budget', type=int, default=SNAPSHOT_BUDGET,
+                        help="snapshot bytes per client per tick; further entity updates wait for later ticks, 0 disables")
+    parser.add_argument('--view-radius', type=int, default=VIEW_RADIUS,
+                        help=f"chunks of {CHUNK_SIZE}x{CHUNK_SIZE} tiles a client sees around itself, -1 for the whole world")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
+    args = parse_args()
     load_content()
-    server = TCPServer()
-    server.start() 
\ No newline at end of file
+    load_map()
+    options = dict(tick_rate=args.tick_rate, rate_limit=args.rate_limit, rate_burst=args.rate_burst,
+                   view_radius=args.view_radius if args.view_radius >= 0 else None,
+                   queue_policy=args.queue_policy, queue_size=args.queue_size, queue_bytes=args.queue_bytes,
+                   validate_moves=not args.trust_clients,
+                   snapshot_budget=args.snapshot_budget if args.snapshot_budget > 0 else None)
+    compress_threshold = args.compress_threshold if args.compress_threshold >= 0 else None
+    if args.shards > 0:
+        run_sharded(args.host, args.port, args.shards, args.shard_port or args.port + 1, SERVERS[args.mode],
+                    compress_threshold, options)
+    else:
+        server = SERVERS[args.mode](host=args.host, port=args.port, compress_threshold=compress_threshold,
+                                   udp_port=args.port if args.udp_port is None else (args.udp_port if args.udp_port >= 0 else None),
+                                   session_grace=args.session_grace,
+                                   **options)
+        if args.world_file is not None:
+            server.persistence = Persistence(args.world_file, args.snapshot_interval)
+            restored = server.persistence.load()
+            print(f"World {args.world_file!r}: {restored} entities restored in {server.persistence.load_ms:.0f} ms")
+            server.persistence.start()
+        if args.stats_port is not None:
+            serve_stats(server, args.stats_port)
+        if args.stats_file is not None:
+            dump_stats(server, args.stats_file, args.stats_interval)
+        server.start()
+        if server.persistence is not None:
+            server.persistence.close()
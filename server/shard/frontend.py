@@ -0,0 +1,211 @@
+import asyncio
+import multiprocessing
+import threading
+from shared.framing import FrameDecoder, FrameCompressor, encode_frame
+from shared.protocol import ProtocolError, decode, encode
+from connection.ratelimit import MAX_CLIENT_FRAME
+from loader.mapchunks import get_map
+from shard.regions import RegionMap
+from shard.worker import run_shard
+
+# How long a client's first connection waits for its shard to come up, in seconds
+SHARD_CONNECT_TIMEOUT = 5.0
+
+class ClientProxy:
+    """One client connection, relayed frame by frame to the shard that owns its player.
+
+    Frames are passed through without being decoded, except the join and its reply. The
+    front-end does the compression towards the client itself, so the client keeps a single
+    zlib stream however many shards it passes through. When its player crosses into
+    another region the old shard says so (a 'handoff'). The proxy then half-closes the old
+    connection, which lets that shard finish sending, and joins the new shard on the
+    player's behalf. The client sees nothing but a full snapshot.
+    """
+
+    def __init__(self, frontend: 'ShardFrontend', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.frontend = frontend
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.join = None
+        self.upstream = None     # StreamWriter to the current shard; None while switching shards
+        self.pending = []        # client frames that arrived while switching
+        self.compress = False
+        self.compressor = None
+        self.closed = False
+
+    async def run(self):
+        decoder = FrameDecoder(max_frame=MAX_CLIENT_FRAME)
+        try:
+            while not self.closed:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                decoder.feed(data)
+                for payload in decoder.frames():
+                    if self.join is None:
+                        await self.start(decode(payload))
+                    elif self.upstream is None:
+                        self.pending.append(encode_frame(bytes(payload)))
+                    else:
+                        self.upstream.write(encode_frame(bytes(payload)))
+        except (ConnectionError, OSError):
+            pass
+        except ValueError as e:
+            print(f"Dropping {self.addr}: malformed message ({e})")
+        finally:
+            self.close()
+
+    async def start(self, join: dict) -> None:
+        if join.get('type') != 'join':
+            raise ProtocolError("The first message must be a join")
+        join.pop('handoff', None)  # only the front-end may send those
+        join.pop('udp', None)      # no UDP side channel through the front-end
+        self.compress = join.pop('compression', None) == 'zlib' and self.frontend.compress_threshold is not None
+        self.join = join
+        position = join['data']['data']
+        shard = self.frontend.regions.shard_of(position.get('x', 0), position.get('y', 0))
+        await self.connect(shard, join, handoff=False, timeout=SHARD_CONNECT_TIMEOUT)
+
+    async def connect(self, shard: int, join: dict, handoff: bool, timeout: float = 0.0) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection('127.0.0.1', self.frontend.shard_ports[shard])
+                break
+            except OSError:
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.1)  # shard process still starting
+        key = (shard, writer.get_extra_info('sockname'))
+        self.frontend.proxies[key] = self
+        writer.write(encode(join, False))
+        for frame in self.pending:
+            writer.write(frame)
+        self.pending.clear()
+        self.upstream = writer
+        asyncio.get_running_loop().create_task(self.relay(key, reader, writer, handoff))
+
+    async def relay(self, key: tuple, reader: asyncio.StreamReader, upstream: asyncio.StreamWriter, handoff: bool):
+        """Copy frames from one shard connection to the client until that shard closes it."""
+        decoder = FrameDecoder(initial_size=65536)
+        joined = False
+        try:
+            while not self.closed:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                decoder.feed(data)
+                frames = []
+                for payload in decoder.frames():
+                    if not joined:
+                        # The shard's 'joined' reply, always JSON
+                        joined = True
+                        if handoff:
+                            continue  # the client joined long ago
+                        reply = decode(payload)
+                        if self.compress:
+                            reply['compression'] = 'zlib'
+                        frames.append(encode(reply, False))
+                        continue
+                    frames.append(encode_frame(bytes(payload)))
+                if frames:
+                    out = b''.join(frames)
+                    if self.compressor is not None:
+                        out = self.compressor.compress(out)
+                    self.writer.write(out)
+                    if self.compress and self.compressor is None:
+                        # Everything after the 'joined' reply may be deflated
+                        self.compressor = FrameCompressor(self.frontend.compress_threshold)
+                    await self.writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self.frontend.proxies.pop(key, None)
+            upstream.close()
+            if upstream is self.upstream:
+                # Not a handoff: the shard dropped the client
+                self.close()
+
+    async def switch(self, shard: int, state: dict, tick: int, seq) -> None:
+        """Move the client to `shard`, which already owns its player."""
+        old, self.upstream = self.upstream, None
+        if old is not None and old.can_write_eof():
+            old.write_eof()  # the old shard sends what it still has, then closes
+        join = dict(self.join)
+        join['data'] = {'type': 'player', 'data': {'x': state['x'], 'y': state['y']}}
+        join['handoff'] = {'entity': state, 'tick': tick, 'seq': seq}
+        try:
+            await self.connect(shard, join, handoff=True)
+        except OSError as e:
+            print(f"Dropping {self.addr}: shard {shard} unreachable ({e})")
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self.upstream is not None:
+            self.upstream.close()
+        self.writer.close()
+
+class ShardFrontend:
+    """Accepts every client and relays it to the shard owning its player (see ClientProxy)."""
+
+    def __init__(self, host: str, port: int, regions: RegionMap, shard_ports: list, inbox, compress_threshold=512):
+        self.host = host
+        self.port = port
+        self.regions = regions
+        self.shard_ports = shard_ports
+        self.inbox = inbox
+        self.compress_threshold = compress_threshold  # smallest frame worth deflating, None disables compression
+        # (shard, address that shard sees) -> proxy, to find the client a handoff is about
+        self.proxies = {}
+        self.loop = None
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self._read_inbox, daemon=True).start()
+        server = await asyncio.start_server(self._accept, self.host, self.port, reuse_address=True)
+        print(f"Front-end started on {self.host}:{self.port} for {self.regions.count} shards")
+        async with server:
+            await server.serve_forever()
+
+    async def _accept(self, reader, writer):
+        await ClientProxy(self, reader, writer).run()
+
+    def _read_inbox(self):
+        while True:
+            message = self.inbox.get()
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message: tuple) -> None:
+        if message[0] == 'handoff':
+            _, shard, addr, target, state, tick, seq = message
+            proxy = self.proxies.get((shard, tuple(addr)))
+            if proxy is not None and not proxy.closed:
+                self.loop.create_task(proxy.switch(target, state, tick, seq))
+
+def run_sharded(host: str, port: int, shards: int, shard_port: int, server_class, compress_threshold, options: dict):
+    """Run one large world on `shards` processes behind a front-end on host:port. Call after load_map()."""
+    world_map = get_map()
+    regions = RegionMap(world_map.bounds, shards, world_map.chunk_size)
+    inboxes = [multiprocessing.Queue() for _ in range(shards)]
+    frontend_inbox = multiprocessing.Queue()
+    ports = [shard_port + i for i in range(shards)]
+    processes = [
+        multiprocessing.Process(target=run_shard, args=(i, shards, ports[i], inboxes, frontend_inbox, server_class, options),
+                                name=f"shard-{i}", daemon=True)
+        for i in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    frontend = ShardFrontend(host, port, regions, ports, frontend_inbox, compress_threshold)
+    try:
+        asyncio.run(frontend.serve())
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
+    finally:
+        for process in processes:
+            process.terminate()
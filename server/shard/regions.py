@@ -0,0 +1,49 @@
+"""
+Partition of the map into shard regions.
+
+The map's chunk columns are split into `count` vertical strips of (nearly) equal width and
+each strip is owned by one shard. Positions left or right of the map belong to the first or
+last strip, so every position has exactly one owner.
+"""
+from bisect import bisect_right
+from shared.mapchunks import CHUNK_SIZE
+
+class RegionMap:
+    def __init__(self, bounds: tuple, count: int, chunk_size: int = CHUNK_SIZE):
+        if count < 1:
+            raise ValueError("A sharded world needs at least one region")
+        min_cx, _, max_cx, _ = bounds
+        width = max(1, max_cx - min_cx + 1)
+        self.count = count
+        self.chunk_size = chunk_size
+        # First chunk column of regions 1..count-1; region 0 starts at minus infinity
+        self.edges = [min_cx + (width * i + count - 1) // count for i in range(1, count)]
+
+    def shard_of_column(self, cx: int) -> int:
+        return bisect_right(self.edges, cx)
+
+    def shard_of(self, x: float, y: float) -> int:
+        """Region owning tile position (x, y)"""
+        return self.shard_of_column(int(x // self.chunk_size))
+
+    def columns(self, shard: int) -> tuple:
+        """(first, end) chunk columns of a region; None means unbounded on that side"""
+        first = self.edges[shard - 1] if shard > 0 else None
+        end = self.edges[shard] if shard < self.count - 1 else None
+        return first, end
+
+    def owns(self, shard: int, x: float, slack: float = 0.0) -> bool:
+        """True while tile column x is inside the region, or less than `slack` tiles past its edges.
+
+        The slack keeps an entity walking along a border from being handed back and forth.
+        """
+        first, end = self.columns(shard)
+        if first is not None and x < first * self.chunk_size - slack:
+            return False
+        if end is not None and x >= end * self.chunk_size + slack:
+            return False
+        return True
+
+    def shards_near(self, cx: int, margin: int) -> range:
+        """Regions with a chunk column within `margin` columns of column cx (strips are ordered)"""
+        return range(self.shard_of_column(cx - margin), self.shard_of_column(cx + margin) + 1)
@@ -0,0 +1,175 @@
+import queue
+import time
+from update import data
+from update.data import entities, grid, spawn_entity, update_entity, remove_entity, skip_to_tick
+from connection.logic import players, views, inputs, links
+from shard.regions import RegionMap
+
+# Tiles an entity has to be past a region edge before it is handed off
+HANDOFF_SLACK = 1.0
+# Seconds a handed-off player waits on its new shard for the client's connection to follow
+ATTACH_TIMEOUT = 10.0
+
+class ShardLink:
+    """One shard's side of a sharded world; its TickLoop calls step() every tick.
+
+    Messages between processes are plain tuples on multiprocessing queues, one inbox per shard
+    plus one for the front-end:
+
+        ('entity', state, tick)            to a shard: you own this entity now
+        ('ghosts', shard, {id: state})     to a shard: my entities near your region this tick
+        ('handoff', shard, addr, to, state, tick, seq)
+                                           to the front-end: move the client on `addr` to shard `to`
+
+    Entities owned by a neighbouring shard within `margin` chunks of our region are kept as
+    read-only ghosts in the entity store, so clients near a border see across it. A ghost
+    that gets handed to us turns into an owned entity under the same id, so clients see it
+    carry on instead of disappearing and coming back.
+    """
+
+    def __init__(self, index: int, regions: RegionMap, inboxes: list, frontend, margin: int):
+        self.index = index
+        self.regions = regions
+        self.inboxes = inboxes
+        self.frontend = frontend
+        self.margin = margin
+        self.ghost_ids = set()
+        self.ghosts = {}           # shard -> {id: state} it last published to us
+        self._published = {}       # shard -> {id: state} we last published to it
+        self._waiting = {}         # player id -> deadline for its client to attach
+        # Metrics
+        self.handed_off = 0
+        self.adopted = 0
+
+    def step(self, moved) -> None:
+        """Exchange entities with the other shards. Call with data.lock held, after moving `moved`."""
+        self._receive()
+        for entity_id in moved:
+            entity = entities.get(entity_id)
+            if entity is None or entity_id in self.ghost_ids:
+                continue
+            if not self.regions.owns(self.index, entity['x'], HANDOFF_SLACK):
+                self._hand_off(entity_id, entity)
+        self._publish_ghosts()
+        now = time.monotonic()
+        for entity_id, deadline in list(self._waiting.items()):
+            if now > deadline:
+                # Its client never showed up (disconnected during the handoff)
+                del self._waiting[entity_id]
+                remove_entity(entity_id)
+
+    def adopt(self, state: dict) -> int:
+        """Own an entity handed over by another shard; a ghost of it becomes the real thing.
+
+        The same handoff arrives twice for a player, once in its inbox message and once in its
+        client's join, in either order; the second one is ignored.
+        """
+        entity_id = state['id']
+        if entity_id in entities and entity_id not in self.ghost_ids:
+            # Already ours: it may have moved since, so `state` is stale
+            return entity_id
+        for ghosts in self.ghosts.values():
+            ghosts.pop(entity_id, None)
+        self.ghost_ids.discard(entity_id)
+        if entity_id in entities:
+            update_entity(entity_id, x=state['x'], y=state['y'], rot=state['rot'])
+        else:
+            spawn_entity(state['proto'], state['x'], state['y'], state['rot'], entity_id=entity_id)
+        self.adopted += 1
+        return entity_id
+
+    def attach(self, state: dict, tick: int) -> int:
+        """Take over a player whose client followed it here (join with 'handoff'); returns its id."""
+        # Our snapshots must continue after the ones the client already has from the old shard.
+        skip_to_tick(tick + 1)
+        self._waiting.pop(state['id'], None)
+        return self.adopt(state)
+
+    def stats(self) -> dict:
+        return {'shard': self.index, 'owned': len(entities) - len(self.ghost_ids), 'ghosts': len(self.ghost_ids),
+                'handed_off': self.handed_off, 'adopted': self.adopted}
+
+    def _hand_off(self, entity_id: int, entity: dict) -> None:
+        target = self.regions.shard_of(entity['x'], entity['y'])
+        state = dict(entity)
+        tick = data.current_tick()
+        self.inboxes[target].put(('entity', state, tick))
+        addr = next((a for a, i in players.items() if i == entity_id), None)
+        if addr is not None:
+            # The client's connection follows its player; this one is closed by the front-end.
+            del players[addr]
+            views.pop(addr, None)
+            links.pop(addr, None)
+            self.frontend.put(('handoff', self.index, addr, target, state, tick, inputs.pop(entity_id, None)))
+        # Keep it as a ghost of its new owner until that shard publishes it
+        self.ghost_ids.add(entity_id)
+        self.ghosts.setdefault(target, {})[entity_id] = state
+        self.handed_off += 1
+
+    def _receive(self) -> None:
+        inbox = self.inboxes[self.index]
+        while True:
+            try:
+                message = inbox.get_nowait()
+            except queue.Empty:
+                return
+            if message[0] == 'entity':
+                _, state, tick = message
+                self.adopt(state)
+                if state['proto'] == 'player' and state['id'] not in players.values():
+                    self._waiting[state['id']] = time.monotonic() + ATTACH_TIMEOUT
+            elif message[0] == 'ghosts':
+                self._update_ghosts(message[1], message[2])
+
+    def _update_ghosts(self, shard: int, states: dict) -> None:
+        previous = self.ghosts.get(shard, {})
+        for entity_id, state in states.items():
+            if entity_id in entities and entity_id not in self.ghost_ids:
+                continue  # ours by now; that shard has not heard yet
+            if entity_id in entities:
+                update_entity(entity_id, x=state['x'], y=state['y'], rot=state['rot'])
+            else:
+                spawn_entity(state['proto'], state['x'], state['y'], state['rot'], entity_id=entity_id)
+                self.ghost_ids.add(entity_id)
+        self.ghosts[shard] = states
+        for entity_id in previous.keys() - states.keys():
+            if entity_id in self.ghost_ids and not any(entity_id in g for g in self.ghosts.values()):
+                self.ghost_ids.discard(entity_id)
+                remove_entity(entity_id)
+
+    def _publish_ghosts(self) -> None:
+        if self.regions.count == 1:
+            return
+        outgoing = {shard: {} for shard in range(self.regions.count) if shard != self.index}
+        for (cx, cy), ids in grid.cells.items():
+            near = self.regions.shards_near(cx, self.margin)
+            if len(near) == 1:
+                continue  # nowhere near a border
+            for entity_id in ids:
+                if entity_id in self.ghost_ids:
+                    continue
+                state = None
+                for shard in near:
+                    if shard != self.index:
+                        if state is None:
+                            state = dict(entities[entity_id])
+                        outgoing[shard][entity_id] = state
+        for shard, states in outgoing.items():
+            if states != self._published.get(shard, {}):
+                self._published[shard] = states
+                self.inboxes[shard].put(('ghosts', self.index, states))
+
+def run_shard(index: int, count: int, port: int, inboxes: list, frontend, server_class, options: dict) -> None:
+    """Entry point of a shard process: one region of the world with its own tick, on localhost."""
+    from loader.content import load_content
+    from loader.mapchunks import load_map
+    load_content()
+    world_map = load_map()
+    data.set_id_space(index + 1, count)
+    regions = RegionMap(world_map.bounds, count, world_map.chunk_size)
+    server = server_class(host='127.0.0.1', port=port, udp_port=None, compress_threshold=None, session_grace=0, **options)
+    # Ghosts must reach as far as a client can see; at least one chunk so a handed-off entity is always published back
+    margin = max(1, server.view_radius) if server.view_radius is not None else 1 << 30
+    server.shard = ShardLink(index, regions, inboxes, frontend, margin)
+    print(f"Shard {index}: chunk columns {regions.columns(index)}")
+    server.start()
@@ -1,2 +1,162 @@
-updates = []
-entities = {}
\ No newline at end of file
+import itertools
+import math
+import threading
+from collections import deque
+from update.grid import SpatialGrid
+from update.walls import WallGrid
+
+# How many past ticks of change history are kept for building deltas, at least; set_history()
+# keeps more when sessions can be resumed after a longer gap.
+CHANGE_LOG_TICKS = 64
+# Seconds of history kept on top of that gap, for the ticks the client had not acknowledged yet
+CHANGE_LOG_SLACK = 1.0
+
+# Player updates queued by the connection handlers as (entity_id, data), drained once per tick.
+updates = deque()
+# Authoritative world state: entity id -> {'id', 'proto', 'x', 'y', 'rot'}. Positions are in tiles.
+entities = {}
+# The same entities filed by chunk, kept in step with `entities` by the functions below.
+grid = SpatialGrid()
+# Wall tiles and the tiles wall entities stand on, for validating player moves
+walls = WallGrid()
+# Guards `entities` when the threaded server's handler threads and the tick thread both touch it.
+lock = threading.RLock()
+
+_next_id = itertools.count(1)
+# Bumped by every change to `entities`; cached entity payloads are keyed by it.
+_version = 0
+
+# Tick the next snapshot will be sent for; every change is stamped with it.
+_tick = 1
+# entity id -> {field: tick it last changed}
+_field_ticks = {}
+# Ids changed during the pending tick, and (tick, ids) for closed ticks, oldest first.
+_dirty = set()
+change_log = deque(maxlen=CHANGE_LOG_TICKS)
+# changed_since() results for the pending tick: base tick -> (len(_dirty) when built, ids).
+# Clients that acknowledged the same tick share one result; _dirty only grows until end_tick.
+_changed_cache = {}
+
+def current_tick() -> int:
+    return _tick
+
+def entities_version() -> int:
+    return _version
+
+def skip_to_tick(tick: int) -> None:
+    """Move the pending tick forward to `tick` (never back), e.g. to stay ahead of the ticks a
+    client handed over from another shard has already seen. Skipped ticks simply had no changes."""
+    global _tick
+    _tick = max(_tick, tick)
+
+def set_id_space(start: int, step: int) -> None:
+    """Allocate ids start, start + step, ... so several shards never hand out the same id."""
+    global _next_id
+    _next_id = itertools.count(start, step)
+
+def set_history(seconds: float, tick_rate: int) -> None:
+    """Keep enough change history for a delta against a baseline `seconds` old at `tick_rate` ticks
+    per second, e.g. for a client resuming its session within the grace period."""
+    global change_log
+    ticks = max(CHANGE_LOG_TICKS, math.ceil((seconds + CHANGE_LOG_SLACK) * tick_rate))
+    if ticks != change_log.maxlen:
+        change_log = deque(change_log, maxlen=ticks)
+
+def end_tick() -> int:
+    """Close the pending tick after its snapshots were built and return the new pending tick."""
+    global _tick, _dirty
+    change_log.append((_tick, frozenset(_dirty)))
+    _dirty = set()
+    _changed_cache.clear()
+    _tick += 1
+    return _tick
+
+def spawn_entity(proto: str, x: float = 0, y: float = 0, rot: float = 0, entity_id: int = None) -> int:
+    """Create an entity and return its id. `entity_id` keeps the id of one moved in from another shard."""
+    global _version
+    if entity_id is None:
+        entity_id = next(_next_id)
+    elif entity_id in entities:
+        raise ValueError(f"Entity {entity_id} already exists")
+    _version += 1
+    entities[entity_id] = {'id': entity_id, 'proto': proto, 'x': x, 'y': y, 'rot': rot}
+    _field_ticks[entity_id] = dict.fromkeys(entities[entity_id], _tick)
+    grid.insert(entity_id, x, y)
+    walls.place(entity_id, proto, x, y)
+    _dirty.add(entity_id)
+    return entity_id
+
+def restore_entities(state: dict) -> None:
+    """Fill the empty store with id -> (proto, x, y, rot) at startup; spawn_entity for a whole world at once."""
+    global _version
+    for entity_id, (proto, x, y, rot) in state.items():
+        entities[entity_id] = {'id': entity_id, 'proto': proto, 'x': x, 'y': y, 'rot': rot}
+        _field_ticks[entity_id] = {'id': _tick, 'proto': _tick, 'x': _tick, 'y': _tick, 'rot': _tick}
+        grid.insert(entity_id, x, y)
+        walls.place(entity_id, proto, x, y)
+    _dirty.update(state)
+    _version += 1
+
+def update_entity(entity_id: int, **fields) -> bool:
+    """Set fields on an existing entity. Returns False if it does not exist."""
+    global _version
+    entity = entities.get(entity_id)
+    if entity is None:
+        return False
+    ticks = _field_ticks[entity_id]
+    for key, value in fields.items():
+        if entity.get(key) != value:
+            entity[key] = value
+            ticks[key] = _tick
+            _dirty.add(entity_id)
+            _version += 1
+    if 'x' in fields or 'y' in fields:
+        grid.move(entity_id, entity['x'], entity['y'])
+        walls.move(entity_id, entity['x'], entity['y'])
+    return True
+
+def remove_entity(entity_id: int) -> None:
+    global _version
+    if entities.pop(entity_id, None) is not None:
+        _version += 1
+        del _field_ticks[entity_id]
+        grid.remove(entity_id)
+        walls.remove(entity_id)
+        _dirty.add(entity_id)
+
+def visible_from(entity_id: int, radius) -> set:
+    """Ids within `radius` chunks of an entity; every id when radius is None, nothing if it does not exist."""
+    if radius is None:
+        return set(entities)
+    center = grid.chunk_of(entity_id)
+    return grid.query(center, radius) if center is not None else set()
+
+def changed_since(tick: int):
+    """Ids of entities created, changed or removed after `tick`, or None if that is older than the log."""
+    if tick + 1 < _tick and (not change_log or change_log[0][0] > tick + 1):
+        return None
+    cached = _changed_cache.get(tick)
+    if cached is not None and cached[0] == len(_dirty):
+        return cached[1]
+    changed = set(_dirty)
+    for logged_tick, ids in reversed(change_log):
+        if logged_tick <= tick:
+            break
+        changed |= ids
+    _changed_cache[tick] = (len(_dirty), changed)
+    return changed
+
+def changed_fields(entity_id: int, since: int) -> dict:
+    """The fields of an entity that changed after tick `since`, plus its id."""
+    entity = entities[entity_id]
+    delta = {key: entity[key] for key, changed in _field_ticks[entity_id].items() if changed > since}
+    delta['id'] = entity_id
+    return delta
+
+def drain_updates() -> dict:
+    """Pop every queued update, keeping only the newest one per entity."""
+    latest = {}
+    while updates:
+        entity_id, data = updates.popleft()
+        latest[entity_id] = data
+    return latest
@@ -0,0 +1,74 @@
+"""
+Uniform spatial grid used for interest management.
+
+The world is split into square chunks of CHUNK_SIZE tiles. Every entity is filed under the
+chunk its position falls in, so "which entities are near this point" only touches the
+chunks around it instead of the whole world.
+"""
+
+from shared.mapchunks import CHUNK_SIZE
+
+# Chunks around the player's own chunk a client sees: 2 -> a 5x5 chunk square
+VIEW_RADIUS = 2
+
+class SpatialGrid:
+    """Entity ids bucketed by chunk coordinate.
+
+    Moving an entity inside its chunk costs a dict lookup; only crossing a chunk border
+    touches the buckets.
+    """
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        # (cx, cy) -> ids in that chunk; empty chunks are dropped
+        self.cells = {}
+        # id -> (cx, cy)
+        self.chunks = {}
+
+    def chunk(self, x: float, y: float) -> tuple:
+        """Chunk coordinate of a tile position"""
+        return int(x // self.chunk_size), int(y // self.chunk_size)
+
+    def insert(self, entity_id: int, x: float, y: float) -> None:
+        chunk = self.chunk(x, y)
+        self.chunks[entity_id] = chunk
+        self.cells.setdefault(chunk, set()).add(entity_id)
+
+    def move(self, entity_id: int, x: float, y: float) -> bool:
+        """Refile an entity after it moved. Returns True if it changed chunk."""
+        chunk = self.chunk(x, y)
+        old = self.chunks.get(entity_id)
+        if old == chunk:
+            return False
+        if old is not None:
+            self._discard(old, entity_id)
+        self.chunks[entity_id] = chunk
+        self.cells.setdefault(chunk, set()).add(entity_id)
+        return True
+
+    def remove(self, entity_id: int) -> None:
+        chunk = self.chunks.pop(entity_id, None)
+        if chunk is not None:
+            self._discard(chunk, entity_id)
+
+    def chunk_of(self, entity_id: int):
+        """Chunk an entity is filed under, or None if it is not in the grid"""
+        return self.chunks.get(entity_id)
+
+    def query(self, center: tuple, radius: int) -> set:
+        """Ids in every chunk within `radius` chunks of `center` (a square, not a circle)."""
+        cx, cy = center
+        cells = self.cells
+        found = set()
+        for gx in range(cx - radius, cx + radius + 1):
+            for gy in range(cy - radius, cy + radius + 1):
+                ids = cells.get((gx, gy))
+                if ids:
+                    found |= ids
+        return found
+
+    def _discard(self, chunk: tuple, entity_id: int) -> None:
+        ids = self.cells[chunk]
+        ids.discard(entity_id)
+        if not ids:
+            del self.cells[chunk]
@@ -0,0 +1,248 @@
+"""
+World persistence: a binary snapshot of every entity plus an append-only journal of the
+ticks since that snapshot.
+
+The tick loop calls record_tick() once per tick with the entity store locked. That copies
+the end state of every entity changed during the tick (or notes its removal) and queues it.
+At each snapshot interval it copies the whole store as well. One writer thread encodes and
+writes everything in queue order:
+
+    <path>          snapshot: header, type names, then one fixed-size record per entity
+    <path>.journal  one block per tick: (length, tick), then the tick's entity records and removed ids
+
+A snapshot is written to a temporary file and renamed over the old one, and only then is
+the journal emptied, so a crash at any point leaves a snapshot plus a journal that replays
+on top of it. Blocks of ticks before the snapshot's are skipped. The block of the snapshot's
+own tick is applied again, since the snapshot may have been taken halfway through that tick;
+a block holds end states, so applying it twice is harmless. A block cut short by a crash is
+ignored. Journal blocks are flushed to the OS every tick but not fsynced, so a process
+crash loses nothing and a power cut loses at most what the OS had not written out yet.
+
+Player entities are not persisted; they belong to connections, which do not survive a restart.
+"""
+import os
+import queue
+import struct
+import threading
+import time
+from update import data
+
+MAGIC = b'EMWORLD1'
+# magic, tick, highest entity id, number of type names
+SNAPSHOT_HEADER = struct.Struct('<8sQQI')
+NAME_LENGTH = struct.Struct('<H')
+COUNT = struct.Struct('<I')
+# id, type index, x, y, rot
+RECORD = struct.Struct('<QHddd')
+# payload length, tick
+BLOCK = struct.Struct('<IQ')
+# A block's payload: counts of new type names, upserts and removals, then those in that order
+BLOCK_COUNTS = struct.Struct('<HII')
+NAME_RECORD = struct.Struct('<HH')  # type index, name length; the name follows
+ID = struct.Struct('<Q')
+
+# Entity types that are never persisted
+TRANSIENT = ('player',)
+
+class Persistence:
+    """Snapshots and journals the entity store in data.py; see the module docstring."""
+
+    def __init__(self, path: str, snapshot_interval: float = 60.0):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.snapshot_interval = snapshot_interval
+        self._queue = queue.Queue()
+        self._last_snapshot = time.monotonic()
+        self._journal = None
+        self._journal_names = {}  # type name -> index in the current journal file
+        self._thread = None
+        # Metrics
+        self.snapshots = 0
+        self.last_snapshot_ms = 0.0  # copying the store in the tick
+        self.last_write_ms = 0.0     # encoding and writing it on the writer thread
+        self.journal_bytes = 0
+        self.load_ms = 0.0
+
+    def load(self) -> int:
+        """Restore the world from the snapshot and journal, if there are any, into the empty
+        store. Call at startup, before start(). Returns how many entities were restored.
+
+        The journal is folded into the snapshot's records first, so every entity is spawned
+        once in its final state however often it changed since the snapshot.
+        """
+        start = time.perf_counter()
+        highest, tick, state = 0, 0, {}
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                highest, tick = _read_snapshot(f.read(), state)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as f:
+                tick = max(tick, _replay_journal(f.read(), tick, state))
+        data.restore_entities(state)
+        highest = max(highest, max(state, default=0))
+        if highest:
+            data.set_id_space(highest + 1, 1)
+        # Continue after the restored ticks, and close the loading tick so it is not journaled again
+        data.skip_to_tick(tick + 1)
+        data.end_tick()
+        self.load_ms = (time.perf_counter() - start) * 1000
+        return len(data.entities)
+
+    def start(self) -> None:
+        """Start the writer thread, beginning with a fresh snapshot of what load() restored."""
+        self._journal = open(self.journal_path, 'ab')
+        self._thread = threading.Thread(target=self._write, name='persistence', daemon=True)
+        self._thread.start()
+        with data.lock:
+            self.snapshot()
+
+    def record_tick(self, tick: int) -> None:
+        """Queue the changes of the pending tick. Call from the tick with data.lock held, before end_tick()."""
+        entities = data.entities
+        changes = []
+        for entity_id in data.changed_since(tick - 1) or ():
+            entity = entities.get(entity_id)
+            if entity is None:
+                changes.append((entity_id, None))
+            elif entity['proto'] not in TRANSIENT:
+                changes.append((entity_id, entity['proto'], entity['x'], entity['y'], entity['rot']))
+        if changes:
+            self._queue.put(('journal', tick, changes))
+        if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.snapshot()
+
+    def snapshot(self) -> None:
+        """Queue a snapshot of the whole store. Call with data.lock held."""
+        start = time.perf_counter()
+        state = [(e['id'], e['proto'], e['x'], e['y'], e['rot'])
+                 for e in data.entities.values() if e['proto'] not in TRANSIENT]
+        self._queue.put(('snapshot', data.current_tick(), state))
+        self._last_snapshot = time.monotonic()
+        self.last_snapshot_ms = (time.perf_counter() - start) * 1000
+
+    def close(self, final_snapshot: bool = True) -> None:
+        """Write a last snapshot, wait until everything queued is on disk and stop the writer."""
+        if self._thread is None:
+            return
+        if final_snapshot:
+            with data.lock:
+                self.snapshot()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def stats(self) -> dict:
+        return {'snapshots': self.snapshots, 'last_snapshot_ms': self.last_snapshot_ms, 'last_write_ms': self.last_write_ms,
+                'journal_bytes': self.journal_bytes, 'queued': self._queue.qsize(), 'load_ms': self.load_ms}
+
+    def _write(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._journal.close()
+                return
+            kind, tick, payload = item
+            if kind == 'journal':
+                block = self._encode_block(payload)
+                self._journal.write(BLOCK.pack(len(block), tick) + block)
+                self._journal.flush()
+                self.journal_bytes += BLOCK.size + len(block)
+            else:
+                start = time.perf_counter()
+                tmp = f"{self.path}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(_encode_snapshot(tick, payload))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                # Everything journaled so far is in the snapshot now
+                self._journal.truncate(0)
+                self._journal.seek(0)
+                self._journal_names.clear()
+                self.journal_bytes = 0
+                self.snapshots += 1
+                self.last_write_ms = (time.perf_counter() - start) * 1000
+
+    def _encode_block(self, changes: list) -> bytes:
+        names = self._journal_names
+        new_names = []
+        upserts = []
+        removed = []
+        for change in changes:
+            if change[1] is None:
+                removed.append(ID.pack(change[0]))
+                continue
+            entity_id, proto, x, y, rot = change
+            index = names.get(proto)
+            if index is None:
+                index = names[proto] = len(names)
+                name = proto.encode()
+                new_names.append(NAME_RECORD.pack(index, len(name)) + name)
+            upserts.append(RECORD.pack(entity_id, index, x, y, rot))
+        return b''.join([BLOCK_COUNTS.pack(len(new_names), len(upserts), len(removed))] + new_names + upserts + removed)
+
+def _encode_snapshot(tick: int, state: list) -> bytes:
+    names = {}
+    for _, proto, _, _, _ in state:
+        if proto not in names:
+            names[proto] = len(names)
+    parts = [SNAPSHOT_HEADER.pack(MAGIC, tick, max((s[0] for s in state), default=0), len(names))]
+    for name in names:
+        encoded = name.encode()
+        parts.append(NAME_LENGTH.pack(len(encoded)) + encoded)
+    body = bytearray(COUNT.size + RECORD.size * len(state))
+    COUNT.pack_into(body, 0, len(state))
+    offset = COUNT.size
+    for entity_id, proto, x, y, rot in state:
+        RECORD.pack_into(body, offset, entity_id, names[proto], x, y, rot)
+        offset += RECORD.size
+    parts.append(body)
+    return b''.join(parts)
+
+def _read_snapshot(buf: bytes, state: dict) -> tuple:
+    """Read a snapshot into `state` (id -> (type, x, y, rot)); returns (highest id, tick)"""
+    magic, tick, highest, name_count = SNAPSHOT_HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError(f"Not a world snapshot (magic {magic!r})")
+    offset = SNAPSHOT_HEADER.size
+    names = []
+    for _ in range(name_count):
+        (length,) = NAME_LENGTH.unpack_from(buf, offset)
+        offset += NAME_LENGTH.size
+        names.append(bytes(buf[offset:offset + length]).decode())
+        offset += length
+    (count,) = COUNT.unpack_from(buf, offset)
+    offset += COUNT.size
+    for entity_id, index, x, y, rot in RECORD.iter_unpack(memoryview(buf)[offset:offset + count * RECORD.size]):
+        state[entity_id] = (names[index], x, y, rot)
+    return highest, tick
+
+def _replay_journal(buf: bytes, since: int, state: dict) -> int:
+    """Apply the journal blocks of tick `since` and later to `state`; returns the last tick"""
+    view = memoryview(buf)
+    names = {}
+    last_tick = 0
+    offset = 0
+    while offset + BLOCK.size <= len(buf):
+        length, tick = BLOCK.unpack_from(buf, offset)
+        offset += BLOCK.size
+        end = offset + length
+        if end > len(buf):
+            break  # the write of this block was cut short
+        name_count, upsert_count, remove_count = BLOCK_COUNTS.unpack_from(buf, offset)
+        offset += BLOCK_COUNTS.size
+        for _ in range(name_count):
+            index, size = NAME_RECORD.unpack_from(buf, offset)
+            offset += NAME_RECORD.size
+            names[index] = bytes(view[offset:offset + size]).decode()
+            offset += size
+        if tick >= since:
+            upserts = view[offset:offset + upsert_count * RECORD.size]
+            for entity_id, index, x, y, rot in RECORD.iter_unpack(upserts):
+                state[entity_id] = (names[index], x, y, rot)
+            removes = offset + upsert_count * RECORD.size
+            for (entity_id,) in ID.iter_unpack(view[removes:removes + remove_count * ID.size]):
+                state.pop(entity_id, None)
+            last_tick = max(last_tick, tick)
+        offset = end
+    return last_tick
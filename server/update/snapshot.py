@@ -0,0 +1,144 @@
+import math
+from collections import OrderedDict
+from update.data import entities, changed_since, changed_fields
+
+# Unacknowledged snapshots kept per client. A client that falls further behind gets a full resync.
+MAX_PENDING = 32
+# Bytes of snapshot entity data each client may be sent per tick by default; see ClientView.build
+SNAPSHOT_BUDGET = 8192
+# Snapshot bytes besides the entities: header, input echo and framing, and each removed id
+SNAPSHOT_OVERHEAD = 48
+REMOVED_BYTES = 4
+# How much more an entity type's updates matter than the default of 1
+IMPORTANCE = {'player': 4.0}
+# Ticks an entity the client has never been sent counts as waiting
+NEW_AGE = 8
+
+class ClientView:
+    """Per-client snapshot state: what was sent each tick and the newest tick the client acknowledged.
+
+    Deltas are built against the acknowledged baseline, so a lost or late snapshot never
+    leaves the client with a gap: every later delta repeats whatever it missed. An entity
+    coming into view is sent whole like a new one, and one going out of view is listed
+    in `removed` like a deleted one.
+
+    With a byte budget, a snapshot carries the entity updates that fit it, most important
+    first, and the rest are owed: recorded with the snapshot and sent whole in a later one.
+    """
+
+    def __init__(self, entity_id: int = None):
+        # Player entity whose position decides what this client can see
+        self.entity_id = entity_id
+        self.acked = None
+        # tick -> (ids the client has after applying it, ids it removed (None for a full
+        # snapshot), ids whose updates were deferred and are still owed)
+        self.sent = OrderedDict()
+        # entity id -> tick it was last put in a snapshot, for ranking; visible entities only
+        self.last_sent = {}
+        # Metrics
+        self.deferred = 0  # entity updates held back for later ticks, in total
+        self.owed = 0      # held back by the newest snapshot
+
+    def ack(self, tick: int) -> None:
+        if tick not in self.sent or (self.acked is not None and tick <= self.acked):
+            return
+        self.acked = tick
+        while next(iter(self.sent)) < tick:
+            self.sent.popitem(last=False)
+
+    def resync(self) -> None:
+        """Forget the baseline so the next snapshot is a full one."""
+        self.acked = None
+        self.sent.clear()
+
+    def build(self, tick: int, visible: set, budget: int = None) -> dict:
+        """Build the snapshot for `tick` covering the entity ids in `visible`, in at most
+        `budget` bytes of (binary encoded) snapshot when one is given."""
+        base = self.acked
+        changed = changed_since(base) if base is not None else None
+        if changed is None or len(self.sent) >= MAX_PENDING:
+            # Full snapshot. Older entries stay so an ack that is still in flight can become the baseline.
+            self.acked = None
+            while len(self.sent) >= MAX_PENDING:
+                self.sent.popitem(last=False)
+            # The client drops whatever a full snapshot leaves out, so deferred entities simply
+            # are not part of what it has; the next delta sends them as new ones.
+            states, deferred = self._fit([dict(entities[i]) for i in visible], tick, budget, 0)
+            self.sent[tick] = (frozenset(visible) - deferred, None, frozenset())
+            return {'tick': tick, 'base': None, 'entities': states, 'removed': []}
+
+        known, _, owed = self.sent[base]
+        maybe_known = set(known)
+        removed_since = set()
+        for sent_tick, (ids, removed, _) in self.sent.items():
+            if sent_tick > base:
+                if removed is None:
+                    # A full snapshot drops everything it does not list.
+                    removed_since |= maybe_known - ids
+                else:
+                    removed_since |= removed
+                maybe_known |= ids
+
+        removed = maybe_known - visible
+        # New to the client, removed from it since the baseline, or deferred before the
+        # baseline so we do not know which fields it lacks: send everything.
+        full = (visible - known) | (visible & removed_since) | (visible & owed)
+        partial = (visible & known & changed) - removed_since - full
+        for entity_id in removed:
+            self.last_sent.pop(entity_id, None)
+
+        states, deferred = self._fit([dict(entities[i]) for i in full] + [changed_fields(i, base) for i in partial],
+                                     tick, budget, len(removed) * REMOVED_BYTES)
+        self.sent[tick] = (frozenset(visible), frozenset(removed), deferred)
+        return {
+            'tick': tick,
+            'base': base,
+            'entities': states,
+            'removed': list(removed),
+        }
+
+    def _fit(self, states: list, tick: int, budget, used: int) -> tuple:
+        """The entity states that fit `budget` bytes after `used`, and the ids of the ones deferred.
+
+        When not everything fits, states are taken in order of priority: the entity type's
+        IMPORTANCE, times the ticks since this client was last sent the entity, over its
+        distance from the client's player. An update that keeps being deferred keeps
+        gaining priority, so each one goes out eventually.
+        """
+        last_sent = self.last_sent
+        costs = [_cost(state) for state in states] if budget is not None else ()
+        if budget is None or SNAPSHOT_OVERHEAD + used + sum(costs) <= budget:
+            for state in states:
+                last_sent[state['id']] = tick
+            self.owed = 0
+            return states, frozenset()
+
+        player = entities.get(self.entity_id)
+        px, py = (player['x'], player['y']) if player is not None else (0.0, 0.0)
+        ranked = []
+        for state, cost in zip(states, costs):
+            entity = entities[state['id']]
+            age = tick - last_sent.get(state['id'], tick - NEW_AGE)
+            distance = math.hypot(entity['x'] - px, entity['y'] - py)
+            ranked.append((IMPORTANCE.get(entity['proto'], 1.0) * (1 + age) / (1 + distance), cost, state))
+        ranked.sort(key=lambda r: r[0], reverse=True)
+
+        room = budget - SNAPSHOT_OVERHEAD - used
+        chosen = []
+        deferred = []
+        for _, cost, state in ranked:
+            if cost <= room:
+                room -= cost
+                chosen.append(state)
+                last_sent[state['id']] = tick
+            else:
+                deferred.append(state['id'])
+        self.deferred += len(deferred)
+        self.owed = len(deferred)
+        return chosen, frozenset(deferred)
+
+def _cost(state: dict) -> int:
+    """Bytes an entity state takes in a binary snapshot (see shared/protocol.py)"""
+    proto = state.get('proto')
+    floats = len(state) - 1 - (proto is not None)
+    return 5 + 4 * floats + (len(proto) + 1 if proto is not None else 0)
@@ -0,0 +1,181 @@
+import asyncio
+import struct
+import time
+from update.data import entities, grid, lock, drain_updates, update_entity, current_tick, end_tick, visible_from, set_history
+from loader import mapchunks
+from shared import clock
+from connection.logic import views, inputs, links, payloads, expire_sessions
+
+class TickLoop:
+    """Fixed-rate simulation loop.
+
+    Each tick drains the queued player updates, applies them to the entity store and
+    sends every joined client one snapshot delta, so outbound traffic is one message per
+    client per tick no matter how many updates came in. A client's snapshot only covers the
+    chunks within `server.view_radius` of its player (everything when that is None), and
+    only as many entity updates as fit `server.snapshot_budget`; the rest follow in later
+    ticks (see ClientView.build).
+    """
+
+    def __init__(self, server, tick_rate: int = 20, report_interval: float = 10.0):
+        self.server = server
+        self.tick_rate = tick_rate
+        self.interval = 1.0 / tick_rate
+        self.report_interval = report_interval
+        self.tick = 0
+        # Tick timing, reset every report
+        self.overruns = 0
+        self.total_ticks = 0
+        self.total_overruns = 0
+        self._durations = []
+        self._last_report = time.perf_counter()
+        if server.sessions is not None:
+            # A resumed session gets a delta against its last acknowledged snapshot, up to `grace` seconds old
+            set_history(server.sessions.grace, tick_rate)
+
+    def step(self) -> float:
+        """Run one tick and return how long it took in seconds"""
+        start = time.perf_counter()
+        with lock:
+            if self.server.sessions is not None:
+                expire_sessions(self.server)
+            moved = drain_updates()
+            if self.server.moves is not None:
+                # Clamp moves that are too fast or go into a wall, all of this tick's at once
+                self.server.moves.check(moved, entities, mapchunks.world_map)
+            for entity_id, update in moved.items():
+                update_entity(entity_id, x=update['x'], y=update['y'])
+                if 'seq' in update:
+                    inputs[entity_id] = update['seq']
+            if self.server.shard is not None:
+                # Hand entities that left our region to their new shard and swap border ghosts
+                self.server.shard.step(moved)
+            self.tick = current_tick()
+            radius = self.server.view_radius
+            # Clients in the same chunk see the same entities, so each chunk is only queried once.
+            visible_by_chunk = {}
+            snapshots = {}
+            for addr, view in views.items():
+                chunk = grid.chunk_of(view.entity_id) if radius is not None else None
+                visible = visible_by_chunk.get(chunk)
+                if visible is None:
+                    visible = visible_by_chunk[chunk] = visible_from(view.entity_id, radius)
+                # One delta per joined client, against the last snapshot that client acknowledged
+                body = view.build(self.tick, visible, self.server.snapshot_budget)
+                seq = inputs.get(view.entity_id)
+                if seq is not None:
+                    # Where its player ended up after input `seq`; a predicting client replays the inputs after it
+                    player = entities[view.entity_id]
+                    body['input'] = [seq, player['x'], player['y']]
+                snapshots[addr] = {'type': 'response', 'data': {'type': 'snapshot', 'data': body}}
+            if self.server.persistence is not None:
+                self.server.persistence.record_tick(self.tick)
+            end_tick()
+            # Clients due a ping (one a second each); their pongs feed `links`
+            stamp = clock.now()
+            pings = [addr for addr, link in links.items() if link.ping_due(stamp)]
+        for addr, snapshot in snapshots.items():
+            # A lost snapshot is harmless: the next delta repeats whatever it carried.
+            try:
+                self.server.send_to_client(addr, snapshot, reliable=False)
+            except (struct.error, OverflowError, TypeError, ValueError) as e:
+                # Only this client's snapshot is affected; the others and the loop carry on
+                print(f"Dropping {addr}: could not encode its snapshot ({e})")
+                self.server.drop_client(addr)
+        for addr in pings:
+            self.server.send_to_client(addr, clock.ping_message(stamp))
+        duration = time.perf_counter() - start
+        self._record(duration)
+        return duration
+
+    def _record(self, duration: float):
+        if self.server.metrics is not None:
+            self.server.metrics.tick(duration)
+        self.total_ticks += 1
+        self._durations.append(duration)
+        if duration > self.interval:
+            self.overruns += 1
+            self.total_overruns += 1
+        now = time.perf_counter()
+        if now - self._last_report >= self.report_interval:
+            print(self.format_stats())
+            self._durations.clear()
+            self.overruns = 0
+            self._last_report = now
+
+    def stats(self) -> dict:
+        durations = self._durations or [0.0]
+        return {
+            'tick': self.tick,
+            'tick_rate': self.tick_rate,
+            'avg_ms': sum(durations) / len(durations) * 1000,
+            'max_ms': max(durations) * 1000,
+            'overruns': self.overruns,
+            'total_overruns': self.total_overruns,
+            'queues': self.server.queue_stats(),
+            'payloads': payloads.stats(),
+            'udp': self.server.udp.stats() if self.server.udp is not None else None,
+            'shard': self.server.shard.stats() if self.server.shard is not None else None,
+            'moves': self.server.moves.stats() if self.server.moves is not None else None,
+            'persistence': self.server.persistence.stats() if self.server.persistence is not None else None,
+            'sessions': self.server.sessions.stats() if self.server.sessions is not None else None,
+            'links': {f"{addr[0]}:{addr[1]}": link.to_dict() for addr, link in list(links.items())},
+            'budget': {
+                'bytes_per_tick': self.server.snapshot_budget,
+                'deferred': sum(view.deferred for view in list(views.values())),
+                'owed': sum(view.owed for view in list(views.values())),
+                'clients_over': sum(1 for view in list(views.values()) if view.owed),
+            },
+        }
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        queues = s['queues'].values()
+        udp = s['udp']
+        udp_line = (f"; udp: {udp['bound']}/{udp['sessions']} bound, {udp['datagrams_out']} out, "
+                    f"{udp['datagrams_in']} in, {udp['stale']} stale, {udp['too_big']} sent over TCP") if udp else ""
+        rtts = [link['rtt_ms'] for link in s['links'].values() if link['rtt_ms'] is not None]
+        rtt_line = (f"; rtt: avg {sum(rtts) / len(rtts):.1f} ms, max {max(rtts):.1f} ms "
+                    f"over {len(rtts)} clients") if rtts else ""
+        budget = s['budget']
+        budget_line = (f"; budget: {budget['owed']} updates owed to {budget['clients_over']} clients"
+                       if budget['owed'] else "")
+        moves = s['moves']
+        moves_line = (f"; moves: {moves['checked']} checked, {moves['too_fast']} too fast, "
+                      f"{moves['into_wall']} into walls") if moves else ""
+        shard = s['shard']
+        shard_prefix = (f"Shard {shard['shard']} ({shard['owned']} owned, {shard['ghosts']} ghosts, "
+                        f"{shard['handed_off']} handed off, {shard['adopted']} adopted): ") if shard else ""
+        return (f"{shard_prefix}Tick {s['tick']} @ {s['tick_rate']} Hz: avg {s['avg_ms']:.2f} ms, "
+                f"max {s['max_ms']:.2f} ms, overruns {s['overruns']} (total {s['total_overruns']}); "
+                f"outbound: {len(queues)} clients, max depth {max((q['depth'] for q in queues), default=0)}, "
+                f"{sum(q['bytes_pending'] for q in queues) / 1024:.1f} KB pending, "
+                f"{sum(q['dropped'] + q['coalesced'] for q in queues)} snapshots dropped; "
+                f"payload cache: {s['payloads']['hits']} hits, {s['payloads']['misses']} misses; "
+                f"compression saved {sum(q['compression']['bytes_saved'] for q in queues if 'compression' in q) / 1024:.1f} KB "
+                f"for {sum(q['compression']['cpu_ms'] for q in queues if 'compression' in q):.1f} ms CPU"
+                f"{udp_line}{rtt_line}{budget_line}{moves_line}")
+
+    def _next_deadline(self, deadline: float) -> float:
+        deadline += self.interval
+        now = time.perf_counter()
+        if deadline < now:
+            # Fell behind by more than a tick: skip the missed ticks instead of bursting to catch up.
+            deadline = now
+        return deadline
+
+    def run(self):
+        """Blocking loop for the threaded server, run on its own thread."""
+        deadline = time.perf_counter()
+        while self.server.running:
+            self.step()
+            deadline = self._next_deadline(deadline)
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+
+    async def run_async(self):
+        """Loop for the asyncio server, run as a task on its event loop."""
+        deadline = time.perf_counter()
+        while self.server.running:
+            self.step()
+            deadline = self._next_deadline(deadline)
+            await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
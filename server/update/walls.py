@@ -0,0 +1,199 @@
+"""
+Server-side movement validation.
+
+Clients predict their own movement and send the positions they end up at (see
+client/game/player.py). The server checks each tick's moves as one batch against a wall
+index before applying them. A move that is too fast is shortened, and one that would go
+into a wall stops just before it. The client learns the corrected position from the input
+echo in its next snapshot and reconciles.
+
+Wall tiles come from the `wall` flag of each tile type (tiles.yml) and are kept one byte per
+tile over the map's bounds, so a lookup is an index into a bytearray. Entities whose type
+has the flag (dbgentity.yml) block the tile their centre is on. Players are left out: the
+other players a client collides with are interpolated behind the server's positions, so a
+legitimate move could pass through where the server has one.
+"""
+import math
+import time
+from loader.content import get_object_properties
+
+# Fastest a player moves in tiles per second (Player.speed on the client, in pixels, over TILE_SIZE)
+PLAYER_SPEED = 250 / 48
+# Allowance over PLAYER_SPEED for frame time jitter and updates that arrive bunched up
+SPEED_TOLERANCE = 1.5
+# Tiles any move may cover on top of that
+SPEED_SLACK = 0.5
+# Most seconds of movement one update is allowed to catch up on after a quiet spell
+MAX_CATCHUP = 1.0
+# How far before a wall a move that runs into it is stopped, in tiles
+WALL_CLEARANCE = 0.001
+# Entity types that never block a move even when their content says `wall`
+UNBLOCKING = ('player',)
+
+class WallGrid:
+    """Which tiles a player cannot enter: wall tiles plus tiles holding a wall entity."""
+
+    def __init__(self):
+        self.origin = (0, 0)     # tile coordinate of solid[0]
+        self.width = 0
+        self.height = 0
+        self.solid = bytearray()  # 1 for a wall tile, row by row
+        self.version = None       # MapChunks.version the tiles were read at
+        self.wall_tiles = 0
+        self._map = None
+        self._wall_types = {}     # tile or entity type -> bool, from the content
+        # (tx, ty) -> number of wall entities on it, and entity id -> its tile
+        self.blockers = {}
+        self._entity_tiles = {}
+
+    def is_wall_type(self, name: str) -> bool:
+        wall = self._wall_types.get(name)
+        if wall is None:
+            wall = self._wall_types[name] = bool((get_object_properties(name) or {}).get('wall', False))
+        return wall
+
+    def blocked(self, tx: int, ty: int) -> bool:
+        """True if tile (tx, ty) holds a wall; everything outside the map is open."""
+        x = tx - self.origin[0]
+        y = ty - self.origin[1]
+        if 0 <= x < self.width and 0 <= y < self.height and self.solid[y * self.width + x]:
+            return True
+        return bool(self.blockers) and (tx, ty) in self.blockers
+
+    def first_hit(self, x0: float, y0: float, x1: float, y1: float):
+        """How far along the way from (x0, y0) to (x1, y1), from 0 to 1, it enters a wall; None if it does not.
+
+        Walks the tiles the segment crosses in order. The starting tile itself is not
+        checked, so something that ended up inside a wall can still walk out of it.
+        """
+        tx, ty = math.floor(x0), math.floor(y0)
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # Fraction of the move per tile crossed, and at which the next tile edge is reached
+        delta_x = abs(1 / dx) if dx else math.inf
+        delta_y = abs(1 / dy) if dy else math.inf
+        next_x = ((tx + 1 - x0) if dx > 0 else (x0 - tx)) * delta_x if dx else math.inf
+        next_y = ((ty + 1 - y0) if dy > 0 else (y0 - ty)) * delta_y if dy else math.inf
+        for _ in range(abs(math.floor(x1) - tx) + abs(math.floor(y1) - ty)):
+            if next_x < next_y:
+                t = next_x
+                tx += step_x
+                next_x += delta_x
+            else:
+                t = next_y
+                ty += step_y
+                next_y += delta_y
+            if t > 1:
+                break
+            if self.blocked(tx, ty):
+                return t
+        return None
+
+    def sync(self, world_map) -> None:
+        """Bring the wall tiles up to date with the map; only chunks changed since the last call are read."""
+        if world_map is self._map and world_map.version == self.version:
+            return
+        min_cx, min_cy, max_cx, max_cy = world_map.bounds
+        size = world_map.chunk_size
+        origin = (min_cx * size, min_cy * size)
+        width, height = (max_cx - min_cx + 1) * size, (max_cy - min_cy + 1) * size
+        if world_map is not self._map or (origin, width, height) != (self.origin, self.width, self.height):
+            self.origin, self.width, self.height = origin, max(0, width), max(0, height)
+            self.solid = bytearray(self.width * self.height)
+            chunks = world_map.chunks
+        else:
+            chunks = {c: world_map.chunks.get(c, ()) for c in world_map.changed_chunks(self.version)}
+        for (cx, cy), tiles in chunks.items():
+            for y in range(cy * size - origin[1], (cy + 1) * size - origin[1]):
+                start = y * self.width + cx * size - origin[0]
+                self.solid[start:start + size] = bytes(size)
+            for tile in tiles:
+                if self.is_wall_type(tile['tile']):
+                    self.solid[(tile['y'] - origin[1]) * self.width + tile['x'] - origin[0]] = 1
+        self._map = world_map
+        self.version = world_map.version
+        self.wall_tiles = self.solid.count(1)
+
+    def place(self, entity_id: int, proto: str, x: float, y: float) -> None:
+        """A new entity; it blocks its tile if its type is a wall (see UNBLOCKING)."""
+        if proto in UNBLOCKING or not self.is_wall_type(proto):
+            return
+        tile = (math.floor(x), math.floor(y))
+        self._entity_tiles[entity_id] = tile
+        self.blockers[tile] = self.blockers.get(tile, 0) + 1
+
+    def move(self, entity_id: int, x: float, y: float) -> None:
+        old = self._entity_tiles.get(entity_id)
+        if old is None:
+            return
+        tile = (math.floor(x), math.floor(y))
+        if tile != old:
+            self._unblock(old)
+            self._entity_tiles[entity_id] = tile
+            self.blockers[tile] = self.blockers.get(tile, 0) + 1
+
+    def remove(self, entity_id: int) -> None:
+        tile = self._entity_tiles.pop(entity_id, None)
+        if tile is not None:
+            self._unblock(tile)
+
+    def clear_entities(self) -> None:
+        self.blockers.clear()
+        self._entity_tiles.clear()
+
+    def _unblock(self, tile: tuple) -> None:
+        count = self.blockers[tile] - 1
+        if count:
+            self.blockers[tile] = count
+        else:
+            del self.blockers[tile]
+
+class MoveValidator:
+    """Checks the player moves drained in one tick before the tick applies them."""
+
+    def __init__(self, walls: WallGrid, speed: float = PLAYER_SPEED):
+        self.walls = walls
+        self.speed = speed
+        self._last = {}  # entity id -> when its last move was applied
+        # Metrics
+        self.checked = 0
+        self.too_fast = 0
+        self.into_wall = 0
+
+    def check(self, moved: dict, entities: dict, world_map=None) -> None:
+        """Clamp the {'x', 'y'} of every update in `moved` (entity id -> update) in place."""
+        if world_map is not None:
+            self.walls.sync(world_map)
+        now = time.monotonic()
+        walls = self.walls
+        for entity_id, update in moved.items():
+            entity = entities.get(entity_id)
+            if entity is None:
+                continue
+            self.checked += 1
+            x0, y0 = entity['x'], entity['y']
+            x1, y1 = update['x'], update['y']
+            elapsed = min(now - self._last.get(entity_id, now - MAX_CATCHUP), MAX_CATCHUP)
+            self._last[entity_id] = now
+            distance = math.hypot(x1 - x0, y1 - y0)
+            allowed = self.speed * SPEED_TOLERANCE * elapsed + SPEED_SLACK
+            if distance > allowed:
+                self.too_fast += 1
+                scale = allowed / distance
+                x1, y1 = x0 + (x1 - x0) * scale, y0 + (y1 - y0) * scale
+                distance = allowed
+            if distance:
+                t = walls.first_hit(x0, y0, x1, y1)
+                if t is not None:
+                    self.into_wall += 1
+                    t = max(0.0, t - WALL_CLEARANCE / distance)
+                    x1, y1 = x0 + (x1 - x0) * t, y0 + (y1 - y0) * t
+            update['x'], update['y'] = x1, y1
+
+    def forget(self, entity_id: int) -> None:
+        self._last.pop(entity_id, None)
+
+    def stats(self) -> dict:
+        return {'checked': self.checked, 'too_fast': self.too_fast, 'into_wall': self.into_wall,
+                'wall_tiles': self.walls.wall_tiles, 'wall_entities': sum(self.walls.blockers.values())}
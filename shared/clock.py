@@ -0,0 +1,88 @@
+"""
+Round trip time and clock offset from ping/pong, used by both the client and the server.
+
+Either side may ping; the other answers right away with a pong that echoes the ping's
+timestamp and adds its own clock reading:
+
+    {'type': 'ping', 'data': {'type': 'clock', 'data': {'t': sender's clock}}}
+    {'type': 'pong', 'data': {'type': 'clock', 'data': {'t': echoed, 'clock': answerer's clock}}}
+
+When the pong arrives at `now` on the sender's clock:
+
+    rtt    = now - t
+    offset = clock + rtt / 2 - now    (the other clock minus ours, for a symmetric path)
+
+The RTT is smoothed like TCP's retransmission timer (RFC 6298): the average moves 1/8 of
+the way to each sample and the jitter 1/4 of the way to the sample's deviation from it.
+Queueing only ever delays a pong, so the offset comes from the fastest of the last
+OFFSET_WINDOW samples, the one it skewed least.
+"""
+import time
+from collections import deque
+
+# Seconds between pings from each side
+PING_INTERVAL = 1.0
+RTT_GAIN = 1 / 8
+JITTER_GAIN = 1 / 4
+OFFSET_WINDOW = 8
+
+def now() -> float:
+    """The clock pings are stamped with: monotonic, in seconds, with an arbitrary zero per process"""
+    return time.perf_counter()
+
+def ping_message(t: float = None) -> dict:
+    return {'type': 'ping', 'data': {'type': 'clock', 'data': {'t': now() if t is None else t}}}
+
+def pong_message(t: float) -> dict:
+    """The answer to a received ping stamped `t`"""
+    return {'type': 'pong', 'data': {'type': 'clock', 'data': {'t': float(t), 'clock': now()}}}
+
+class LinkEstimator:
+    """Smoothed RTT, jitter and clock offset of one link, fed with the pongs it gets back."""
+
+    __slots__ = ('rtt', 'jitter', 'offset', 'last_rtt', 'samples', 'last_ping', '_window')
+
+    def __init__(self):
+        self.rtt = None      # smoothed round trip in seconds, None before the first pong
+        self.jitter = 0.0    # smoothed deviation of the samples from it
+        self.offset = 0.0    # the other side's clock minus ours
+        self.last_rtt = None
+        self.samples = 0
+        self.last_ping = float('-inf')  # when we last sent a ping, on our clock
+        self._window = deque(maxlen=OFFSET_WINDOW)  # (rtt, offset) of the newest samples
+
+    def ping_due(self, t: float = None) -> bool:
+        """True, and the ping counted as sent, if PING_INTERVAL passed since the last one"""
+        t = now() if t is None else t
+        if t - self.last_ping < PING_INTERVAL:
+            return False
+        self.last_ping = t
+        return True
+
+    def pong(self, sent: float, clock: float, t: float = None) -> float:
+        """Take in a received pong: the ping's echoed stamp and the other side's clock.
+        Returns the sample's RTT in seconds."""
+        t = now() if t is None else t
+        rtt = max(0.0, t - float(sent))
+        offset = float(clock) + rtt / 2 - t
+        if self.rtt is None:
+            self.rtt = rtt
+            self.jitter = rtt / 2
+        else:
+            self.jitter += JITTER_GAIN * (abs(rtt - self.rtt) - self.jitter)
+            self.rtt += RTT_GAIN * (rtt - self.rtt)
+        self._window.append((rtt, offset))
+        self.offset = min(self._window)[1]
+        self.last_rtt = rtt
+        self.samples += 1
+        return rtt
+
+    def remote_time(self, t: float = None) -> float:
+        """The other side's clock now (or at our time `t`)"""
+        return (now() if t is None else t) + self.offset
+
+    def to_dict(self) -> dict:
+        """In milliseconds; rtt is None until the first pong"""
+        return {'rtt_ms': self.rtt * 1000 if self.rtt is not None else None, 'jitter_ms': self.jitter * 1000,
+                'last_rtt_ms': self.last_rtt * 1000 if self.last_rtt is not None else None,
+                'offset_ms': self.offset * 1000, 'samples': self.samples}
@@ -0,0 +1,118 @@
+"""
+Game content (assets/content/*.yml), indexed once when it is loaded. Used by both the client and
+the server through their loader/content.py.
+
+Any mapping under a key, at any depth of a content file, is an object named by that key. On load
+the registry walks every file once and keeps:
+
+  - `by name`: name -> its properties with 'name' filled in, so a lookup is one dict access. The
+    index holds every name, so a name it does not have is known to be missing without a search.
+    When a name occurs more than once, the first file loaded wins, and within a file the
+    shallowest occurrence wins, the same object a search through the files would find first.
+  - `by property`: property -> value -> the objects with that value. `type` and `subtype` are
+    indexed on load; other properties when they are first queried. Absent values are stored as
+    empty lists, so a repeated query that found nothing is one dict access too.
+
+The indexes describe the content as of the last load() or index(); call index() after editing
+`files` in place.
+"""
+import sys
+from pathlib import Path
+import yaml
+
+# Properties indexed on load; others are indexed by find() when first asked for
+INDEXED = ('type', 'subtype')
+
+def content_dir() -> Path:
+    """assets/content, in the source tree or in a bundled executable"""
+    if getattr(sys, 'frozen', False):
+        base_path = Path(sys._MEIPASS)
+    else:
+        base_path = Path(__file__).resolve().parent.parent
+    return base_path / "assets" / "content"
+
+class ContentRegistry:
+    """Every loaded content file by name (`files`), and the objects in them by name and by property."""
+
+    def __init__(self):
+        self.files = {}  # file stem -> parsed YAML
+        self._objects = []  # every object's properties as written, in load order
+        self._by_name = {}
+        self._by_property = {}
+
+    def load(self, directory: Path = None, exclude: tuple = ()) -> dict:
+        """(Re)load every .yml file in `directory` (default content_dir()) except the `exclude` stems"""
+        directory = content_dir() if directory is None else Path(directory)
+        if not directory.exists():
+            raise FileNotFoundError(f"Content directory {directory} not found")
+        self.files.clear()
+        for file in directory.glob("*.yml"):
+            if file.stem in exclude:
+                continue
+            try:
+                with file.open("r", encoding="utf-8") as f:
+                    data = yaml.safe_load(f)
+                if data is not None:
+                    self.files[file.stem] = data
+            except Exception as e:
+                print(f"Error loading {file}: {str(e)}")
+        self.index()
+        return self.files
+
+    def index(self) -> None:
+        """Rebuild the indexes from `files`"""
+        self._objects = []
+        self._by_name = {}
+        self._by_property = {}
+        for data in self.files.values():
+            if isinstance(data, dict):
+                self._walk(data)
+        for prop in INDEXED:
+            self._index_property(prop)
+
+    def _walk(self, d: dict) -> None:
+        # A mapping's own objects are named before any nested ones, so a shallower name wins
+        nested = []
+        for name, value in d.items():
+            if isinstance(value, dict):
+                if name not in self._by_name:
+                    self._by_name[name] = {'name': name, **value}
+                nested.append(value)
+        for value in nested:
+            self._objects.append(value)
+            self._walk(value)
+
+    def _index_property(self, prop: str) -> dict:
+        index = self._by_property[prop] = {}
+        for obj in self._objects:
+            value = obj.get(prop)
+            if value is not None and getattr(value, '__hash__', None) is not None:
+                index.setdefault(value, []).append(obj)
+        return index
+
+    def get(self, name: str):
+        """Properties of the object called `name` (with 'name' set), or None"""
+        return self._by_name.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._by_name
+
+    def names(self) -> list:
+        return list(self._by_name)
+
+    def find(self, prop: str, value) -> list:
+        """Every object whose property `prop` equals `value`, in load order, as written in its file"""
+        if value is None:
+            # Also matches the objects without `prop`, which the index leaves out
+            return [obj for obj in self._objects if obj.get(prop) is None]
+        index = self._by_property.get(prop)
+        if index is None:
+            index = self._index_property(prop)
+        try:
+            found = index.get(value)
+        except TypeError:
+            # Unhashable values (lists, mappings) are not indexed
+            return [obj for obj in self._objects if obj.get(prop) == value]
+        if found is None:
+            found = index[value] = []
+        return list(found)
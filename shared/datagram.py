@@ -0,0 +1,63 @@
+"""
+Datagram layout of the optional UDP side channel.
+
+Join, map, chunks and every other reliable message stay on the TCP stream. A client that
+asked for it at join (`'udp': True`) gets `'udp': {'port': ..., 'token': ...}` in `joined`;
+its position updates and snapshot acks can then go over UDP, and the server sends its
+snapshots there. Both are latest-wins, so a lost datagram costs nothing but a little
+staleness.
+
+    client -> server: u64 token | u32 sequence | payload
+    server -> client: u32 sequence | payload
+
+The payload is one message without a frame header, encoded as on the TCP stream. An empty
+payload is a bind: the client repeats it until the server answers with an empty datagram,
+which proves datagrams get through both ways. The token ties the datagram to the TCP
+session, so the server does not care which address it comes from (NAT rebinding is fine).
+Each side drops datagrams whose sequence is not newer than the newest one it accepted.
+"""
+import struct
+
+TO_SERVER = struct.Struct('<QI')
+TO_CLIENT = struct.Struct('<I')
+# Largest datagram either side sends; stays under a typical path MTU so nothing is fragmented.
+# Bigger messages (large snapshot deltas) go over TCP instead.
+MAX_DATAGRAM = 1200
+
+class DatagramError(ValueError):
+    pass
+
+def pack_to_server(token: int, seq: int, payload: bytes = b'') -> bytes:
+    return TO_SERVER.pack(token, seq) + payload
+
+def unpack_to_server(data) -> tuple:
+    """(token, sequence, payload) of a client datagram"""
+    if len(data) < TO_SERVER.size:
+        raise DatagramError("Truncated datagram")
+    token, seq = TO_SERVER.unpack_from(data)
+    return token, seq, memoryview(data)[TO_SERVER.size:]
+
+def pack_to_client(seq: int, payload: bytes = b'') -> bytes:
+    return TO_CLIENT.pack(seq) + payload
+
+def unpack_to_client(data) -> tuple:
+    """(sequence, payload) of a server datagram"""
+    if len(data) < TO_CLIENT.size:
+        raise DatagramError("Truncated datagram")
+    return TO_CLIENT.unpack_from(data)[0], memoryview(data)[TO_CLIENT.size:]
+
+class SequenceFilter:
+    """Accepts only datagrams newer than the newest one accepted so far."""
+
+    def __init__(self):
+        self.last = -1
+        self.accepted = 0
+        self.stale = 0  # late or duplicated datagrams that were dropped
+
+    def accept(self, seq: int) -> bool:
+        if seq <= self.last:
+            self.stale += 1
+            return False
+        self.last = seq
+        self.accepted += 1
+        return True
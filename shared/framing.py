@@ -0,0 +1,180 @@
+"""
+Length-prefixed framing shared by the client and the server.
+
+Every message on a TCP stream is one frame:
+
+    u32 payload length (big endian) | payload
+
+If the top bit of the length is set (COMPRESSED), the payload is a deflate block from the
+sender's per-connection zlib stream (see FrameCompressor). Compressed frames have to be
+decoded in order, which the decoder does on its own, so they can appear anywhere in the
+stream once the peer said it accepts them.
+
+FrameDecoder reassembles frames from arbitrary reads. Sockets read straight into its
+buffer (`recv_into(decoder.writable())`) and complete frames come back as memoryviews
+into that same buffer, so bytes are not copied on the way in or on the way out. Once a
+frame header has arrived the buffer is sized for the whole frame, so a multi-megabyte
+payload split over hundreds of reads is still received in linear time.
+"""
+import struct
+import time
+import zlib
+
+HEADER = struct.Struct('>I')
+# Length flag of a deflated payload
+COMPRESSED = 0x80000000
+# Largest payload accepted from the network; anything bigger is treated as a broken stream.
+MAX_FRAME = 64 * 1024 * 1024
+# Every Z_SYNC_FLUSH block ends with these bytes, so they are dropped on the wire and added back.
+_SYNC_TAIL = b'\x00\x00\xff\xff'
+
+class FrameError(ValueError):
+    pass
+
+def encode_frame(payload: bytes) -> bytes:
+    return HEADER.pack(len(payload)) + payload
+
+class FrameDecoder:
+    """Incremental decoder over one reusable buffer.
+
+    Unread bytes live in `_buf[_start:_end]`. Free space is reclaimed by moving the unread
+    tail to the front (at most one partial frame, never the whole stream) and the buffer only
+    grows when a single frame does not fit.
+    """
+
+    def __init__(self, initial_size: int = 16384, max_frame: int = MAX_FRAME):
+        self._initial_size = initial_size
+        # Allocated on first use, so a connection that never sends anything costs no buffer.
+        self._buf = bytearray()
+        self._start = 0
+        self._end = 0
+        self.max_frame = max_frame
+        self._inflater = None  # created by the first compressed frame
+        self.compressed_frames = 0
+
+    def buffered(self) -> int:
+        """Bytes received but not yet returned as frames"""
+        return self._end - self._start
+
+    def writable(self, min_free: int = 4096) -> memoryview:
+        """Free space to receive into. Call commit() with the number of bytes written."""
+        unread = self._end - self._start
+        need = min_free
+        if unread >= HEADER.size:
+            # Make room for the rest of the current frame so it arrives in place.
+            need = max(need, HEADER.size + self._frame_size() - unread)
+        if len(self._buf) - self._end < need:
+            self._make_room(unread, need)
+        return memoryview(self._buf)[self._end:]
+
+    def commit(self, nbytes: int) -> None:
+        self._end += nbytes
+
+    def feed(self, data) -> None:
+        """Copy bytes in, for callers that already have them (e.g. from asyncio data_received)."""
+        size = len(data)
+        self.writable(size)[:size] = data
+        self.commit(size)
+
+    def frames(self):
+        """Yield each complete payload as a memoryview (as bytes if it was compressed).
+
+        A view is only valid until the next writable()/feed() call; decode it right away.
+        """
+        buf = self._buf
+        while self._end - self._start >= HEADER.size:
+            size = self._frame_size()
+            frame_end = self._start + HEADER.size + size
+            if frame_end > self._end:
+                break
+            payload = memoryview(buf)[self._start + HEADER.size:frame_end]
+            compressed = buf[self._start] & 0x80
+            self._start = frame_end
+            yield self._inflate(payload) if compressed else payload
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def _inflate(self, payload) -> bytes:
+        if self._inflater is None:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            data = self._inflater.decompress(bytes(payload) + _SYNC_TAIL, self.max_frame)
+        except zlib.error as e:
+            raise FrameError(f"Corrupt compressed frame: {e}") from e
+        if self._inflater.unconsumed_tail:
+            raise FrameError(f"Compressed frame inflates past the {self.max_frame} byte limit")
+        self.compressed_frames += 1
+        return data
+
+    def _frame_size(self) -> int:
+        size = HEADER.unpack_from(self._buf, self._start)[0] & ~COMPRESSED
+        if size > self.max_frame:
+            raise FrameError(f"Frame of {size} bytes exceeds the {self.max_frame} byte limit")
+        return size
+
+    def _make_room(self, unread: int, need: int) -> None:
+        if len(self._buf) - unread >= need and len(self._buf) <= self._initial_size * 4:
+            # Enough space overall: slide the unread bytes to the front.
+            self._buf[:unread] = self._buf[self._start:self._end]
+        else:
+            # Grow (or shrink back after a huge frame) to fit; a fresh buffer leaves old views intact.
+            size = max(self._initial_size, unread + need)
+            if size > len(self._buf):
+                size = max(size, min(len(self._buf) * 2, unread + need + self.max_frame))
+            new_buf = bytearray(size)
+            new_buf[:unread] = self._buf[self._start:self._end]
+            self._buf = new_buf
+        self._start = 0
+        self._end = unread
+
+class FrameCompressor:
+    """Deflates outgoing frames of one connection through a single zlib stream.
+
+    The stream's window spans messages, so a snapshot that repeats most of the previous
+    one compresses to a few bytes. Frames under `threshold` bytes are sent as they are.
+    Because every compressed frame depends on the ones before it, compress() must run
+    where frames are actually written, after any queue has dropped or coalesced them.
+    """
+
+    def __init__(self, threshold: int = 512, level: int = 6):
+        self.threshold = threshold
+        self._deflater = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        # Metrics
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    def compress(self, data: bytes) -> bytes:
+        """Compress every large enough frame in `data`, a run of whole frames."""
+        if len(data) < HEADER.size + self.threshold:
+            return data
+        start = time.thread_time()
+        view = memoryview(data)
+        out = bytearray()
+        pos = 0
+        while pos < len(data):
+            size = HEADER.unpack_from(data, pos)[0]
+            end = pos + HEADER.size + size
+            if size < self.threshold:
+                out += view[pos:end]
+            else:
+                packed = self._deflater.compress(view[pos + HEADER.size:end]) + self._deflater.flush(zlib.Z_SYNC_FLUSH)
+                packed = packed[:-len(_SYNC_TAIL)]
+                out += HEADER.pack(len(packed) | COMPRESSED)
+                out += packed
+                self.frames += 1
+                self.bytes_in += size
+                self.bytes_out += len(packed)
+            pos = end
+        self.cpu_seconds += time.thread_time() - start
+        return bytes(out)
+
+    def stats(self) -> dict:
+        return {
+            'frames': self.frames,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+            'cpu_ms': self.cpu_seconds * 1000,
+        }
@@ -0,0 +1,31 @@
+"""
+Map chunk coordinates shared by the client and the server.
+
+The tile map is cut into square chunks of CHUNK_SIZE x CHUNK_SIZE tiles. On join the server
+only sends the map's name, bounds and the spawn point; clients then ask for the chunks they
+need (`get chunks`) and receive each one as a `chunk` response.
+"""
+
+# Chunk edge length in tiles. The server's interest grid uses the same chunks.
+CHUNK_SIZE = 16
+# Largest tile coordinate accepted from a client. Positions are 32-bit floats on the wire, which
+# cannot tell neighbouring tiles apart beyond this.
+MAX_COORDINATE = float(1 << 24)
+
+def chunk_of(x: float, y: float, size: int = CHUNK_SIZE) -> tuple:
+    """Chunk coordinate of a tile position"""
+    return int(x // size), int(y // size)
+
+def chunks_around(center: tuple, radius: int, bounds=None) -> list:
+    """Chunk coordinates within `radius` of `center`, nearest first.
+
+    `bounds` is (min_cx, min_cy, max_cx, max_cy), inclusive; chunks outside it are skipped.
+    """
+    cx, cy = center
+    chunks = []
+    for x in range(cx - radius, cx + radius + 1):
+        for y in range(cy - radius, cy + radius + 1):
+            if bounds is None or (bounds[0] <= x <= bounds[2] and bounds[1] <= y <= bounds[3]):
+                chunks.append((x, y))
+    chunks.sort(key=lambda c: (c[0] - cx) ** 2 + (c[1] - cy) ** 2)
+    return chunks
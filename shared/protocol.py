@@ -0,0 +1,368 @@
+"""
+Wire protocol shared by the client and the server.
+
+A message is always the nested dict `{'type': ..., 'data': {'type': ..., 'data': ...}}`.
+Each message travels as one frame (see shared/framing.py) whose payload is either JSON
+(it starts with `{`) or binary:
+
+    u8 PROTOCOL_VERSION | u8 message id | body
+
+Each (type, subtype) pair is registered under a message id. Hot messages (player
+position, snapshot acks, entity snapshots, map chunks, ping/pong) have struct-packed layouts;
+everything else uses a compact tagged encoding of the JSON-like value (`pack_value` /
+`unpack_value`).
+
+Both ends decode either kind of payload. The handshake only decides what the server sends:
+the client's JSON `join` carries `'protocol': 'binary', 'version': PROTOCOL_VERSION`, and if
+the server speaks that version its `joined` reply carries the same two keys. Likewise
+`'compression': 'zlib'` in both lets the server send deflated frames (see shared/framing.py),
+and `'udp'` opens the optional UDP side channel (see shared/datagram.py).
+"""
+import json
+import struct
+from shared.framing import encode_frame
+
+PROTOCOL_VERSION = 4
+
+class ProtocolError(ValueError):
+    pass
+
+# --- variable-length value encoding -------------------------------------------------
+
+_NONE, _TRUE, _FALSE, _INT, _FLOAT, _STR, _LIST, _DICT, _BYTES = range(9)
+_F64 = struct.Struct('<d')
+
+def _write_varint(out: bytearray, n: int) -> None:
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_varint(buf, pos: int):
+    result = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _write_str(out: bytearray, value: str) -> None:
+    raw = value.encode()
+    _write_varint(out, len(raw))
+    out += raw
+
+def _read_str(buf, pos: int):
+    size, pos = _read_varint(buf, pos)
+    return str(buf[pos:pos + size], 'utf-8'), pos + size
+
+def _pack(out: bytearray, value) -> None:
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(out, value << 1 if value >= 0 else (~value << 1) | 1)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _F64.pack(value)
+    elif isinstance(value, str):
+        out.append(_STR)
+        _write_str(out, value)
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _pack(out, item)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_varint(out, len(value))
+        for key, item in value.items():
+            _pack(out, key)
+            _pack(out, item)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        _write_varint(out, len(value))
+        out += value
+    else:
+        raise ProtocolError(f"Cannot encode {type(value).__name__}")
+
+def _unpack(buf, pos: int):
+    tag = buf[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _INT:
+        n, pos = _read_varint(buf, pos)
+        return (n >> 1) ^ -(n & 1), pos
+    if tag == _FLOAT:
+        return _F64.unpack_from(buf, pos)[0], pos + 8
+    if tag == _STR:
+        return _read_str(buf, pos)
+    if tag == _LIST:
+        count, pos = _read_varint(buf, pos)
+        items = []
+        for _ in range(count):
+            item, pos = _unpack(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == _DICT:
+        count, pos = _read_varint(buf, pos)
+        result = {}
+        for _ in range(count):
+            key, pos = _unpack(buf, pos)
+            result[key], pos = _unpack(buf, pos)
+        return result, pos
+    if tag == _BYTES:
+        size, pos = _read_varint(buf, pos)
+        return bytes(buf[pos:pos + size]), pos + size
+    raise ProtocolError(f"Unknown value tag {tag}")
+
+def pack_value(value) -> bytes:
+    out = bytearray()
+    _pack(out, value)
+    return bytes(out)
+
+def unpack_value(buf):
+    return _unpack(buf, 0)[0]
+
+# --- message registry ---------------------------------------------------------------
+
+_by_id = {}
+_by_name = {}
+
+def register(msg_id: int, type_: str, subtype: str, encoder=None, decoder=None):
+    """Register a message layout. Without an encoder/decoder the body uses pack_value."""
+    if msg_id in _by_id:
+        raise ValueError(f"Message id {msg_id} already registered")
+    entry = (msg_id, type_, subtype, encoder, decoder)
+    _by_id[msg_id] = entry
+    _by_name[(type_, subtype)] = entry
+
+_POSITION = struct.Struct('<ff')
+_INPUT_SEQ = struct.Struct('<I')  # optional trailer: newest input command the position includes
+
+def _encode_position(out: bytearray, data: dict) -> None:
+    out += _POSITION.pack(data['x'], data['y'])
+    if 'seq' in data:
+        out += _INPUT_SEQ.pack(data['seq'])
+
+def _decode_position(buf, pos: int) -> dict:
+    x, y = _POSITION.unpack_from(buf, pos)
+    position = {'x': x, 'y': y}
+    if len(buf) >= pos + _POSITION.size + _INPUT_SEQ.size:
+        position['seq'] = _INPUT_SEQ.unpack_from(buf, pos + _POSITION.size)[0]
+    return position
+
+_TICK = struct.Struct('<I')
+
+def _encode_ack(out: bytearray, data: dict) -> None:
+    out += _TICK.pack(data['tick'])
+
+def _decode_ack(buf, pos: int) -> dict:
+    return {'tick': _TICK.unpack_from(buf, pos)[0]}
+
+# Snapshot: header, then per entity an id, a field mask and the present fields, then removed ids.
+_SNAPSHOT_HEADER = struct.Struct('<IIII')  # tick, base (0 = full), entity count, removed count
+_ENTITY_HEADER = struct.Struct('<IB')      # id, field mask
+_F32 = struct.Struct('<f')
+_ENTITY_FLOATS = (('x', 1), ('y', 2), ('rot', 4))
+_HAS_PROTO = 8
+_HAS_EXTRA = 16
+_ENTITY_KEYS = {'id', 'x', 'y', 'rot', 'proto'}
+_SNAPSHOT_KEYS = {'tick', 'base', 'entities', 'removed'}
+
+def _encode_snapshot(out: bytearray, data: dict) -> None:
+    entities = data['entities']
+    removed = data['removed']
+    out += _SNAPSHOT_HEADER.pack(data['tick'], data['base'] or 0, len(entities), len(removed))
+    for entity in entities:
+        mask = 0
+        for key, bit in _ENTITY_FLOATS:
+            if key in entity:
+                mask |= bit
+        if 'proto' in entity:
+            mask |= _HAS_PROTO
+        extra = {k: v for k, v in entity.items() if k not in _ENTITY_KEYS}
+        if extra:
+            mask |= _HAS_EXTRA
+        out += _ENTITY_HEADER.pack(entity['id'], mask)
+        for key, bit in _ENTITY_FLOATS:
+            if mask & bit:
+                out += _F32.pack(entity[key])
+        if mask & _HAS_PROTO:
+            _write_str(out, entity['proto'])
+        if extra:
+            _pack(out, extra)
+    for entity_id in removed:
+        out += _TICK.pack(entity_id)
+    _pack(out, {k: v for k, v in data.items() if k not in _SNAPSHOT_KEYS})
+
+def _decode_snapshot(buf, pos: int) -> dict:
+    tick, base, count, removed_count = _SNAPSHOT_HEADER.unpack_from(buf, pos)
+    pos += _SNAPSHOT_HEADER.size
+    entities = []
+    for _ in range(count):
+        entity_id, mask = _ENTITY_HEADER.unpack_from(buf, pos)
+        pos += _ENTITY_HEADER.size
+        entity = {'id': entity_id}
+        for key, bit in _ENTITY_FLOATS:
+            if mask & bit:
+                entity[key] = _F32.unpack_from(buf, pos)[0]
+                pos += 4
+        if mask & _HAS_PROTO:
+            entity['proto'], pos = _read_str(buf, pos)
+        if mask & _HAS_EXTRA:
+            extra, pos = _unpack(buf, pos)
+            entity.update(extra)
+        entities.append(entity)
+    removed = list(struct.unpack_from(f'<{removed_count}I', buf, pos))
+    pos += 4 * removed_count
+    data = {'tick': tick, 'base': base or None, 'entities': entities, 'removed': removed}
+    extra, pos = _unpack(buf, pos)
+    data.update(extra)
+    return data
+
+_CHUNK_HEADER = struct.Struct('<iiHH')  # chunk x, chunk y, palette size, tile count
+_TILE = struct.Struct('<BBBh')           # x, y within the chunk, palette index, rotation in degrees
+
+def _encode_chunk(out: bytearray, data: dict) -> None:
+    """Tiles as 5 bytes each, with tile names written once per chunk.
+
+    Positions are stored relative to the chunk's corner (`size` tiles per side).
+    """
+    size = data['size']
+    origin_x, origin_y = data['x'] * size, data['y'] * size
+    palette = {}
+    for tile in data['tiles']:
+        palette.setdefault(tile['tile'], len(palette))
+    out += _CHUNK_HEADER.pack(data['x'], data['y'], len(palette), len(data['tiles']))
+    out.append(size)
+    for name in palette:
+        _write_str(out, name)
+    for tile in data['tiles']:
+        out += _TILE.pack(tile['x'] - origin_x, tile['y'] - origin_y, palette[tile['tile']], int(tile.get('rot', 0)))
+
+def _decode_chunk(buf, pos: int) -> dict:
+    chunk_x, chunk_y, palette_size, count = _CHUNK_HEADER.unpack_from(buf, pos)
+    pos += _CHUNK_HEADER.size
+    size = buf[pos]
+    pos += 1
+    palette = []
+    for _ in range(palette_size):
+        name, pos = _read_str(buf, pos)
+        palette.append(name)
+    origin_x, origin_y = chunk_x * size, chunk_y * size
+    tiles = []
+    for x, y, index, rot in _TILE.iter_unpack(bytes(buf[pos:pos + count * _TILE.size])):
+        tiles.append({'tile': palette[index], 'x': origin_x + x, 'y': origin_y + y, 'rot': rot})
+    return {'x': chunk_x, 'y': chunk_y, 'size': size, 'tiles': tiles}
+
+_PING = struct.Struct('<d')    # sender's clock
+_PONG = struct.Struct('<dd')   # echoed sender's clock, answerer's clock
+
+def _encode_ping(out: bytearray, data: dict) -> None:
+    out += _PING.pack(data['t'])
+
+def _decode_ping(buf, pos: int) -> dict:
+    return {'t': _PING.unpack_from(buf, pos)[0]}
+
+def _encode_pong(out: bytearray, data: dict) -> None:
+    out += _PONG.pack(data['t'], data['clock'])
+
+def _decode_pong(buf, pos: int) -> dict:
+    t, clock = _PONG.unpack_from(buf, pos)
+    return {'t': t, 'clock': clock}
+
+# Id 0 carries a whole message of any type with pack_value.
+register(0, None, None)
+register(1, 'update', 'player', _encode_position, _decode_position)
+register(2, 'response', 'snapshot', _encode_snapshot, _decode_snapshot)
+register(3, 'ack', 'snapshot', _encode_ack, _decode_ack)
+register(4, 'join', 'player')
+register(5, 'get', 'entities')
+register(6, 'response', 'joined')
+register(7, 'response', 'entities')
+register(8, 'response', 'map')
+register(9, 'get', 'chunks')
+register(10, 'response', 'chunk', _encode_chunk, _decode_chunk)
+register(11, 'ping', 'clock', _encode_ping, _decode_ping)  # see shared/clock.py
+register(12, 'pong', 'clock', _encode_pong, _decode_pong)
+
+# --- encoding / decoding -------------------------------------------------------------
+
+_JSON_START = ord('{')
+
+def encode_binary(message: dict) -> bytes:
+    """Encode a message as a binary payload."""
+    out = bytearray()
+    out.append(PROTOCOL_VERSION)
+    body = message.get('data')
+    entry = None
+    if isinstance(body, dict) and len(message) == 2 and body.keys() == {'type', 'data'}:
+        entry = _by_name.get((message['type'], body['type']))
+    if entry is None:
+        out.append(0)
+        _pack(out, message)
+    else:
+        msg_id, _, _, encoder, _ = entry
+        out.append(msg_id)
+        if encoder is None:
+            _pack(out, body['data'])
+        else:
+            encoder(out, body['data'])
+    return bytes(out)
+
+def decode_binary(payload) -> dict:
+    """Decode a binary payload."""
+    if len(payload) < 2:
+        raise ProtocolError("Truncated message")
+    if payload[0] != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {payload[0]}")
+    entry = _by_id.get(payload[1])
+    if entry is None:
+        raise ProtocolError(f"Unknown message id {payload[1]}")
+    msg_id, type_, subtype, _, decoder = entry
+    try:
+        if msg_id == 0:
+            return _unpack(payload, 2)[0]
+        data = decoder(payload, 2) if decoder else _unpack(payload, 2)[0]
+    except (struct.error, IndexError, UnicodeDecodeError, TypeError, RecursionError) as e:
+        # Truncated or corrupt body, an unhashable dict key or nesting too deep to unpack;
+        # surface it like any other malformed message
+        raise ProtocolError(f"Malformed message id {msg_id}: {e}") from e
+    return {'type': type_, 'data': {'type': subtype, 'data': data}}
+
+def encode_json(message: dict) -> bytes:
+    return json.dumps(message).encode()
+
+def encode_payload(message: dict, binary: bool) -> bytes:
+    """Encode a message without a frame header (e.g. for a datagram, see shared/datagram.py)."""
+    return encode_binary(message) if binary else encode_json(message)
+
+def encode(message: dict, binary: bool) -> bytes:
+    """Encode a message as a complete frame, ready to write to a socket."""
+    return encode_frame(encode_payload(message, binary))
+
+def decode(payload) -> dict:
+    """Decode one frame payload, JSON or binary."""
+    if not payload:
+        raise ProtocolError("Empty message")
+    if payload[0] == _JSON_START:
+        try:
+            return json.loads(bytes(payload))
+        except RecursionError as e:
+            raise ProtocolError(f"Malformed JSON message: {e}") from e
+    return decode_binary(payload)
+
+def wants_binary(message: dict) -> bool:
+    """True for a handshake message (`join` / `joined`) asking for / accepting the binary protocol."""
+    return message.get('protocol') == 'binary' and message.get('version') == PROTOCOL_VERSION
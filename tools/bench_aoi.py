@@ -0,0 +1,107 @@
+"""
+Tick cost and snapshot size with and without area-of-interest filtering.
+
+Drives the server's TickLoop directly (no sockets) with thousands of wandering entities
+and hundreds of joined clients, and reports per-tick time and the bytes each client
+would be sent per tick.
+
+Run from the repository root:
+    python tools/bench_aoi.py
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'server'))
+
+from shared.protocol import encode
+from update import data
+from update.grid import VIEW_RADIUS
+from update.snapshot import ClientView
+from update.tick import TickLoop
+from connection.logic import players, views
+
+WORLD_SIZE = 1024  # tiles per side
+MOVING = 0.2  # share of entities that move every tick
+WARMUP_TICKS = 5
+TICKS = 10
+# The unfiltered run is skipped above this many entity x client pairs; it takes seconds per tick.
+MAX_WHOLE_WORLD = 500_000
+
+class BenchServer:
+    """Stands in for the TCP server: encodes every snapshot and counts the bytes."""
+
+    running = True
+    shard = None
+    udp = None
+    metrics = None
+    moves = None
+    persistence = None
+    sessions = None
+    snapshot_budget = None
+
+    def __init__(self, view_radius):
+        self.view_radius = view_radius
+        self.bytes_sent = 0
+
+    def send_to_client(self, addr, message, reliable=True):
+        self.bytes_sent += len(encode(message, True))
+        # Acknowledge right away, as a client on a fast link would.
+        views[addr].ack(message['data']['data']['tick'])
+
+def reset():
+    data.entities.clear()
+    data._field_ticks.clear()
+    data._dirty.clear()
+    data.change_log.clear()
+    data.updates.clear()
+    data.grid.cells.clear()
+    data.grid.chunks.clear()
+    players.clear()
+    views.clear()
+
+def run(entity_count, client_count, view_radius):
+    reset()
+    rng = random.Random(1)
+    for _ in range(entity_count):
+        data.spawn_entity('npc', rng.uniform(0, WORLD_SIZE), rng.uniform(0, WORLD_SIZE))
+    for addr in range(client_count):
+        entity_id = data.spawn_entity('player', rng.uniform(0, WORLD_SIZE), rng.uniform(0, WORLD_SIZE))
+        players[addr] = entity_id
+        views[addr] = ClientView(entity_id)
+    server = BenchServer(view_radius)
+    ticker = TickLoop(server, report_interval=float('inf'))
+    ids = list(data.entities)
+    durations = []
+    for tick in range(WARMUP_TICKS + TICKS):
+        for entity_id in rng.sample(ids, int(len(ids) * MOVING)):
+            entity = data.entities[entity_id]
+            data.updates.append((entity_id, {
+                'x': min(WORLD_SIZE - 1, max(0.0, entity['x'] + rng.uniform(-2, 2))),
+                'y': min(WORLD_SIZE - 1, max(0.0, entity['y'] + rng.uniform(-2, 2))),
+            }))
+        if tick == WARMUP_TICKS:
+            server.bytes_sent = 0
+        start = time.perf_counter()
+        ticker.step()
+        if tick >= WARMUP_TICKS:
+            durations.append(time.perf_counter() - start)
+    return sum(durations) / len(durations) * 1000, server.bytes_sent / TICKS / client_count
+
+def main():
+    print(f"{WORLD_SIZE}x{WORLD_SIZE} tiles, {MOVING:.0%} of entities moving per tick, view radius {VIEW_RADIUS} chunks")
+    print(f"{'entities':>8} {'clients':>8} {'whole world ms':>15} {'B/client':>9} {'AoI ms':>8} {'B/client':>9}")
+    for entity_count, client_count in ((1000, 100), (5000, 100), (5000, 500), (20000, 500)):
+        if entity_count * client_count <= MAX_WHOLE_WORLD:
+            world_ms, world_bytes = run(entity_count, client_count, None)
+            world = f"{world_ms:>15.1f} {world_bytes:>9.0f}"
+        else:
+            world = f"{'-':>15} {'-':>9}"
+        aoi_ms, aoi_bytes = run(entity_count, client_count, VIEW_RADIUS)
+        print(f"{entity_count:>8} {client_count:>8} {world} {aoi_ms:>8.1f} {aoi_bytes:>9.0f}")
+
+if __name__ == "__main__":
+    main()
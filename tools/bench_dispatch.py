@@ -0,0 +1,88 @@
+"""
+Cost of dispatching one client message, the old way and through the handler registry.
+
+For each message kind a client sends, times per message:
+  - if-chain: the `if data['type'] == ...` chain packet_handler used to be, reading and
+    converting the same fields out of the raw dict,
+  - registry: what packet_handler does now: key_of(), one HANDLERS lookup and the message
+    class's compiled parse(), which also validates every field,
+  - parse: parse() on its own.
+
+Handlers do nothing here, so the numbers are dispatch and validation only.
+
+Run from the repository root:
+    python tools/bench_dispatch.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'server'))
+
+from connection.messages import key_of, Join, PlayerUpdate, SnapshotAck, GetEntities, GetChunks, Ping, Pong
+
+NUMBER = 200_000
+
+MESSAGES = {
+    'join': {'type': 'join', 'data': {'type': 'player', 'data': {'x': 10, 'y': 12}},
+             'protocol': 'binary', 'version': 4, 'compression': 'zlib', 'udp': True},
+    'update': {'type': 'update', 'data': {'type': 'player', 'data': {'x': 10.5, 'y': 12.25, 'seq': 812}}},
+    'ack': {'type': 'ack', 'data': {'type': 'snapshot', 'data': {'tick': 4021}}},
+    'ping': {'type': 'ping', 'data': {'type': 'clock', 'data': {'t': 1234.5}}},
+    'pong': {'type': 'pong', 'data': {'type': 'clock', 'data': {'t': 1234.5, 'clock': 99.25}}},
+    'get entities': {'type': 'get', 'data': {'type': 'entities', 'data': {}}},
+    'get chunks': {'type': 'get', 'data': {'type': 'chunks', 'data': {'chunks': [[0, 0], [0, 1], [1, 0], [1, 1]]}}},
+}
+
+def noop(*args):
+    pass
+
+def if_chain(data: dict):
+    if data['type'] == 'join':
+        position = data['data']['data']
+        noop((position.get('x', 0), position.get('y', 0)), data.get('handoff'), data.get('resume'),
+             data.get('compression'), data.get('udp'))
+    elif data['type'] == 'update':
+        if data['data']['type'] == 'player':
+            position = data['data']['data']
+            update = {'x': float(position['x']), 'y': float(position['y'])}
+            if 'seq' in position:
+                update['seq'] = int(position['seq'])
+            noop(update)
+    elif data['type'] == 'ack':
+        if data['data']['type'] == 'snapshot':
+            noop(int(data['data']['data']['tick']))
+    elif data['type'] == 'ping':
+        noop(float(data['data']['data']['t']))
+    elif data['type'] == 'pong':
+        noop(float(data['data']['data']['t']), float(data['data']['data']['clock']))
+    elif data['type'] == 'get':
+        if data['data']['type'] == 'entities':
+            noop()
+        elif data['data']['type'] == 'chunks':
+            noop([(int(cx), int(cy)) for cx, cy in data['data']['data']['chunks']])
+
+HANDLERS = {cls.key: (cls, noop) for cls in (Join, PlayerUpdate, SnapshotAck, GetEntities, GetChunks, Ping, Pong)}
+
+def registry(data: dict):
+    entry = HANDLERS.get(key_of(data))
+    if entry is None:
+        return
+    cls, handler = entry
+    handler(None, None, cls.parse(data))
+
+def per_message_ns(fn, message: dict) -> float:
+    return min(timeit.repeat(lambda: fn(message), number=NUMBER, repeat=3)) / NUMBER * 1e9
+
+def main():
+    print(f"ns per message, best of 3 x {NUMBER}")
+    print(f"{'message':>12}  {'if-chain':>9}  {'registry':>9}  {'parse':>9}")
+    for name, message in MESSAGES.items():
+        cls = HANDLERS[key_of(message)][0]
+        print(f"{name:>12}  {per_message_ns(if_chain, message):>9.0f}  {per_message_ns(registry, message):>9.0f}  "
+              f"{per_message_ns(cls.parse, message):>9.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Cost of world persistence: copying the store for a snapshot (done inside a tick), writing
+it (on the writer thread), the journal a stretch of ticks produces, and the restart time
+from snapshot plus journal.
+
+Run from the repository root:
+    python tools/bench_persistence.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'server'))
+
+from update import data
+from update.persist import Persistence
+
+WORLD_SIZE = 1024  # tiles per side
+JOURNAL_TICKS = 200  # ticks journaled after the snapshot, replayed at restart
+MOVING = 0.01  # share of entities that move every tick
+
+def reset():
+    data.entities.clear()
+    data._field_ticks.clear()
+    data._dirty.clear()
+    data._changed_cache.clear()
+    data.change_log.clear()
+    data.updates.clear()
+    data.grid.cells.clear()
+    data.grid.chunks.clear()
+    data.walls.clear_entities()
+
+def world_digest():
+    return round(sum(e['x'] + e['y'] for e in data.entities.values()), 3), len(data.entities)
+
+def run(entity_count, path):
+    reset()
+    rng = random.Random(1)
+    for _ in range(entity_count):
+        data.spawn_entity('npc', rng.uniform(0, WORLD_SIZE), rng.uniform(0, WORLD_SIZE))
+    data.end_tick()
+    store = Persistence(path, snapshot_interval=float('inf'))
+    store.start()
+    ids = list(data.entities)
+    record_ms = 0.0
+    for _ in range(JOURNAL_TICKS):
+        with data.lock:
+            for entity_id in rng.sample(ids, int(len(ids) * MOVING)):
+                entity = data.entities[entity_id]
+                data.update_entity(entity_id, x=entity['x'] + rng.uniform(-1, 1), y=entity['y'] + rng.uniform(-1, 1))
+            start = time.perf_counter()
+            store.record_tick(data.current_tick())
+            record_ms += time.perf_counter() - start
+            data.end_tick()
+    store.close(final_snapshot=False)
+    expected = world_digest()
+    stats = store.stats()
+    snapshot_bytes = os.path.getsize(path)
+
+    reset()
+    restored = Persistence(path)
+    restored.load()
+    if world_digest() != expected:
+        raise AssertionError(f"Restored world differs: {world_digest()} != {expected}")
+    return (stats['last_snapshot_ms'], stats['last_write_ms'], snapshot_bytes,
+            record_ms / JOURNAL_TICKS * 1e6, stats['journal_bytes'], restored.load_ms)
+
+def main():
+    print(f"{JOURNAL_TICKS} journaled ticks with {MOVING:.0%} of entities moving per tick")
+    print(f"{'entities':>8} {'copy ms':>8} {'write ms':>9} {'snapshot KB':>12} {'tick us':>8} {'journal KB':>11} {'restart ms':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for entity_count in (10_000, 100_000):
+            copy_ms, write_ms, snapshot_bytes, tick_us, journal_bytes, load_ms = run(entity_count, os.path.join(tmp, 'world'))
+            print(f"{entity_count:>8} {copy_ms:>8.1f} {write_ms:>9.1f} {snapshot_bytes / 1024:>12.0f} {tick_us:>8.0f} "
+                  f"{journal_bytes / 1024:>11.0f} {load_ms:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Encode/decode cost and size of the JSON and binary wire formats, the cost of
+reassembling a large frame from small socket reads, and what per-connection
+compression saves on a realistic message stream.
+
+Run from the repository root:
+    python tools/bench_protocol.py
+"""
+import json
+import sys
+import timeit
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from shared.framing import FrameCompressor, FrameDecoder, encode_frame
+from shared.mapchunks import CHUNK_SIZE
+from shared.protocol import encode, encode_json, encode_binary, decode_binary
+
+def snapshot(count, full=True):
+    if full:
+        entities = [{'id': i, 'proto': 'player', 'x': i * 0.5, 'y': i * 0.25, 'rot': 0.0} for i in range(count)]
+    else:
+        entities = [{'id': i, 'x': i * 0.5} for i in range(count)]
+    return {'type': 'response', 'data': {'type': 'snapshot', 'data': {
+        'tick': 1000, 'base': None if full else 990, 'entities': entities, 'removed': [],
+    }}}
+
+def samples():
+    with open(ROOT / 'assets' / 'content' / 'map.yml', encoding='utf-8') as f:
+        tile_map = yaml.safe_load(f)
+    return [
+        ('player position', {'type': 'update', 'data': {'type': 'player', 'data': {'x': 12.345, 'y': 6.789}}}),
+        ('snapshot ack', {'type': 'ack', 'data': {'type': 'snapshot', 'data': {'tick': 1000}}}),
+        ('full snapshot x100', snapshot(100)),
+        ('full snapshot x1000', snapshot(1000)),
+        ('delta snapshot x100', snapshot(100, full=False)),
+        ('map', {'type': 'response', 'data': {'type': 'map', 'data': tile_map}}),
+    ]
+
+def per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e6
+
+def main():
+    print(f"{'message':<22} {'json B':>8} {'bin B':>8} {'json enc':>9} {'bin enc':>9} {'json dec':>9} {'bin dec':>9}  (us/msg)")
+    for name, message in samples():
+        as_json = encode_json(message)
+        as_binary = encode_binary(message)  # payloads only; framing adds 4 bytes to both
+        assert decode_binary(as_binary)['data']['type'] == message['data']['type']
+        number = max(1, 20000 // max(1, len(as_json) // 100))
+        print(f"{name:<22} {len(as_json):>8} {len(as_binary):>8} "
+              f"{per_call_us(lambda: encode_json(message), number):>9.2f} "
+              f"{per_call_us(lambda: encode_binary(message), number):>9.2f} "
+              f"{per_call_us(lambda: json.loads(as_json), number):>9.2f} "
+              f"{per_call_us(lambda: decode_binary(as_binary), number):>9.2f}")
+
+def reassemble_framed(stream: bytes, read_size: int) -> int:
+    decoder = FrameDecoder()
+    frames = 0
+    for pos in range(0, len(stream), read_size):
+        chunk = stream[pos:pos + read_size]
+        decoder.writable(len(chunk))[:len(chunk)] = chunk
+        decoder.commit(len(chunk))
+        frames += sum(1 for _ in decoder.frames())
+    return frames
+
+def reassemble_concat(stream: bytes, read_size: int) -> int:
+    """The old approach: grow a bytes object and split it."""
+    buffer = b''
+    frames = 0
+    for pos in range(0, len(stream), read_size):
+        buffer += stream[pos:pos + read_size]
+        while len(buffer) >= 4:
+            size = int.from_bytes(buffer[:4], 'big')
+            if len(buffer) < 4 + size:
+                break
+            buffer = buffer[4 + size:]
+            frames += 1
+    return frames
+
+def bench_framing():
+    print()
+    print(f"{'payload':<10} {'read':>6} {'FrameDecoder ms':>16} {'bytes += ms':>12}")
+    for megabytes in (1, 4):
+        stream = encode_frame(b'x' * (megabytes * 1024 * 1024))
+        for read_size in (1460, 65536):
+            framed = min(timeit.repeat(lambda: reassemble_framed(stream, read_size), number=1, repeat=3))
+            concat = min(timeit.repeat(lambda: reassemble_concat(stream, read_size), number=1, repeat=1))
+            print(f"{megabytes:>7} MB {read_size:>6} {framed * 1000:>16.1f} {concat * 1000:>12.1f}")
+
+def session_stream(binary):
+    """What one client receives in its first ten seconds: 25 map chunks, then 200 snapshot deltas."""
+    frames = []
+    for cx in range(5):
+        for cy in range(5):
+            tiles = [{'tile': ('grass', 'sand', 'water', 'dirt')[(x * 7 + y * 3) % 4], 'x': cx * CHUNK_SIZE + x, 'y': cy * CHUNK_SIZE + y, 'rot': 0}
+                     for x in range(CHUNK_SIZE) for y in range(CHUNK_SIZE)]
+            frames.append(encode({'type': 'response', 'data': {'type': 'chunk', 'data': {'x': cx, 'y': cy, 'size': CHUNK_SIZE, 'tiles': tiles}}}, binary))
+    for tick in range(200):
+        entities = [{'id': i, 'x': i + tick * 0.05, 'y': i * 0.5} for i in range(40)]
+        frames.append(encode({'type': 'response', 'data': {'type': 'snapshot', 'data': {
+            'tick': 1000 + tick, 'base': 999 + tick, 'entities': entities, 'removed': []}}}, binary))
+    return frames
+
+def bench_compression():
+    print()
+    print(f"{'stream':<8} {'threshold':>9} {'raw KB':>8} {'wire KB':>8} {'saved':>6} {'CPU ms':>7} {'inflate ms':>10}")
+    for binary in (False, True):
+        frames = session_stream(binary)
+        raw = sum(len(frame) for frame in frames)
+        for threshold in (128, 512):
+            compressor = FrameCompressor(threshold)
+            wire = b''.join(compressor.compress(frame) for frame in frames)
+            decoder = FrameDecoder()
+            start = timeit.default_timer()
+            decoder.feed(wire)
+            assert sum(1 for _ in decoder.frames()) == len(frames)
+            inflate = timeit.default_timer() - start
+            print(f"{'binary' if binary else 'json':<8} {threshold:>9} {raw / 1024:>8.1f} {len(wire) / 1024:>8.1f} "
+                  f"{1 - len(wire) / raw:>6.0%} {compressor.cpu_seconds * 1000:>7.1f} {inflate * 1000:>10.1f}")
+
+if __name__ == "__main__":
+    main()
+    bench_framing()
+    bench_compression()
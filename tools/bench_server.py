@@ -0,0 +1,145 @@
+"""
+Compare the threaded and asyncio server modes.
+
+Starts `server/main.py` in a subprocess for each mode, then measures:
+  - how many idle connections it accepts (up to --connections),
+  - server memory per connected client (RSS delta, Linux only),
+  - request/response throughput with --active clients sending `get entities`.
+
+Run from the repository root:
+    python tools/bench_server.py --connections 2000 --active 50 --duration 5
+"""
+import argparse
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from shared.framing import HEADER
+from shared.protocol import encode
+
+GET_ENTITIES = encode({'type': 'get', 'data': {'type': 'entities', 'data': {}}}, binary=False)
+
+def raise_fd_limit():
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def read_proc_status(pid):
+    """Return (rss_kb, threads) for a process, or (None, None) where /proc is unavailable."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]), int(fields['Threads'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def start_server(mode, port):
+    proc = subprocess.Popen(
+        # No inbound rate limit: the throughput phase deliberately floods the server.
+        [sys.executable, 'main.py', '--mode', mode, '--host', '127.0.0.1', '--port', str(port), '--rate-limit', '0'],
+        cwd=ROOT / 'server', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+async def open_idle(port, count, batch=200):
+    conns = []
+    for start in range(0, count, batch):
+        results = await asyncio.gather(
+            *(asyncio.open_connection('127.0.0.1', port) for _ in range(min(batch, count - start))),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                return conns, result
+            conns.append(result)
+    return conns, None
+
+async def active_client(port, deadline):
+    # No join: joined clients also receive per-tick snapshots, which would skew the count.
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    done = 0
+    while time.perf_counter() < deadline:
+        writer.write(GET_ENTITIES)
+        size = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+        await reader.readexactly(size)
+        done += 1
+    writer.close()
+    return done
+
+async def bench_mode(mode, args):
+    port = free_port()
+    proc = start_server(mode, port)
+    try:
+        await asyncio.sleep(0.5)
+        base_rss, base_threads = read_proc_status(proc.pid)
+
+        conns, error = await open_idle(port, args.connections)
+        await asyncio.sleep(1.0)  # let the server finish accepting
+        rss, threads = read_proc_status(proc.pid)
+
+        deadline = time.perf_counter() + args.duration
+        counts = await asyncio.gather(*(active_client(port, deadline) for _ in range(args.active)))
+
+        for _, writer in conns:
+            writer.close()
+
+        per_client = None
+        if base_rss is not None and conns:
+            per_client = (rss - base_rss) / len(conns)
+        return {
+            'mode': mode,
+            'connections': len(conns),
+            'error': repr(error) if error else '',
+            'threads': threads,
+            'kb_per_client': per_client,
+            'msgs_per_sec': sum(counts) / args.duration,
+        }
+    finally:
+        proc.kill()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=2000, help="idle connections to open")
+    parser.add_argument('--active', type=int, default=50, help="clients in the throughput phase")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds of throughput phase")
+    parser.add_argument('--modes', nargs='+', default=['threaded', 'asyncio'])
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    results = [asyncio.run(bench_mode(mode, args)) for mode in args.modes]
+
+    print(f"{'mode':<10} {'conns':>7} {'threads':>8} {'KB/client':>10} {'msgs/s':>10}  error")
+    for r in results:
+        kb = f"{r['kb_per_client']:.1f}" if r['kb_per_client'] is not None else 'n/a'
+        threads = r['threads'] if r['threads'] is not None else 'n/a'
+        print(f"{r['mode']:<10} {r['connections']:>7} {threads:>8} {kb:>10} {r['msgs_per_sec']:>10.0f}  {r['error']}")
+
+if __name__ == "__main__":
+    main()
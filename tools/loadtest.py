@@ -0,0 +1,302 @@
+"""
+Headless load test: a swarm of simulated clients against a local server.
+
+Each bot speaks the same protocol as client/networking/main.py, without arcade: it joins
+(binary protocol, optionally compressed), sends numbered position updates at --send-rate
+following a movement pattern, acknowledges every snapshot, answers and sends pings and asks
+for `get entities` every --request-interval seconds. Reported at the end:
+
+  - join latency: connect + join until the `joined` reply,
+  - request round trip: `get entities` until its response,
+  - input echo: a position update until a snapshot reports it applied (includes the tick),
+  - ping: round trips of the once-a-second pings (shared/clock.py), and each bot's smoothed jitter,
+  - throughput in both directions, and errors by kind.
+
+By default a server is started on a free port (--mode picks which one); pass --port to
+test a server that is already running on this machine.
+
+Run from the repository root:
+    python tools/loadtest.py --bots 200 --duration 30 --pattern walk
+    python tools/loadtest.py --port 5555 --bots 50 --pattern circle --send-rate 10
+"""
+import argparse
+import asyncio
+import math
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, deque
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from shared.clock import LinkEstimator, ping_message, pong_message
+from shared.framing import FrameDecoder
+from shared.protocol import PROTOCOL_VERSION, decode, encode
+
+PATTERNS = ('idle', 'walk', 'circle', 'patrol')
+# Bot speed in tiles per second, about what a player holding one key moves
+SPEED = 5.0
+JOIN_TIMEOUT = 10.0
+
+class Stats:
+    """Measurements shared by every bot"""
+
+    def __init__(self):
+        self.join_ms = []
+        self.request_ms = []
+        self.input_ms = []
+        self.ping_ms = []
+        self.jitter_ms = []
+        self.errors = Counter()
+        self.joined = 0
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.snapshots = 0
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(mode, port, extra):
+    proc = subprocess.Popen(
+        [sys.executable, 'main.py', '--mode', mode, '--host', '127.0.0.1', '--port', str(port)] + extra,
+        cwd=ROOT / 'server', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+def percentiles(values) -> str:
+    if not values:
+        return "n/a"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return (f"p50 {pick(0.5):7.2f}  p90 {pick(0.9):7.2f}  p99 {pick(0.99):7.2f}  "
+            f"max {values[-1]:7.2f}  (n={len(values)})")
+
+class Bot:
+    def __init__(self, index: int, args, stats: Stats, rng: random.Random):
+        self.index = index
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.x = self.home_x = rng.uniform(0, args.area)
+        self.y = self.home_y = rng.uniform(0, args.area)
+        self.heading = rng.uniform(0, 2 * math.pi)
+        self.binary = False
+        self.seq = 0
+        self.sent_inputs = deque()    # (seq, time sent), oldest first
+        self.requests = deque()       # time each `get entities` was sent
+        self.link = LinkEstimator()
+        self.writer = None
+
+    def step(self, t: float, dt: float) -> bool:
+        """Move along the pattern; False if the position did not change."""
+        pattern = self.args.pattern
+        if pattern == 'idle':
+            return False
+        if pattern == 'walk':
+            if self.rng.random() < dt:  # new direction about once a second
+                self.heading = self.rng.uniform(0, 2 * math.pi)
+            self.x = min(self.args.area, max(0.0, self.x + math.cos(self.heading) * SPEED * dt))
+            self.y = min(self.args.area, max(0.0, self.y + math.sin(self.heading) * SPEED * dt))
+        elif pattern == 'circle':
+            angle = self.heading + t * SPEED / 3.0
+            self.x = self.home_x + 3.0 * math.cos(angle)
+            self.y = self.home_y + 3.0 * math.sin(angle)
+        elif pattern == 'patrol':
+            phase = (t * SPEED / 10.0 + self.heading) % 2.0
+            self.x = self.home_x + 10.0 * (phase if phase < 1.0 else 2.0 - phase)
+        return True
+
+    def send(self, message: dict, binary=None) -> None:
+        data = encode(message, self.binary if binary is None else binary)
+        self.writer.write(data)
+        self.stats.sent_messages += 1
+        self.stats.sent_bytes += len(data)
+
+    async def run(self, deadline: float) -> None:
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.args.host, self.args.port), JOIN_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            stats.errors['connect'] += 1
+            return
+        joined = asyncio.get_running_loop().create_future()
+        receiver = asyncio.get_running_loop().create_task(self.receive(reader, joined))
+        try:
+            join = {'type': 'join', 'data': {'type': 'player', 'data': {'x': self.x, 'y': self.y}},
+                    'protocol': 'binary', 'version': PROTOCOL_VERSION}
+            if self.args.compression:
+                join['compression'] = 'zlib'
+            self.send(join, binary=False)
+            try:
+                await asyncio.wait_for(asyncio.shield(joined), JOIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                stats.errors['join timeout'] += 1
+                return
+            if receiver.done():
+                return
+            stats.join_ms.append((time.perf_counter() - start) * 1000)
+            stats.joined += 1
+            await self.play(deadline, receiver)
+            if self.link.samples:
+                stats.jitter_ms.append(self.link.jitter * 1000)
+        finally:
+            receiver.cancel()
+            self.writer.close()
+
+    async def play(self, deadline: float, receiver: asyncio.Task) -> None:
+        interval = 1.0 / self.args.send_rate
+        started = last = time.perf_counter()
+        next_request = started + self.rng.uniform(0, self.args.request_interval)
+        last_send = 0.0
+        while time.perf_counter() < deadline and not receiver.done():
+            now = time.perf_counter()
+            moved = self.step(now - started, now - last)
+            last = now
+            if moved or now - last_send >= 1.0:  # heartbeat when idle, like SendScheduler
+                self.seq += 1
+                self.sent_inputs.append((self.seq, now))
+                self.send({'type': 'update', 'data': {'type': 'player', 'data': {'x': self.x, 'y': self.y, 'seq': self.seq}}})
+                last_send = now
+            if self.link.ping_due(now):
+                self.send(ping_message(now))
+            if self.args.request_interval and now >= next_request:
+                self.requests.append(now)
+                self.send({'type': 'get', 'data': {'type': 'entities', 'data': {}}})
+                next_request = now + self.args.request_interval
+            try:
+                await asyncio.wait_for(self.writer.drain(), interval)
+            except asyncio.TimeoutError:
+                self.stats.errors['send stalled'] += 1
+            except (ConnectionError, OSError):
+                self.stats.errors['disconnected'] += 1
+                return
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - now)))
+
+    async def receive(self, reader: asyncio.StreamReader, joined: asyncio.Future) -> None:
+        stats = self.stats
+        decoder = FrameDecoder(initial_size=65536)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    if time.perf_counter() < self.args.deadline:
+                        stats.errors['disconnected'] += 1
+                    return
+                stats.received_bytes += len(data)
+                decoder.feed(data)
+                for payload in decoder.frames():
+                    stats.received_messages += 1
+                    self.handle(decode(payload), joined)
+        except ValueError:
+            stats.errors['malformed'] += 1
+        except (ConnectionError, OSError):
+            stats.errors['disconnected'] += 1
+        finally:
+            if not joined.done():
+                joined.set_result(False)
+
+    def handle(self, message: dict, joined: asyncio.Future) -> None:
+        kind = message['data']['type']
+        now = time.perf_counter()
+        if message['type'] == 'ping':
+            self.send(pong_message(message['data']['data']['t']))
+        elif message['type'] == 'pong':
+            pong = message['data']['data']
+            self.stats.ping_ms.append(self.link.pong(pong['t'], pong['clock'], now) * 1000)
+        elif kind == 'joined':
+            self.binary = message.get('protocol') == 'binary'
+            if not joined.done():
+                joined.set_result(True)
+        elif kind == 'snapshot':
+            snapshot = message['data']['data']
+            self.stats.snapshots += 1
+            self.send({'type': 'ack', 'data': {'type': 'snapshot', 'data': {'tick': snapshot['tick']}}})
+            echo = snapshot.get('input')
+            if echo is not None:
+                sent = None
+                while self.sent_inputs and self.sent_inputs[0][0] <= echo[0]:
+                    sent = self.sent_inputs.popleft()
+                if sent is not None and sent[0] == echo[0]:
+                    self.stats.input_ms.append((now - sent[1]) * 1000)
+        elif kind == 'entities':
+            if self.requests:
+                self.stats.request_ms.append((now - self.requests.popleft()) * 1000)
+
+async def swarm(args) -> Stats:
+    stats = Stats()
+    rng = random.Random(args.seed)
+    args.deadline = time.perf_counter() + args.ramp + args.duration
+    tasks = []
+    for index in range(args.bots):
+        tasks.append(asyncio.get_running_loop().create_task(Bot(index, args, stats, random.Random(rng.random())).run(args.deadline)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / args.bots)
+    await asyncio.gather(*tasks)
+    return stats
+
+def report(args, stats: Stats, elapsed: float) -> None:
+    print(f"{args.bots} bots ({stats.joined} joined), pattern {args.pattern} @ {args.send_rate:g} Hz, "
+          f"{elapsed:.1f} s")
+    print(f"join latency ms     {percentiles(stats.join_ms)}")
+    print(f"request rtt ms      {percentiles(stats.request_ms)}")
+    print(f"input echo ms       {percentiles(stats.input_ms)}")
+    print(f"ping rtt ms         {percentiles(stats.ping_ms)}")
+    print(f"ping jitter ms      {percentiles(stats.jitter_ms)}")
+    print(f"sent      {stats.sent_messages / elapsed:9.0f} msgs/s {stats.sent_bytes / elapsed / 1024:9.1f} KB/s")
+    print(f"received  {stats.received_messages / elapsed:9.0f} msgs/s {stats.received_bytes / elapsed / 1024:9.1f} KB/s "
+          f"({stats.snapshots / elapsed:.0f} snapshots/s)")
+    errors = ', '.join(f"{kind} {count}" for kind, count in sorted(stats.errors.items())) or 'none'
+    print(f"errors    {errors}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bots', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds every bot plays after the ramp")
+    parser.add_argument('--ramp', type=float, default=2.0, help="seconds over which the bots join")
+    parser.add_argument('--pattern', choices=PATTERNS, default='walk')
+    parser.add_argument('--send-rate', type=float, default=20.0, help="position updates per second per bot")
+    parser.add_argument('--request-interval', type=float, default=2.0,
+                        help="seconds between `get entities` requests per bot, 0 disables")
+    parser.add_argument('--area', type=float, default=64.0, help="bots spawn and walk within this many tiles")
+    parser.add_argument('--no-compression', dest='compression', action='store_false')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=None, help="server already running here; default starts one")
+    parser.add_argument('--mode', choices=('threaded', 'asyncio'), default='threaded',
+                        help="server to start when --port is not given")
+    args, server_args = parser.parse_known_args()
+
+    proc = None
+    if args.port is None:
+        args.port = free_port()
+        # Bots send faster than the default inbound limit allows when --send-rate is high
+        proc = start_server(args.mode, args.port, ['--rate-limit', '0'] + server_args)
+    try:
+        start = time.perf_counter()
+        stats = asyncio.run(swarm(args))
+        report(args, stats, time.perf_counter() - start)
+    finally:
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+if __name__ == "__main__":
+    main()